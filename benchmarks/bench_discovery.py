@@ -0,0 +1,91 @@
+"""Benchmark Markdown discovery on a synthetic monorepo-shaped tree.
+
+Compares :func:`md_batch_gpt.file_io.iter_markdown_files` with the old
+``rglob`` + dot-path filter approach. Run from the repository root::
+
+    python -m benchmarks.bench_discovery --dirs 200 --files 20
+"""
+
+from __future__ import annotations
+
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import statistics
+import time
+
+from md_batch_gpt.file_io import iter_markdown_files
+
+
+def build_tree(root: Path, dirs: int, files: int, noise: int) -> int:
+    """Create docs plus ``.git``/``.venv``/``node_modules`` noise; return doc count."""
+    count = 0
+    for d in range(dirs):
+        docs = root / f"module{d:04d}"
+        docs.mkdir(parents=True)
+        for f in range(files):
+            (docs / f"lesson{f:03d}.md").write_text("# Lesson\n")
+            count += 1
+        for ignored in (".git/objects", ".venv/lib", "node_modules/pkg"):
+            junk = docs / ignored
+            junk.mkdir(parents=True)
+            for n in range(noise):
+                (junk / f"file{n:03d}.md").write_text("x")
+    return count
+
+
+def rglob_baseline(folder: Path):
+    for path in folder.rglob("*.md"):
+        relative_parts = path.relative_to(folder).parts
+        if any(part.startswith(".") for part in relative_parts):
+            continue
+        if "node_modules" in relative_parts:
+            continue
+        yield path
+
+
+def time_walk(walk, folder: Path, repeat: int) -> tuple[float, int]:
+    timings = []
+    found = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = sum(1 for _ in walk(folder))
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dirs", type=int, default=200)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--noise", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Append JSON results here")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        expected = build_tree(root, args.dirs, args.files, args.noise)
+        rglob_s, rglob_found = time_walk(rglob_baseline, root, args.repeat)
+        scandir = partial(iter_markdown_files, exclude=["node_modules"])
+        scandir_s, scandir_found = time_walk(scandir, root, args.repeat)
+
+    assert rglob_found == scandir_found == expected
+    result = {
+        "benchmark": "discovery",
+        "docs": expected,
+        "noise_files": args.dirs * 3 * args.noise,
+        "rglob_s": round(rglob_s, 4),
+        "scandir_s": round(scandir_s, 4),
+        "speedup": round(rglob_s / scandir_s, 2) if scandir_s else None,
+    }
+    print(json.dumps(result))
+    if args.output:
+        with args.output.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Load-test ``process_folder`` against the local fake OpenAI backend.
+
+Generates a corpus of Markdown files, runs every prompt over it through the
+real client code and reports throughput, tail latency and peak RSS. Run from
+the repository root::
+
+    python -m benchmarks.bench_load --files 100 1000 10000 --concurrency 32
+    python -m benchmarks.bench_load --files 1000 --async --p429 0.05 --rpm 3000
+    python -m benchmarks.bench_load --files 1000 --async --adaptive --rpm 600
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from md_batch_gpt.concurrency import AdaptiveConcurrency
+from md_batch_gpt.metrics import RunMetrics
+from md_batch_gpt.orchestrator import process_folder
+from md_batch_gpt.ratelimit import RateLimiter
+
+from .fake_backend import LATENCY_DISTRIBUTIONS, BackendConfig, FakeBackend, install
+
+
+def build_corpus(root: Path, files: int, file_chars: int) -> None:
+    """Write *files* Markdown files of about *file_chars* characters."""
+    section = "## Section\n\nLearning outcomes and activities for this lesson.\n\n"
+    body = (section * (file_chars // len(section) + 1))[:file_chars]
+    per_dir = 500
+    for i in range(files):
+        folder = root / f"module{i // per_dir:03d}"
+        folder.mkdir(exist_ok=True)
+        (folder / f"lesson{i:05d}.md").write_text(f"# Lesson {i}\n\n{body}")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_once(args: argparse.Namespace, files: int) -> dict:
+    backend = FakeBackend(
+        BackendConfig(
+            latency_ms=args.latency_ms,
+            latency_dist=args.latency_dist,
+            p429=args.p429,
+            p502=args.p502,
+            rpm=args.rpm,
+            response_chars=args.response_chars,
+            seed=args.seed,
+        )
+    )
+    with TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        corpus = root / "docs"
+        corpus.mkdir()
+        build_corpus(corpus, files, args.file_chars)
+        prompts = []
+        for i in range(args.prompts):
+            prompt = root / f"{i + 1:02d}_prompt.txt"
+            prompt.write_text(f"Prompt {i + 1}: summarise the lesson.")
+            prompts.append(prompt)
+        metrics = RunMetrics()
+        start = time.perf_counter()
+        with install(backend):
+            process_folder(
+                corpus,
+                prompts,
+                model="fake-model",
+                max_tokens=None,
+                regex_json=None,
+                dry_run=False,
+                verbose=False,
+                inplace=False,
+                log_file=root / "extracted.txt",
+                concurrency=args.concurrency,
+                use_async=args.use_async,
+                rate_limiter=RateLimiter(),
+                metrics=metrics,
+                # Every response has the same text, so deduplication or the
+                # cache would answer later passes depending on timing
+                cache=None,
+                dedupe=False,
+                adaptive=(
+                    AdaptiveConcurrency(args.concurrency) if args.adaptive else None
+                ),
+            )
+        elapsed = time.perf_counter() - start
+    summary = metrics.summary()
+    return {
+        "benchmark": "load",
+        "files": files,
+        "prompts": args.prompts,
+        "concurrency": args.concurrency,
+        "async": args.use_async,
+        "adaptive": args.adaptive,
+        "backend": {
+            "latency_ms": args.latency_ms,
+            "latency_dist": args.latency_dist,
+            "p429": args.p429,
+            "p502": args.p502,
+            "rpm": args.rpm,
+            "response_chars": args.response_chars,
+            **backend.stats(),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(files / elapsed, 2),
+        "requests_per_s": round(summary["requests"] / elapsed, 2),
+        "latency_p50_s": summary["latency_s"]["p50"],
+        "latency_p99_s": summary["latency_s"]["p99"],
+        "retries": summary["retries"],
+        "errors": summary["errors"],
+        "concurrency_limit": summary["concurrency"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[100])
+    parser.add_argument("--file-chars", type=int, default=4000)
+    parser.add_argument("--prompts", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument(
+        "--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal"
+    )
+    parser.add_argument("--p429", type=float, default=0.0)
+    parser.add_argument("--p502", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Backend RPM limit")
+    parser.add_argument("--response-chars", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", type=Path, help="Append JSON results here")
+    args = parser.parse_args()
+
+    # Each size runs in a fresh process so peak RSS is measured per size
+    context = multiprocessing.get_context("spawn")
+    for files in args.files:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_once, (args, files))
+        print(json.dumps(result))
+        if args.output:
+            with args.output.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark CLI cold-start latency.
+
+Times fresh interpreter runs of ``mdgpt --help``, a ``mdgpt run --dry-run`` over a
+small folder and a bare ``import md_batch_gpt.cli``, all without an API key.
+Run from the repository root::
+
+    python -m benchmarks.bench_startup --repeat 10
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROMPT = Path(__file__).resolve().parents[1] / "tests" / "data" / "p1.txt"
+
+
+def time_command(args: list[str], env: dict, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return {
+        "median_s": round(statistics.median(timings), 4),
+        "min_s": round(min(timings), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", type=Path, help="Append JSON results here")
+    args = parser.parse_args()
+
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    cli = [sys.executable, "-m", "md_batch_gpt.cli"]
+    with TemporaryDirectory() as tmp:
+        (Path(tmp) / "a.md").write_text("# A\n")
+        result = {
+            "benchmark": "startup",
+            "python": sys.version.split()[0],
+            "import": time_command(
+                [sys.executable, "-c", "import md_batch_gpt.cli"], env, args.repeat
+            ),
+            "help": time_command(cli + ["--help"], env, args.repeat),
+            "dry_run": time_command(
+                cli + ["run", tmp, "--dry-run", "--prompts", str(PROMPT)],
+                env,
+                args.repeat,
+            ),
+        }
+    print(json.dumps(result))
+    if args.output:
+        with args.output.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
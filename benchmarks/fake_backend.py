@@ -0,0 +1,193 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+The backend plugs into the real ``openai`` SDK through ``httpx.MockTransport``,
+so the client's pooling, retry and rate-limit code runs unchanged while no
+network traffic leaves the process. Latency, error rates, rate limits and
+response sizes are configurable::
+
+    backend = FakeBackend(BackendConfig(latency_ms=400, p429=0.02))
+    with install(backend):
+        process_folder(...)
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import Lock
+from typing import Iterator
+import asyncio
+import json
+import random
+import time
+
+import httpx
+import openai
+
+from md_batch_gpt import config, openai_client
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+@dataclass(frozen=True)
+class BackendConfig:
+    """How the fake backend behaves.
+
+    *latency_ms* is the mean response time; *latency_dist* picks its shape.
+    *p429* and *p502* are the chances a request fails with that status
+    before any rate limit is applied. *rpm* enforces a requests-per-minute
+    limit with ``Retry-After`` and ``x-ratelimit-*`` headers (0 disables it).
+    Responses carry *response_chars* characters of content.
+    """
+
+    latency_ms: float = 200.0
+    latency_dist: str = "lognormal"
+    p429: float = 0.0
+    p502: float = 0.0
+    rpm: int = 0
+    response_chars: int = 400
+    seed: int | None = None
+
+
+class FakeBackend:
+    """Thread-safe request handler with counters for what it served."""
+
+    def __init__(self, config: BackendConfig | None = None) -> None:
+        self.config = config or BackendConfig()
+        if self.config.latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"unknown latency distribution: {self.config.latency_dist}"
+            )
+        self._random = random.Random(self.config.seed)
+        self._lock = Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.requests = 0
+        self.status_counts: dict[int, int] = {}
+
+    def _latency(self) -> float:
+        mean = self.config.latency_ms / 1000
+        dist = self.config.latency_dist
+        with self._lock:
+            if dist == "fixed":
+                return mean
+            if dist == "uniform":
+                return self._random.uniform(0, 2 * mean)
+            if dist == "exponential":
+                return self._random.expovariate(1 / mean) if mean else 0.0
+            # Long right tail with the requested mean (sigma = 1)
+            return self._random.lognormvariate(0, 1) * mean / 1.6487
+
+    def _decide(self) -> tuple[int, dict[str, str]]:
+        """Return the status and rate-limit headers for the next request."""
+        cfg = self.config
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start, self._window_count = now, 0
+            reset = 60 - (now - self._window_start)
+            headers: dict[str, str] = {}
+            status = 200
+            if roll < cfg.p429:
+                status = 429
+                headers["retry-after-ms"] = "100"
+            elif roll < cfg.p429 + cfg.p502:
+                status = 502
+            elif cfg.rpm:
+                if self._window_count >= cfg.rpm:
+                    status = 429
+                    headers["retry-after-ms"] = str(int(reset * 1000))
+                else:
+                    self._window_count += 1
+                headers.update(
+                    {
+                        "x-ratelimit-limit-requests": str(cfg.rpm),
+                        "x-ratelimit-remaining-requests": str(
+                            max(0, cfg.rpm - self._window_count)
+                        ),
+                        "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                    }
+                )
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            return status, headers
+
+    def _respond(
+        self, request: httpx.Request, status: int, headers: dict
+    ) -> httpx.Response:
+        if status != 200:
+            error = {"error": {"message": f"fake {status}", "type": "fake_error"}}
+            return httpx.Response(status, json=error, headers=headers)
+        body = json.loads(request.content)
+        prompt_chars = sum(len(m.get("content") or "") for m in body["messages"])
+        content = ("lorem ipsum " * (self.config.response_chars // 12 + 1))[
+            : self.config.response_chars
+        ]
+        completion = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (prompt_chars + len(content)) // 4,
+            },
+        }
+        return httpx.Response(200, json=completion, headers=headers)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        status, headers = self._decide()
+        time.sleep(self._latency())
+        return self._respond(request, status, headers)
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        status, headers = self._decide()
+        await asyncio.sleep(self._latency())
+        return self._respond(request, status, headers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "status": {str(k): v for k, v in sorted(self.status_counts.items())},
+            }
+
+
+@contextmanager
+def install(backend: FakeBackend) -> Iterator[FakeBackend]:
+    """Route every ``md_batch_gpt`` request to *backend* inside the block."""
+    sync_client = openai.OpenAI(
+        api_key="fake",
+        http_client=httpx.Client(transport=httpx.MockTransport(backend.handle)),
+    )
+
+    def async_http_client(**kwargs) -> httpx.AsyncClient:
+        # Pool limits do not apply without sockets; keep the timeouts
+        return httpx.AsyncClient(
+            transport=httpx.MockTransport(backend.handle_async),
+            timeout=kwargs.get("timeout"),
+        )
+
+    saved_client = openai_client._client
+    saved_http_client = openai.DefaultAsyncHttpxClient
+    saved_key = config.OPENAI_API_KEY
+    openai_client._sdk()
+    openai_client._client = sync_client
+    openai.DefaultAsyncHttpxClient = async_http_client
+    config.OPENAI_API_KEY = "fake"
+    try:
+        yield backend
+    finally:
+        openai_client._client = saved_client
+        openai.DefaultAsyncHttpxClient = saved_http_client
+        config.OPENAI_API_KEY = saved_key
+        sync_client.close()
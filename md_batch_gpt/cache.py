@@ -0,0 +1,141 @@
+"""Content-addressed on-disk cache of model responses."""
+
+from __future__ import annotations
+
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import sqlite3
+import time
+
+
+def _digest(text: str) -> str:
+    return sha256(text.encode("utf-8")).hexdigest()
+
+
+def default_cache_path() -> Path:
+    """Return the cache location, honouring ``XDG_CACHE_HOME``."""
+    base = os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "md_batch_gpt" / "responses.sqlite3"
+
+
+class ResponseCache:
+    """SQLite-backed store of responses keyed by request inputs.
+
+    Entries older than *max_age* seconds are dropped on :meth:`evict`, which
+    then removes least recently used entries until the stored responses fit
+    in *max_bytes*.
+
+    The database is in WAL mode so readers do not block the writer, and a
+    statement that finds it locked by another process (e.g. queue workers
+    sharing a cache) retries for up to *busy_timeout* seconds. Methods are
+    safe to call from several threads, so callers on an event loop can run
+    them in an executor.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+        busy_timeout: float = 30.0,
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=busy_timeout, check_same_thread=False
+        )
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, content: str, max_tokens: int | None) -> str:
+        """Return the cache key for one request."""
+        parts = [model, _digest(prompt), _digest(content), max_tokens]
+        return _digest(json.dumps(parts))
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response for *key*, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or (
+                self.max_age is not None and now - row[1] > self.max_age
+            ):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        """Store *response* under *key*, replacing any previous entry."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, model, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """Apply the age and size limits and return the number of entries removed."""
+        with self._lock:
+            return self._evict()
+
+    def _evict(self) -> int:
+        removed = 0
+        if self.max_age is not None:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE created < ?",
+                (time.time() - self.max_age,),
+            )
+            removed += cur.rowcount
+        if self.max_bytes is not None:
+            (total,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if total > self.max_bytes:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall()
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+        self._conn.commit()
+        return removed
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,86 @@
+"""Split oversized Markdown at headings into token-bounded chunks."""
+
+from __future__ import annotations
+
+from typing import List
+import re
+
+from .ratelimit import CHARS_PER_TOKEN
+
+_HEADING = re.compile(r"#{1,6}(\s|$)")
+_FENCE = re.compile(r"(```|~~~)")
+
+MERGE_STRATEGIES = ("concat", "reduce")
+
+
+def split_sections(text: str) -> List[str]:
+    """Split *text* before every ATX heading outside fenced code blocks.
+
+    Joining the result gives back *text* unchanged.
+    """
+    sections: List[str] = []
+    current: List[str] = []
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        stripped = line.lstrip()
+        if _FENCE.match(stripped):
+            in_fence = not in_fence
+        elif not in_fence and _HEADING.match(stripped) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _split_oversized(section: str, max_chars: int) -> List[str]:
+    """Break a single section at blank lines, then hard-wrap what is left."""
+    pieces: List[str] = []
+    current = ""
+    for para in re.split(r"(?<=\n\n)", section):
+        while len(para) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(para[:max_chars])
+            para = para[max_chars:]
+        if current and len(current) + len(para) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += para
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_markdown(text: str, max_tokens: int) -> List[str]:
+    """Group heading sections of *text* into chunks of at most *max_tokens*.
+
+    Token counts are estimated from characters. Sections are never merged
+    across the limit; a section that alone exceeds it is split further.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return [text]
+    chunks: List[str] = []
+    current = ""
+    for section in split_sections(text):
+        if len(section) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_split_oversized(section, max_chars))
+            continue
+        if current and len(current) + len(section) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += section
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def concat_outputs(outputs: List[str]) -> str:
+    """Join chunk outputs in order, one blank line apart."""
+    return "\n\n".join(output.strip("\n") for output in outputs)
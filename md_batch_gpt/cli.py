@@ -5,7 +5,21 @@ from typing import List, Tuple
 
 import typer
 
-from .orchestrator import process_folder
+from .cache import ResponseCache, default_cache_path
+from .chunking import MERGE_STRATEGIES
+from .concurrency import AdaptiveConcurrency
+from .config import load_prices, load_routing, require_api_key
+from .estimate import Calibration, parse_prices
+from .file_io import iter_markdown_files
+from .jobqueue import JobQueue, new_worker_id
+from .log_io import merge_logs
+from .manifest import Manifest
+from .metrics import RunMetrics
+from .openai_client import HttpPoolConfig
+from .orchestrator import process_folder, process_queue
+from .plan import fanout_plan, load_plan
+from .ratelimit import RateLimiter
+from .routing import ModelRouter
 
 
 def validate_prompts(_: typer.Context, value: Tuple[Path, ...]) -> List[Path]:
@@ -16,6 +30,74 @@ def validate_prompts(_: typer.Context, value: Tuple[Path, ...]) -> List[Path]:
     return list(value)
 
 
+def parse_shard(value: str | None) -> Tuple[int, int] | None:
+    """Parse ``i/N`` (1-based) into a 0-based ``(index, count)`` pair."""
+    if value is None:
+        return None
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise typer.BadParameter("--shard must look like i/N, e.g. 2/8")
+    if not 1 <= index <= count:
+        raise typer.BadParameter("--shard i/N needs 1 <= i <= N")
+    return index - 1, count
+
+
+def prompts_or_default(prompts: List[Path]) -> List[Path]:
+    """Return *prompts*, or the bundled ``prompts/*.txt`` when none are given."""
+    if prompts:
+        return list(prompts)
+    default_dir = Path(__file__).parent.parent / "prompts"
+    prompt_paths = sorted(default_dir.glob("*.txt"))
+    if not prompt_paths:
+        raise typer.BadParameter(
+            f"No prompt files found in {default_dir}. "
+            "Pass --prompts explicitly or add *.txt files."
+        )
+    return prompt_paths
+
+
+def load_router(model: str, enabled: bool) -> ModelRouter | None:
+    """Return the router configured in pyproject.toml, with *model* as default."""
+    routing = load_routing() if enabled else None
+    if routing is None:
+        return None
+    try:
+        return ModelRouter.from_config(routing, model)
+    except (TypeError, ValueError) as exc:
+        typer.echo(f"Invalid [tool.md_batch_gpt.routing]: {exc}", err=True)
+        raise typer.Exit(code=1)
+
+
+def load_calibration(
+    stats_path: Path | None,
+    chars_per_token: float,
+    output_ratio: float | None,
+    latency: float | None,
+) -> Calibration:
+    """Return dry-run assumptions, learned from *stats_path* where not given."""
+    calibration = Calibration(chars_per_token=chars_per_token)
+    if stats_path is not None:
+        try:
+            calibration = Calibration.from_stats(stats_path, chars_per_token)
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            raise typer.BadParameter(f"--calibrate: {exc}")
+    return Calibration(
+        chars_per_token=chars_per_token,
+        output_ratio=calibration.output_ratio if output_ratio is None else output_ratio,
+        latency=calibration.latency if latency is None else latency,
+    )
+
+
+def load_price_table() -> dict:
+    """Return model prices, with pyproject.toml overrides applied."""
+    try:
+        return parse_prices(load_prices())
+    except (TypeError, ValueError) as exc:
+        typer.echo(f"Invalid [tool.md_batch_gpt.prices]: {exc}", err=True)
+        raise typer.Exit(code=1)
+
+
 app = typer.Typer()
 
 
@@ -29,6 +111,11 @@ def run(
         callback=validate_prompts,
     ),
     model: str = typer.Option("o3", "--model", help="OpenAI model to use"),
+    routing: bool = typer.Option(
+        True,
+        "--routing/--no-routing",
+        help="Pick models per request from [tool.md_batch_gpt.routing]",
+    ),
     max_tokens: int | None = typer.Option(
         None, "--max-tokens", help="Max tokens for completion"
     ),
@@ -58,18 +145,249 @@ def run(
         "--log-file",
         help="Path for extraction log",
     ),
+    concurrency: int = typer.Option(
+        1,
+        "--concurrency",
+        min=1,
+        help="Number of files processed at once",
+    ),
+    use_async: bool = typer.Option(
+        False,
+        "--async/--no-async",
+        help="Send requests through a pooled async client on one event loop",
+    ),
+    adaptive: bool = typer.Option(
+        False,
+        "--adaptive",
+        help="Adapt requests in flight between 1 and --concurrency (AIMD)",
+    ),
+    max_connections: int = typer.Option(
+        100, "--max-connections", min=1, help="HTTP connection pool size (async)"
+    ),
+    max_keepalive: int = typer.Option(
+        20, "--max-keepalive", min=0, help="Idle keep-alive connections kept (async)"
+    ),
+    keepalive_expiry: float = typer.Option(
+        30.0, "--keepalive-expiry", help="Seconds an idle connection is kept (async)"
+    ),
+    timeout: float = typer.Option(
+        600.0, "--timeout", help="Per-request timeout in seconds (async)"
+    ),
+    use_cache: bool = typer.Option(
+        True, "--cache/--no-cache", help="Reuse responses from the on-disk cache"
+    ),
+    refresh_cache: bool = typer.Option(
+        False,
+        "--refresh-cache",
+        help="Ignore cached responses but store fresh ones",
+    ),
+    cache_path: Path = typer.Option(
+        None,
+        "--cache-path",
+        dir_okay=False,
+        help="Response cache database (default: ~/.cache/md_batch_gpt)",
+    ),
+    cache_max_mb: float = typer.Option(
+        512.0, "--cache-max-mb", help="Evict least recently used entries above this"
+    ),
+    cache_max_age_days: float = typer.Option(
+        30.0, "--cache-max-age-days", help="Evict entries older than this"
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="Skip passes already recorded in the manifest next to the log file",
+    ),
+    batch: bool = typer.Option(
+        False,
+        "--batch",
+        help="Submit each prompt pass as an OpenAI Batch API job",
+    ),
+    batch_poll_interval: float = typer.Option(
+        30.0, "--batch-poll-interval", help="Seconds between batch status checks"
+    ),
+    rpm: float = typer.Option(
+        None,
+        "--rpm",
+        min=1,
+        help="Requests per minute budget (default: learned from API headers)",
+    ),
+    tpm: float = typer.Option(
+        None,
+        "--tpm",
+        min=1,
+        help="Tokens per minute budget (default: learned from API headers)",
+    ),
+    chunk_tokens: int = typer.Option(
+        None,
+        "--chunk-tokens",
+        min=1,
+        help="Split files larger than this many tokens at headings",
+    ),
+    merge: str = typer.Option(
+        "concat",
+        "--merge",
+        help=f"How chunk outputs are combined: {', '.join(MERGE_STRATEGIES)}",
+    ),
+    reduce_prompt: Path = typer.Option(
+        None,
+        "--reduce-prompt",
+        exists=True,
+        dir_okay=False,
+        help="Prompt that combines chunk outputs when --merge reduce",
+    ),
+    log_flush_every: int = typer.Option(
+        1,
+        "--log-flush-every",
+        min=0,
+        help="Flush the log every N records (0: only by time or at exit)",
+    ),
+    log_flush_ms: float = typer.Option(
+        None, "--log-flush-ms", min=1, help="Also flush the log every T milliseconds"
+    ),
+    log_fsync: bool = typer.Option(
+        False, "--log-fsync", help="fsync the log file on every flush"
+    ),
+    log_index: bool = typer.Option(
+        True,
+        "--log-index/--no-log-index",
+        help="Keep a byte-offset index next to the log file",
+    ),
+    include: List[str] = typer.Option(
+        [], "--include", help="Glob of files to process (default: *.md)"
+    ),
+    exclude: List[str] = typer.Option(
+        [], "--exclude", help="Glob of files or directories to skip"
+    ),
+    use_gitignore: bool = typer.Option(
+        False,
+        "--gitignore/--no-gitignore",
+        help="Skip paths ignored by .gitignore files",
+    ),
+    prefetch_mb: float = typer.Option(
+        64.0,
+        "--prefetch-mb",
+        min=0,
+        help="Megabytes of upcoming files read ahead in the background",
+    ),
+    shard: str | None = typer.Option(
+        None,
+        "--shard",
+        help="Process only slice i of N (e.g. 2/8), split by a hash of the path",
+    ),
+    dedupe: bool = typer.Option(
+        True,
+        "--dedupe/--no-dedupe",
+        help="Send identical file contents once and reuse the result",
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Write extraction records to the log as the output streams in",
+    ),
+    fanout: bool = typer.Option(
+        False,
+        "--fanout",
+        help="Run every prompt on the original content, all at once",
+    ),
+    plan_path: Path | None = typer.Option(
+        None,
+        "--plan",
+        exists=True,
+        dir_okay=False,
+        help="Prompt plan: one chain per line (a.txt -> b.txt), chains run at once",
+    ),
+    pack_tokens: int | None = typer.Option(
+        None,
+        "--pack-tokens",
+        min=1,
+        help="Send small files together, up to this many tokens per request",
+    ),
+    pack_file_tokens: int = typer.Option(
+        512,
+        "--pack-file-tokens",
+        min=1,
+        help="Largest file (in tokens) that --pack-tokens packs with others",
+    ),
+    stats: bool = typer.Option(
+        False,
+        "--stats",
+        help="Print latency, token and throughput statistics at the end",
+    ),
+    stats_json: Path | None = typer.Option(
+        None, "--stats-json", help="Write run statistics to this JSON file"
+    ),
+    stats_prom: Path | None = typer.Option(
+        None,
+        "--stats-prom",
+        help="Write run statistics as a Prometheus textfile",
+    ),
+    estimate_json: Path | None = typer.Option(
+        None,
+        "--estimate-json",
+        help="With --dry-run, write the token, cost and time estimate as JSON",
+    ),
+    calibrate: Path | None = typer.Option(
+        None,
+        "--calibrate",
+        exists=True,
+        dir_okay=False,
+        help="Learn output size and latency for --dry-run from a --stats-json file",
+    ),
+    chars_per_token: float = typer.Option(
+        4.0,
+        "--chars-per-token",
+        min=0.1,
+        help="Characters per token when estimating with --dry-run",
+    ),
+    output_ratio: float | None = typer.Option(
+        None,
+        "--output-ratio",
+        min=0,
+        help="Output tokens per input token for --dry-run (default 0.25)",
+    ),
+    request_latency: float | None = typer.Option(
+        None,
+        "--request-latency",
+        min=0,
+        help="Seconds per request for the --dry-run wall clock (default 10)",
+    ),
 ) -> None:
     """Run the batch processor on *folder* using *prompts*."""
-    prompt_list = list(prompts)
-    if len(prompt_list) == 0:
-        default_dir = Path(__file__).parent.parent / "prompts"
-        prompt_paths = sorted(default_dir.glob("*.txt"))
-        if not prompt_paths:
+    prompt_list = prompts_or_default(prompts)
+    if estimate_json is not None and not dry_run:
+        raise typer.BadParameter("--estimate-json requires --dry-run")
+
+    if merge not in MERGE_STRATEGIES:
+        raise typer.BadParameter(
+            f"--merge must be one of: {', '.join(MERGE_STRATEGIES)}"
+        )
+    if merge == "reduce" and reduce_prompt is None:
+        raise typer.BadParameter("--merge reduce requires --reduce-prompt")
+    if chunk_tokens is not None and batch:
+        raise typer.BadParameter("--chunk-tokens cannot be combined with --batch")
+    if stream and batch:
+        raise typer.BadParameter("--stream cannot be combined with --batch")
+    if pack_tokens is not None and (batch or fanout or plan_path is not None):
+        raise typer.BadParameter(
+            "--pack-tokens cannot be combined with --batch, --fanout or --plan"
+        )
+    plan = None
+    if fanout or plan_path is not None:
+        if fanout and plan_path is not None:
+            raise typer.BadParameter("--fanout and --plan are mutually exclusive")
+        if inplace or batch:
             raise typer.BadParameter(
-                f"No prompt files found in {default_dir}. "
-                "Pass --prompts explicitly or add *.txt files."
+                "--fanout and --plan only apply to Extraction Mode without --batch"
             )
-        prompt_list = list(prompt_paths)
+        try:
+            plan = (
+                fanout_plan(len(prompt_list))
+                if fanout
+                else load_plan(plan_path, prompt_list)
+            )
+        except ValueError as exc:
+            raise typer.BadParameter(f"--plan: {exc}")
 
     if verbose:
         typer.echo(f"Folder: {folder}")
@@ -77,21 +395,318 @@ def run(
         typer.echo(f"Model: {model} Max tokens: {max_tokens}")
         if regex_json:
             typer.echo(f"Regex JSON: {regex_json}")
+    if not dry_run:
+        try:
+            require_api_key()
+        except RuntimeError as exc:
+            typer.echo(str(exc), err=True)
+            raise typer.Exit(code=1)
     resolved_log_file = Path.cwd() / log_file
-    process_folder(
-        folder,
-        prompt_list,
-        model=model,
-        max_tokens=max_tokens,
-        regex_json=regex_json,
-        dry_run=dry_run,
-        verbose=verbose,
-        inplace=inplace,
-        log_file=resolved_log_file,
-    )
+    cache = None
+    manifest = None
+    metrics = None
+    if (stats or stats_json or stats_prom) and not dry_run:
+        metrics = RunMetrics()
+    if not dry_run:
+        manifest = Manifest(Manifest.path_for(resolved_log_file))
+    if use_cache and not dry_run:
+        cache = ResponseCache(
+            cache_path or default_cache_path(),
+            max_bytes=int(cache_max_mb * 1024 * 1024),
+            max_age=cache_max_age_days * 86400,
+        )
+    try:
+        process_folder(
+            folder,
+            prompt_list,
+            model=model,
+            max_tokens=max_tokens,
+            regex_json=regex_json,
+            dry_run=dry_run,
+            verbose=verbose,
+            inplace=inplace,
+            log_file=resolved_log_file,
+            concurrency=concurrency,
+            use_async=use_async,
+            http_pool=HttpPoolConfig(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+                timeout=timeout,
+            ),
+            cache=cache,
+            refresh_cache=refresh_cache,
+            manifest=manifest,
+            resume=resume,
+            batch=batch,
+            batch_poll_interval=batch_poll_interval,
+            rate_limiter=RateLimiter(rpm=rpm, tpm=tpm),
+            chunk_tokens=chunk_tokens,
+            merge=merge,
+            reduce_prompt=reduce_prompt,
+            log_flush_every=log_flush_every or None,
+            log_flush_interval=log_flush_ms / 1000 if log_flush_ms else None,
+            log_fsync=log_fsync,
+            log_index=log_index,
+            include=list(include) or None,
+            exclude=list(exclude),
+            use_gitignore=use_gitignore,
+            prefetch_bytes=int(prefetch_mb * 1024 * 1024),
+            metrics=metrics,
+            dedupe=dedupe,
+            stream=stream,
+            shard=parse_shard(shard),
+            adaptive=AdaptiveConcurrency(concurrency) if adaptive else None,
+            router=None if dry_run else load_router(model, routing),
+            plan=plan,
+            pack_tokens=pack_tokens,
+            pack_file_tokens=pack_file_tokens,
+            calibration=(
+                load_calibration(
+                    calibrate, chars_per_token, output_ratio, request_latency
+                )
+                if dry_run
+                else None
+            ),
+            prices=load_price_table() if dry_run else None,
+            estimate_json=estimate_json,
+        )
+        if manifest is not None:
+            manifest.compact()
+    finally:
+        if metrics is not None:
+            if stats:
+                typer.echo(metrics.format_summary())
+            if stats_json:
+                metrics.write_json(stats_json)
+            if stats_prom:
+                metrics.write_prometheus(stats_prom)
+        if manifest is not None:
+            manifest.close()
+        if cache is not None:
+            cache.evict()
+            cache.close()
     if verbose:
         typer.echo("Done")
 
 
+@app.command()
+def merge(
+    logs: List[Path] = typer.Argument(
+        ..., exists=True, dir_okay=False, help="Per-shard or per-worker logs"
+    ),
+    output: Path = typer.Option(
+        ..., "--output", "-o", help="Merged log to write (replaced if it exists)"
+    ),
+) -> None:
+    """Merge per-shard or per-worker logs (and their indexes) into one log."""
+    resolved = output.resolve()
+    if any(log.resolve() == resolved for log in logs):
+        raise typer.BadParameter("--output must not be one of the input logs")
+    count = merge_logs(logs, output)
+    typer.echo(f"Merged {count} records from {len(logs)} logs into {output}")
+
+
+@app.command()
+def enqueue(
+    folder: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True),
+    queue_path: Path = typer.Option(
+        ..., "--queue", dir_okay=False, help="Job queue database (created if missing)"
+    ),
+    prompts: List[Path] = typer.Option(
+        [],
+        "--prompts",
+        help="Space-separated list of prompt files",
+        callback=validate_prompts,
+    ),
+    include: List[str] = typer.Option(
+        [], "--include", help="Glob of files to process (default: *.md)"
+    ),
+    exclude: List[str] = typer.Option(
+        [], "--exclude", help="Glob of files or directories to skip"
+    ),
+    use_gitignore: bool = typer.Option(
+        False,
+        "--gitignore/--no-gitignore",
+        help="Skip paths ignored by .gitignore files",
+    ),
+) -> None:
+    """Add a job per Markdown file in *folder* to the queue."""
+    prompt_list = prompts_or_default(prompts)
+    files = iter_markdown_files(
+        folder, list(include) or None, list(exclude), use_gitignore
+    )
+    queue = JobQueue(queue_path)
+    try:
+        added = queue.enqueue(files, prompt_list)
+        counts = queue.counts()
+    finally:
+        queue.close()
+    typer.echo(f"Enqueued {added} jobs ({counts['pending']} pending in {queue_path})")
+
+
+@app.command()
+def worker(
+    queue_path: Path = typer.Option(
+        ..., "--queue", exists=True, dir_okay=False, help="Job queue database"
+    ),
+    model: str = typer.Option("o3", "--model", help="OpenAI model to use"),
+    routing: bool = typer.Option(
+        True,
+        "--routing/--no-routing",
+        help="Pick models per request from [tool.md_batch_gpt.routing]",
+    ),
+    max_tokens: int | None = typer.Option(
+        None, "--max-tokens", help="Max tokens for completion"
+    ),
+    verbose: bool = typer.Option(
+        False, "--verbose", "-v", help="Enable verbose output"
+    ),
+    inplace: bool = typer.Option(
+        False,
+        "--inplace/--no-inplace",
+        help="Toggle rewrite vs extraction",
+    ),
+    log_file: Path | None = typer.Option(
+        None,
+        "--log-file",
+        help="Path for this worker's extraction log (default: extracted.<worker>.txt)",
+    ),
+    concurrency: int = typer.Option(
+        1,
+        "--concurrency",
+        min=1,
+        help="Number of jobs processed at once",
+    ),
+    use_async: bool = typer.Option(
+        False,
+        "--async/--no-async",
+        help="Send requests through a pooled async client on one event loop",
+    ),
+    adaptive: bool = typer.Option(
+        False,
+        "--adaptive",
+        help="Adapt requests in flight between 1 and --concurrency (AIMD)",
+    ),
+    use_cache: bool = typer.Option(
+        True, "--cache/--no-cache", help="Reuse responses from the on-disk cache"
+    ),
+    refresh_cache: bool = typer.Option(
+        False,
+        "--refresh-cache",
+        help="Ignore cached responses but store fresh ones",
+    ),
+    cache_path: Path = typer.Option(
+        None,
+        "--cache-path",
+        dir_okay=False,
+        help="Response cache database (default: ~/.cache/md_batch_gpt)",
+    ),
+    rpm: float = typer.Option(
+        None,
+        "--rpm",
+        min=1,
+        help="Requests per minute budget (default: learned from API headers)",
+    ),
+    tpm: float = typer.Option(
+        None,
+        "--tpm",
+        min=1,
+        help="Tokens per minute budget (default: learned from API headers)",
+    ),
+    log_fsync: bool = typer.Option(
+        False, "--log-fsync", help="fsync the log file on every flush"
+    ),
+    dedupe: bool = typer.Option(
+        True,
+        "--dedupe/--no-dedupe",
+        help="Send identical file contents once and reuse the result",
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Write extraction records to the log as the output streams in",
+    ),
+    lease_seconds: float = typer.Option(
+        300.0,
+        "--lease-seconds",
+        min=1,
+        help="How long a claimed job stays reserved without a heartbeat",
+    ),
+    max_attempts: int = typer.Option(
+        3, "--max-attempts", min=1, help="Mark a job failed after this many tries"
+    ),
+    wait: bool = typer.Option(
+        False,
+        "--wait",
+        help="Keep polling while other workers hold jobs, to take over stale ones",
+    ),
+    poll_interval: float = typer.Option(
+        5.0, "--poll-interval", help="Seconds between polls with --wait"
+    ),
+    worker_id: str | None = typer.Option(
+        None, "--worker-id", help="Name for this worker (default: host-pid-random)"
+    ),
+    stats: bool = typer.Option(
+        False,
+        "--stats",
+        help="Print latency, token and throughput statistics at the end",
+    ),
+) -> None:
+    """Claim jobs from the queue and process them until it is empty."""
+    try:
+        require_api_key()
+    except RuntimeError as exc:
+        typer.echo(str(exc), err=True)
+        raise typer.Exit(code=1)
+    # Workers must not share a log: each keeps its own handle and index
+    worker_id = worker_id or new_worker_id()
+    resolved_log_file = Path.cwd() / (log_file or f"extracted.{worker_id}.txt")
+    metrics = RunMetrics() if stats else None
+    manifest = Manifest(Manifest.path_for(resolved_log_file))
+    cache = None
+    if use_cache:
+        cache = ResponseCache(cache_path or default_cache_path())
+    queue = JobQueue(queue_path, lease=lease_seconds)
+    try:
+        completed = process_queue(
+            queue,
+            model=model,
+            max_tokens=max_tokens,
+            verbose=verbose,
+            inplace=inplace,
+            log_file=resolved_log_file,
+            concurrency=concurrency,
+            use_async=use_async,
+            cache=cache,
+            refresh_cache=refresh_cache,
+            manifest=manifest,
+            rate_limiter=RateLimiter(rpm=rpm, tpm=tpm),
+            log_fsync=log_fsync,
+            metrics=metrics,
+            dedupe=dedupe,
+            stream=stream,
+            worker_id=worker_id,
+            wait=wait,
+            poll_interval=poll_interval,
+            max_attempts=max_attempts,
+            adaptive=AdaptiveConcurrency(concurrency) if adaptive else None,
+            router=load_router(model, routing),
+        )
+        manifest.compact()
+        counts = queue.counts()
+    finally:
+        if metrics is not None:
+            typer.echo(metrics.format_summary())
+        manifest.close()
+        if cache is not None:
+            cache.close()
+        queue.close()
+    typer.echo(
+        f"Completed {completed} jobs; queue: "
+        + ", ".join(f"{count} {status}" for status, count in counts.items())
+    )
+
+
 if __name__ == "__main__":  # pragma: no cover
     app()
@@ -0,0 +1,182 @@
+"""Adaptive limit on the number of requests in flight."""
+
+from __future__ import annotations
+
+from collections import deque
+from threading import Event, Lock
+from typing import Callable, Deque
+import asyncio
+import math
+import time
+
+# Weight of the newest sample in the smoothed latency
+_LATENCY_ALPHA = 0.2
+
+
+class _Waiter:
+    """A caller blocked in :meth:`AdaptiveConcurrency.acquire`."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = Event()
+        else:
+            self._future = loop.create_future()
+
+    def grant(self) -> None:
+        self.granted = True
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self) -> None:
+        self._event.wait()
+
+    async def wait_async(self) -> None:
+        await self._future
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight requests, shared by every worker of a run.
+
+    Callers take a slot with :meth:`acquire` (or ``await``
+    :meth:`acquire_async`) before each request attempt and hand it back
+    with :meth:`release`. Healthy attempts raise the limit: by one per
+    success until the first congestion signal (slow start), then by about
+    one per limit's worth of successes. A 429/502 response, or a smoothed
+    latency above *latency_factor* times the lowest seen so far, cuts the
+    limit by *backoff*. Attempts already in flight when the limit was cut
+    do not cut it again, so one burst of errors counts once.
+
+    The limit stays between *min_limit* and *max_limit*. *on_change* is
+    called with the new limit whenever its integer value changes.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: int | None = None,
+        backoff: float = 0.5,
+        latency_factor: float | None = 3.0,
+        on_change: Callable[[int], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("need 1 <= min_limit <= max_limit")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.on_change = on_change
+        self._clock = clock
+        self._lock = Lock()
+        self._limit = float(min(max(initial or min_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._slow_start = True
+        self._last_decrease = -math.inf
+        self._latency: float | None = None
+        self._latency_floor: float | None = None
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _take(self, waiter: _Waiter | None = None) -> float | None:
+        """Take a free slot, or queue *waiter* for the next one."""
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return self._clock()
+        if waiter is not None:
+            self._waiters.append(waiter)
+        return None
+
+    def acquire(self) -> float:
+        """Block until a slot is free; return the token for :meth:`release`."""
+        waiter = _Waiter()
+        with self._lock:
+            start = self._take(waiter)
+        if start is not None:
+            return start
+        waiter.wait()
+        return self._clock()
+
+    async def acquire_async(self) -> float:
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            start = self._take(waiter)
+        if start is not None:
+            return start
+        try:
+            await waiter.wait_async()
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._in_flight -= 1
+                    self._wake()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+        return self._clock()
+
+    def release(
+        self, start: float, latency: float | None = None, congested: bool = False
+    ) -> None:
+        """Return the slot taken at *start* and report how the attempt went.
+
+        *congested* marks a 429/502; *latency* is the attempt's duration if
+        it succeeded. Pass neither for attempts that failed for other reasons.
+        """
+        with self._lock:
+            before = self.limit
+            self._in_flight -= 1
+            if congested:
+                self._decrease(start)
+            elif latency is not None:
+                self._observe(start, latency)
+            self._wake()
+            after = self.limit
+        if after != before and self.on_change is not None:
+            self.on_change(after)
+
+    def _observe(self, start: float, latency: float) -> None:
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += _LATENCY_ALPHA * (latency - self._latency)
+        if self._latency_floor is None or self._latency < self._latency_floor:
+            self._latency_floor = self._latency
+        if (
+            self.latency_factor is not None
+            and self._latency > self.latency_factor * self._latency_floor
+        ):
+            self._decrease(start)
+        elif self._slow_start:
+            self._limit = min(self.max_limit, self._limit + 1)
+        else:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def _decrease(self, start: float) -> None:
+        if start < self._last_decrease:
+            return
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        self._last_decrease = self._clock()
+        self._slow_start = False
+        self.decreases += 1
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            self._in_flight += 1
+            self._waiters.popleft().grant()
@@ -5,20 +5,36 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Checked only when a request is about to be sent, so --help and --dry-run
+# work without credentials
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY not found in environment or .env file")
 
 
-def _load_defaults() -> tuple[str, float]:
-    """Return (model, temperature) defaults from pyproject.toml."""
+def require_api_key() -> str:
+    """Return the OpenAI API key, raising if it is not configured."""
+    key = OPENAI_API_KEY or os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY not found in environment or .env file")
+    return key
+
+
+def _load_tool_config() -> dict:
+    """Return the ``[tool.md_batch_gpt]`` table of pyproject.toml, or {}."""
     pyproject = Path(__file__).resolve().parents[1] / "pyproject.toml"
     if not pyproject.exists():
-        return "o3", 0.2
+        return {}
     try:
         with pyproject.open("rb") as f:
             data = tomllib.load(f)
-        tool_cfg = data.get("tool", {}).get("md_batch_gpt", {})
+        return data.get("tool", {}).get("md_batch_gpt", {})
+    except Exception:
+        return {}
+
+
+def _load_defaults() -> tuple[str, float]:
+    """Return (model, temperature) defaults from pyproject.toml."""
+    tool_cfg = _load_tool_config()
+    try:
         model = tool_cfg.get("model", "o3")
         temperature = float(tool_cfg.get("temperature", 0.2))
         return model, temperature
@@ -26,4 +42,16 @@ def _load_defaults() -> tuple[str, float]:
         return "o3", 0.2
 
 
+def load_routing() -> dict | None:
+    """Return the ``[tool.md_batch_gpt.routing]`` table, if there is one."""
+    routing = _load_tool_config().get("routing")
+    return routing if isinstance(routing, dict) else None
+
+
+def load_prices() -> dict:
+    """Return the ``[tool.md_batch_gpt.prices]`` table, or {}."""
+    prices = _load_tool_config().get("prices")
+    return prices if isinstance(prices, dict) else {}
+
+
 DEFAULT_MODEL, DEFAULT_TEMPERATURE = _load_defaults()
@@ -0,0 +1,212 @@
+"""Offline token, cost and wall-clock estimates for a dry run."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Sequence, Tuple
+import json
+import math
+
+from .ratelimit import CHARS_PER_TOKEN
+
+# USD per million (input, output) tokens; [tool.md_batch_gpt.prices] adds to
+# and overrides these
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "o3": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+
+@dataclass(frozen=True)
+class Calibration:
+    """Assumptions behind an estimate.
+
+    *chars_per_token* converts text to tokens, *output_ratio* is completion
+    tokens per prompt token, and *latency* the seconds one request takes.
+    """
+
+    chars_per_token: float = CHARS_PER_TOKEN
+    output_ratio: float = 0.25
+    latency: float = 10.0
+
+    @classmethod
+    def from_stats(cls, path: Path, chars_per_token: float = CHARS_PER_TOKEN):
+        """Calibrate output size and latency from a ``--stats-json`` report.
+
+        Raises ValueError if the report has no requests to learn from.
+        """
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        latency = data.get("latency_s") or {}
+        tokens = data.get("tokens") or {}
+        if not latency.get("count") or not tokens.get("prompt"):
+            raise ValueError(f"{path} has no timed requests to calibrate from")
+        return cls(
+            chars_per_token=chars_per_token,
+            output_ratio=tokens.get("completion", 0) / tokens["prompt"],
+            latency=latency["sum"] / latency["count"],
+        )
+
+    def tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+
+def parse_prices(data: Mapping) -> Dict[str, Tuple[float, float]]:
+    """Return :data:`DEFAULT_PRICES` updated from a ``prices`` config table.
+
+    Each entry maps a model to ``{input = ..., output = ...}`` in USD per
+    million tokens. Raises ValueError if an entry is malformed.
+    """
+    prices = dict(DEFAULT_PRICES)
+    for model, entry in data.items():
+        if not isinstance(entry, Mapping) or set(entry) != {"input", "output"}:
+            raise ValueError(f"price for {model} needs exactly input and output")
+        prices[str(model)] = (float(entry["input"]), float(entry["output"]))
+    return prices
+
+
+class RunEstimate:
+    """Token counts a run would use, projected file by file.
+
+    *prompts* are ``(name, text)`` pairs and *chains* lists of prompt
+    indices run in order. The first pass of a chain reads the file; each
+    later one reads the previous pass's estimated output, which is
+    *output_ratio* times its input, capped at *max_tokens*.
+    """
+
+    def __init__(
+        self,
+        prompts: Sequence[Tuple[str, str]],
+        chains: Sequence[Sequence[int]],
+        calibration: Calibration,
+        max_tokens: int | None = None,
+    ) -> None:
+        self.calibration = calibration
+        self.max_tokens = max_tokens
+        self.names = [name for name, _ in prompts]
+        self._prompt_tokens = [calibration.tokens(text) for _, text in prompts]
+        self.chains = [list(chain) for chain in chains]
+        self.files: List[dict] = []
+
+    def add_file(self, path: Path, text: str) -> None:
+        passes: Dict[int, dict] = {}
+        for chain in self.chains:
+            content = self.calibration.tokens(text)
+            for idx in chain:
+                tokens_in = self._prompt_tokens[idx] + content
+                tokens_out = math.ceil(tokens_in * self.calibration.output_ratio)
+                if self.max_tokens is not None:
+                    tokens_out = min(tokens_out, self.max_tokens)
+                passes[idx] = {
+                    "prompt": self.names[idx],
+                    "input_tokens": tokens_in,
+                    "output_tokens": tokens_out,
+                }
+                content = tokens_out
+        self.files.append(
+            {"path": str(path), "passes": [passes[i] for i in sorted(passes)]}
+        )
+
+    def summary(
+        self,
+        model: str,
+        prices: Mapping[str, Tuple[float, float]],
+        concurrency: int = 1,
+        rpm: float | None = None,
+        tpm: float | None = None,
+    ) -> dict:
+        """Return totals, per-model cost and projected wall clock as a dict."""
+        prompts = {
+            name: {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+            for name in self.names
+        }
+        for entry in self.files:
+            for p in entry["passes"]:
+                totals = prompts[p["prompt"]]
+                totals["requests"] += 1
+                totals["input_tokens"] += p["input_tokens"]
+                totals["output_tokens"] += p["output_tokens"]
+        requests = sum(t["requests"] for t in prompts.values())
+        tokens_in = sum(t["input_tokens"] for t in prompts.values())
+        tokens_out = sum(t["output_tokens"] for t in prompts.values())
+        costs = {
+            name: (tokens_in * price_in + tokens_out * price_out) / 1e6
+            for name, (price_in, price_out) in prices.items()
+        }
+        costs.setdefault(model, None)
+        # A file's chains run side by side, each pass after the previous one
+        depth = max((len(chain) for chain in self.chains), default=0)
+        bounds = {
+            "concurrency": math.ceil(len(self.files) / max(1, concurrency))
+            * depth
+            * self.calibration.latency
+        }
+        if rpm:
+            bounds["rpm"] = requests / rpm * 60
+        if tpm:
+            bounds["tpm"] = (tokens_in + tokens_out) / tpm * 60
+        bound = max(bounds, key=bounds.get)
+        return {
+            "files": len(self.files),
+            "requests": requests,
+            "tokens": {"input": tokens_in, "output": tokens_out},
+            "prompts": prompts,
+            "model": model,
+            "cost_usd": costs,
+            "wall_clock_s": bounds[bound],
+            "bound_by": bound,
+            "assumptions": {
+                "chars_per_token": self.calibration.chars_per_token,
+                "output_ratio": self.calibration.output_ratio,
+                "latency_s": self.calibration.latency,
+                "concurrency": concurrency,
+                "rpm": rpm,
+                "tpm": tpm,
+                "max_tokens": self.max_tokens,
+            },
+            "per_file": self.files,
+        }
+
+
+def format_estimate(data: dict) -> str:
+    """Return the human-readable table for an estimate :meth:`summary`."""
+    width = max([len("Prompt"), len("Total")] + [len(n) for n in data["prompts"]])
+    row = f"{{:<{width}}}  {{:>8}}  {{:>12}}  {{:>13}}"
+    lines = [row.format("Prompt", "Requests", "Input tokens", "Output tokens")]
+    for name, t in data["prompts"].items():
+        lines.append(
+            row.format(name, t["requests"], t["input_tokens"], t["output_tokens"])
+        )
+    tokens = data["tokens"]
+    lines.append(
+        row.format("Total", data["requests"], tokens["input"], tokens["output"])
+    )
+    width = max(len("Model"), *(len(m) + 2 for m in data["cost_usd"]))
+    lines.append(f"{'Model':<{width}}  {'Cost (USD)':>10}")
+    costs = sorted(
+        data["cost_usd"].items(), key=lambda item: (item[0] != data["model"], item[0])
+    )
+    for name, cost in costs:
+        label = f"{name} *" if name == data["model"] else name
+        value = "-" if cost is None else f"{cost:.4f}"
+        lines.append(f"{label:<{width}}  {value:>10}")
+    assumed = data["assumptions"]
+    lines.append(
+        f"Wall clock: ~{_duration(data['wall_clock_s'])} at concurrency "
+        f"{assumed['concurrency']}, {assumed['latency_s']:.1f}s per request "
+        f"(bound by {data['bound_by']})"
+    )
+    return "\n".join(lines)
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
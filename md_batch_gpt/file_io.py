@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+from collections import deque
+from fnmatch import fnmatchcase
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from threading import Condition, Thread
+import hashlib
 import os
-from typing import Iterator
+from typing import Callable, Deque, Iterable, Iterator, List, Sequence, Tuple
 
 
 def read_text(path: Path) -> str:
@@ -12,15 +16,215 @@ def read_text(path: Path) -> str:
     return path.read_text(encoding="utf-8")
 
 
-def iter_markdown_files(folder: Path) -> Iterator[Path]:
-    """Yield paths to Markdown files under *folder* skipping dotfiles."""
+def _matches(rel: str, patterns: Sequence[str]) -> bool:
+    """Return True if *rel* or its final component matches any glob."""
+    name = rel.rsplit("/", 1)[-1]
+    return any(fnmatchcase(rel, p) or fnmatchcase(name, p) for p in patterns)
+
+
+class _GitIgnore:
+    """The subset of ``.gitignore`` rules needed to prune a docs tree.
+
+    Supports comments, ``!`` negation, trailing ``/`` for directories and
+    patterns anchored by a leading or inner ``/``. The last matching rule
+    wins, as in git.
+    """
+
+    def __init__(self) -> None:
+        # (directory the rule came from, pattern, negated, dirs only, anchored)
+        self.rules: List[Tuple[str, str, bool, bool, bool]] = []
+
+    def load(self, directory: str, path: Path) -> None:
+        try:
+            lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+        except OSError:
+            return
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            self.rules.append((directory, line.lstrip("/"), negate, dir_only, anchored))
+
+    def ignored(self, rel: str, is_dir: bool) -> bool:
+        result = False
+        for base, pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel.startswith(base + "/"):
+                    continue
+                sub = rel[len(base) + 1 :]
+            else:
+                sub = rel
+            if anchored:
+                hit = fnmatchcase(sub, pattern) or fnmatchcase(
+                    sub, pattern.replace("**/", "")
+                )
+            else:
+                hit = fnmatchcase(sub.rsplit("/", 1)[-1], pattern)
+            if hit:
+                result = not negate
+        return result
+
+
+def iter_markdown_files(
+    folder: Path,
+    include: Sequence[str] | None = None,
+    exclude: Sequence[str] | None = None,
+    use_gitignore: bool = False,
+) -> Iterator[Path]:
+    """Yield paths to Markdown files under *folder* skipping dotfiles.
+
+    The tree is walked with ``os.scandir`` in sorted order, and directories
+    that are hidden, excluded or, with *use_gitignore*, ignored by
+    ``.gitignore`` are pruned before they are entered. *include* globs
+    (default ``*.md``) select files; *exclude* globs drop files and
+    directories. Globs are matched against the path relative to *folder* and
+    against the bare name, and ``*`` also matches ``/``.
+    """
     folder = Path(folder)
-    for path in folder.rglob("*.md"):
-        # Skip any file or directory that starts with a dot
-        relative_parts = path.relative_to(folder).parts
-        if any(part.startswith(".") for part in relative_parts):
+    include = list(include or ["*.md"])
+    exclude = list(exclude or [])
+    gitignore = _GitIgnore() if use_gitignore else None
+    stack: List[Tuple[str, str]] = [(str(folder), "")]
+    while stack:
+        directory, rel_dir = stack.pop()
+        if gitignore is not None:
+            gitignore.load(rel_dir, Path(directory) / ".gitignore")
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
             continue
-        yield path
+        subdirs: List[Tuple[str, str]] = []
+        for entry in entries:
+            # Skip any file or directory that starts with a dot
+            if entry.name.startswith("."):
+                continue
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if _matches(rel, exclude):
+                continue
+            if gitignore is not None and gitignore.ignored(rel, is_dir):
+                continue
+            if is_dir:
+                subdirs.append((entry.path, rel))
+            elif _matches(rel, include) and entry.is_file():
+                yield Path(entry.path)
+        # Reverse so the stack pops subdirectories in sorted order
+        stack.extend(reversed(subdirs))
+
+
+def shard_of(rel_path: str, count: int) -> int:
+    """Return the 0-based shard of *count* that owns *rel_path*.
+
+    Based on a hash of the POSIX-style relative path, so every host that
+    walks the same tree agrees on the split.
+    """
+    digest = hashlib.sha1(rel_path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_shard(
+    paths: Iterable[Path], folder: Path, index: int, count: int
+) -> Iterator[Path]:
+    """Yield the *paths* under *folder* that belong to shard *index* of *count*."""
+    folder = Path(folder)
+    for path in paths:
+        if shard_of(path.relative_to(folder).as_posix(), count) == index:
+            yield path
+
+
+def walk_order_key(rel_path: str) -> Tuple[Tuple[int, str], ...]:
+    """Sort key that orders relative paths the way :func:`iter_markdown_files`
+    yields them: names sorted, and a directory's files before its subdirectories.
+    """
+    parts = rel_path.split("/")
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+class Prefetcher:
+    """Read files on a background thread ahead of their use.
+
+    Iterating yields ``(path, text)`` in the order of *paths*, decoded like
+    ``Path.read_text(encoding="utf-8", errors="replace")``. Reading stops
+    while *max_bytes* of file content is buffered and not yet taken; a
+    single file larger than that is still let through on its own.
+    Iteration is safe from several threads.
+    """
+
+    def __init__(self, paths: Iterable[Path], max_bytes: int = 64 * 1024**2) -> None:
+        self.max_bytes = max_bytes
+        self._paths = iter(paths)
+        self._buffer: Deque[Tuple[Path, str, int]] = deque()
+        self._buffered = 0
+        self._done = False
+        self._closed = False
+        self._error: BaseException | None = None
+        self._cond = Condition()
+        self._thread = Thread(target=self._fill, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _fill(self) -> None:
+        try:
+            for path in self._paths:
+                size = os.stat(path).st_size
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closed
+                        or not self._buffer
+                        or self._buffered + size <= self.max_bytes
+                    )
+                    if self._closed:
+                        return
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+                with self._cond:
+                    self._buffer.append((Path(path), text, size))
+                    self._buffered += size
+                    self._cond.notify_all()
+        except BaseException as exc:
+            with self._cond:
+                self._error = exc
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def __iter__(self) -> "Prefetcher":
+        return self
+
+    def __next__(self) -> Tuple[Path, str]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or self._done)
+            if self._buffer:
+                path, text, size = self._buffer.popleft()
+                self._buffered -= size
+                self._cond.notify_all()
+                return path, text
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+
+    def close(self) -> None:
+        """Stop reading ahead and drop anything buffered."""
+        with self._cond:
+            self._closed = True
+            self._buffer.clear()
+            self._buffered = 0
+            self._cond.notify_all()
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
 def write_atomic(path: Path, data: str) -> None:
@@ -35,3 +239,138 @@ def write_atomic(path: Path, data: str) -> None:
         os.fsync(tmp.fileno())
         tmp_name = tmp.name
     os.replace(tmp_name, path)
+
+
+def _fsync_dir(directory: Path) -> None:
+    """Make renames in *directory* durable, where the platform allows it."""
+    if os.name != "posix":
+        # Windows cannot open a directory for fsync
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupedWriter:
+    """Atomic file replacement with fsyncs shared across files.
+
+    :meth:`write` puts the new contents in a temporary file next to the
+    target and queues it. A background thread takes everything queued so
+    far, fsyncs each temporary file, renames each over its target and then
+    fsyncs each directory once, so files finishing close together share one
+    round of syncs. A target always holds either its old or its complete new
+    contents, as with :func:`write_atomic`; a write is durable once a later
+    :meth:`barrier` callback runs or :meth:`close` returns. A failed commit
+    is raised from the next :meth:`write` or from :meth:`close`.
+    """
+
+    def __init__(self) -> None:
+        self._cond = Condition()
+        # (temporary file, target) or (None, None) with a barrier callback
+        self._queue: List[Tuple[str | None, Path | None, Callable | None]] = []
+        self._closed = False
+        self._error: BaseException | None = None
+        self._thread: Thread | None = None
+        # Files replaced, fsync rounds used for them, and writes skipped
+        self.written = 0
+        self.groups = 0
+        self.unchanged = 0
+
+    def write(self, path: Path, data: str, current: str | None = None) -> bool:
+        """Queue replacing *path* with *data*.
+
+        Returns False without writing if *data* equals *current*, the
+        contents *path* is known to have.
+        """
+        if data == current:
+            with self._cond:
+                self.unchanged += 1
+            return False
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            "w", encoding="utf-8", dir=path.parent, delete=False
+        ) as tmp:
+            tmp.write(data)
+        try:
+            self._put((tmp.name, path, None))
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+        return True
+
+    def barrier(self, callback: Callable[[], None]) -> None:
+        """Run *callback* on the writer thread once every write queued so
+        far is durable."""
+        self._put((None, None, callback))
+
+    def _put(self, item: Tuple[str | None, Path | None, Callable | None]) -> None:
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise ValueError("write to a closed GroupedWriter")
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._commit_loop, name="inplace-writer", daemon=True
+                )
+                self._thread.start()
+            self._queue.append(item)
+            self._cond.notify()
+
+    def _commit_loop(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                group, self._queue = self._queue, []
+            try:
+                self._commit(group)
+            except BaseException as exc:
+                with self._cond:
+                    self._error = exc
+                    group += self._queue
+                    self._queue = []
+                for tmp, _, _ in group:
+                    if tmp is not None and os.path.exists(tmp):
+                        os.unlink(tmp)
+                return
+
+    def _commit(self, group: List[Tuple[str | None, Path | None, Callable]]) -> None:
+        files = [(tmp, path) for tmp, path, _ in group if tmp is not None]
+        for tmp, _ in files:
+            fd = os.open(tmp, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for tmp, path in files:
+            os.replace(tmp, path)
+        for directory in {path.parent for _, path in files}:
+            _fsync_dir(directory)
+        if files:
+            self.written += len(files)
+            self.groups += 1
+        for _, _, callback in group:
+            if callback is not None:
+                callback()
+
+    def close(self) -> None:
+        """Commit every queued write and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "GroupedWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,181 @@
+"""SQLite-backed queue of (file, prompt chain) jobs shared by worker processes."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Sequence
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job(NamedTuple):
+    id: int
+    file: Path
+    prompts: List[Path]
+    attempts: int
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class JobQueue:
+    """Jobs stored in one SQLite file that several processes can share.
+
+    A worker :meth:`claim` s a job by taking a lease on it for *lease*
+    seconds and keeps it with :meth:`heartbeat`. A job whose lease runs out
+    (its worker died or hung) can be claimed again by anyone. Claims run in
+    ``BEGIN IMMEDIATE`` transactions, so two workers never get the same job.
+
+    The database uses SQLite's rollback journal rather than WAL, which needs
+    shared memory and does not work on network filesystems. A statement
+    that finds the database locked by another worker retries for up to
+    *busy_timeout* seconds before raising. All methods are safe to call from
+    several threads.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        lease: float = 300.0,
+        clock=time.time,
+        busy_timeout: float = 60.0,
+    ) -> None:
+        self.path = Path(path)
+        self.lease = lease
+        self._clock = clock
+        self._lock = Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path,
+            timeout=busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " file TEXT NOT NULL,"
+            " prompts TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " worker TEXT,"
+            " lease_until REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " UNIQUE (file, prompts))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)"
+        )
+
+    def enqueue(self, files: Iterable[Path], prompts: Sequence[Path]) -> int:
+        """Add a job per file for the *prompts* chain; return how many were new.
+
+        Paths are stored resolved. A (file, chain) pair already in the queue
+        is left as it is, so enqueueing the same folder twice is harmless.
+        """
+        chain = json.dumps([str(Path(p).resolve()) for p in prompts])
+        rows = ((str(Path(f).resolve()), chain, PENDING) for f in files)
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (file, prompts, status)"
+                    " VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    def claim(self, worker: str) -> Job | None:
+        """Lease the oldest available job to *worker*, or return None."""
+        with self._lock:
+            now = self._clock()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, file, prompts, attempts FROM jobs"
+                    " WHERE status = ? OR (status = ? AND lease_until < ?)"
+                    " ORDER BY id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, lease_until = ?,"
+                        " attempts = attempts + 1 WHERE id = ?",
+                        (LEASED, worker, now + self.lease, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, file, prompts, attempts = row
+        return Job(
+            job_id, Path(file), [Path(p) for p in json.loads(prompts)], attempts + 1
+        )
+
+    def heartbeat(self, worker: str, job_ids: Iterable[int]) -> int:
+        """Extend *worker*'s leases on *job_ids*; return how many it still holds."""
+        ids = list(job_ids)
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_until = ?"
+                f" WHERE status = ? AND worker = ? AND id IN ({marks})",
+                (self._clock() + self.lease, LEASED, worker, *ids),
+            )
+            return cur.rowcount
+
+    def complete(self, worker: str, job_id: int) -> bool:
+        """Mark *job_id* done; False if *worker* no longer held its lease."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, error = NULL"
+                " WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, job_id, worker, LEASED),
+            )
+            return cur.rowcount == 1
+
+    def fail(self, worker: str, job_id: int, error: str, max_attempts: int) -> None:
+        """Release *job_id* after an error, giving up after *max_attempts*."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET"
+                " status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                " lease_until = NULL, error = ?"
+                " WHERE id = ? AND worker = ? AND status = ?",
+                (max_attempts, FAILED, PENDING, error, job_id, worker, LEASED),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of jobs in each status."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self) -> None:
+        self._conn.close()
@@ -1,19 +1,580 @@
+from __future__ import annotations
+
+from contextlib import nullcontext
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Thread
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Sequence
+import heapq
+import json
+import mmap
+import os
+import re
+import time
+import uuid
+
 import typer
 
+from .file_io import walk_order_key
 
-def append_log_record(log_path: Path, file_path: Path, prompt_path: Path, output: str):
-    try:
-        relative = file_path.relative_to(Path.cwd())
-    except ValueError:
-        relative = file_path.name
-    header = f"=== {relative} | prompt: {prompt_path.name} ===\n"
+_SEP = b"\n---\n"
+_HEADER = re.compile(rb"=== (.*) \| prompt: (.*?)(?: \| model: (.*))? ===\n")
+# A separator only ends a record when a header or the end of file follows
+_RECORD_END = re.compile(rb"\n---\n(?==== |\Z)")
+
+
+class LogRecord(NamedTuple):
+    path: str
+    prompt: str
+    output: str
+    offset: int
+    length: int
+    run: str | None = None
+    # Only recorded when model routing is active
+    model: str | None = None
+
+
+def index_path_for(log_path: Path) -> Path:
+    """Return the sidecar index location that belongs to *log_path*."""
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name + ".idx")
+
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def _record_path(file_path: Path, root: Path | None = None) -> str:
+    """Return the POSIX path a record for *file_path* is filed under.
+
+    Relative to *root*, the run's input folder, as :func:`select_shard`
+    hashes it; without one, or for a file outside it, relative to the
+    working directory, and otherwise absolute so that files with the same
+    name never share a path.
+    """
+    file_path = Path(file_path)
+    for base in (root, Path.cwd()):
+        if base is None:
+            continue
+        try:
+            return file_path.relative_to(base).as_posix()
+        except ValueError:
+            pass
+        try:
+            return file_path.resolve().relative_to(Path(base).resolve()).as_posix()
+        except ValueError:
+            pass
+    return file_path.resolve().as_posix()
+
+
+def _format_header(
+    file_path: Path,
+    prompt_path: Path,
+    model: str | None = None,
+    root: Path | None = None,
+) -> str:
+    suffix = f" | model: {model}" if model else ""
+    path = _record_path(file_path, root)
+    return f"=== {path} | prompt: {prompt_path.name}{suffix} ===\n"
+
+
+def format_record(
+    file_path: Path,
+    prompt_path: Path,
+    output: str,
+    model: str | None = None,
+    root: Path | None = None,
+) -> str:
+    """Return the text of one log record for *file_path* and *prompt_path*.
+
+    *model*, if given, is added to the header, and the path in it is
+    relative to *root* (see :func:`_record_path`).
+    """
     sep = "\n---\n"
+    header = _format_header(file_path, prompt_path, model, root)
+    return header + output.rstrip("\n") + "\n" + sep
+
+
+def _log_error(exc: OSError) -> typer.Exit:
+    typer.echo(f"Cannot write to log file: {exc}", err=True)
+    return typer.Exit(code=1)
+
+
+def append_log_record(
+    log_path: Path,
+    file_path: Path,
+    prompt_path: Path,
+    output: str,
+    root: Path | None = None,
+):
     try:
         with log_path.open("a", encoding="utf-8") as f:
-            f.write(header)
-            f.write(output.rstrip("\n") + "\n")
-            f.write(sep)
+            f.write(format_record(file_path, prompt_path, output, root=root))
+    except OSError as exc:
+        raise _log_error(exc)
+
+
+class _Barrier(NamedTuple):
+    callback: Callable[[], None]
+
+
+class LogStream:
+    """A log record whose output is written as it arrives.
+
+    Returned by :meth:`LogWriter.stream`. Text passed to :meth:`write` is
+    queued for the writer thread and :meth:`finish` completes the record.
+    Used as a context manager, an exception aborts the record and a normal
+    exit finishes it if that has not happened yet.
+
+    *model* is called for the model name to put in the header when the
+    first output (or the end of the record) reaches the writer, so it can
+    name a model chosen after the stream was opened.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        prompt_path: Path,
+        model: Callable[[], str | None] | None = None,
+        root: Path | None = None,
+    ) -> None:
+        self._file_path = file_path
+        self._prompt_path = prompt_path
+        self._model = model
+        self._root = root
+        self.key = (_record_path(file_path, root), prompt_path.name)
+        self.written = False
+        self._done = False
+        self._chunks: Queue = Queue()
+
+    def write(self, text: str) -> None:
+        """Append *text* to the record's output; safe from any thread."""
+        if text:
+            self.written = True
+            self._chunks.put(("chunk", text))
+
+    def header(self) -> bytes:
+        model = self._model() if self._model is not None else None
+        header = _format_header(self._file_path, self._prompt_path, model, self._root)
+        return header.encode("utf-8")
+
+    def finish(self, on_flushed: Callable[[], None] | None = None) -> None:
+        """End the record; *on_flushed* runs once it has been flushed."""
+        if not self._done:
+            self._done = True
+            self._chunks.put(("finish", on_flushed))
+
+    def abort(self) -> None:
+        """End the record early, marking it as incomplete in the log."""
+        if not self._done:
+            self._done = True
+            self._chunks.put(("abort", None))
+
+    def __enter__(self) -> "LogStream":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+
+
+class LogWriter:
+    """Append log records through one open handle and a single writer thread.
+
+    Records are queued by :meth:`write` and written whole, one ``write`` call
+    each, in the order they were queued. The handle is flushed every
+    *flush_every* records and/or every *flush_interval* seconds; with both
+    unset it is flushed only on :meth:`close`. With *fsync*, every flush is
+    followed by ``os.fsync``. A record's *on_flushed* callback runs on the
+    writer thread once the record has been flushed.
+
+    With *index*, the byte offset and length of every record are appended
+    to a sidecar index (see :func:`index_path_for`) together with the
+    record's path, prompt name and *run_id*. Paths in headers and the index
+    are relative to *root*, the run's input folder, when it is given.
+
+    :meth:`stream` opens a record whose output is written and flushed chunk
+    by chunk. Records are still written one at a time in queue order, so a
+    stream holds back the records queued after it until it finishes, and
+    the output of a stream waiting its turn is kept in memory meanwhile.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        log_path: Path,
+        flush_every: int | None = 1,
+        flush_interval: float | None = None,
+        fsync: bool = False,
+        index: bool = True,
+        run_id: str | None = None,
+        root: Path | None = None,
+    ) -> None:
+        self.log_path = Path(log_path)
+        self.root = Path(root) if root is not None else None
+        self.index = index
+        self.run_id = run_id or new_run_id()
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._fh: BinaryIO | None = None
+        self._index_fh: BinaryIO | None = None
+        self._queue: Queue = Queue()
+        self._thread: Thread | None = None
+        self._error: Exception | None = None
+
+    def _open(self) -> None:
+        try:
+            self._fh = self.log_path.open("ab")
+            if self.index:
+                self._index_fh = index_path_for(self.log_path).open("ab")
+        except OSError as exc:
+            raise _log_error(exc)
+        self._thread = Thread(target=self._drain, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _raise_error(self) -> None:
+        if isinstance(self._error, OSError):
+            raise _log_error(self._error)
+        raise self._error
+
+    def write(
+        self,
+        file_path: Path,
+        prompt_path: Path,
+        output: str,
+        on_flushed: Callable[[], None] | None = None,
+        model: str | None = None,
+    ) -> None:
+        """Queue one record for *file_path* / *prompt_path*."""
+        if self._error is not None:
+            self._raise_error()
+        if self._fh is None:
+            self._open()
+        record = format_record(file_path, prompt_path, output, model, self.root)
+        data = record.encode("utf-8")
+        key = (_record_path(file_path, self.root), prompt_path.name)
+        self._queue.put((data, key, on_flushed))
+
+    def stream(
+        self,
+        file_path: Path,
+        prompt_path: Path,
+        model: Callable[[], str | None] | None = None,
+    ) -> LogStream:
+        """Queue a record for *file_path* / *prompt_path* written as it arrives.
+
+        Every stream must be finished or aborted, or :meth:`close` will wait
+        for it forever.
+        """
+        if self._error is not None:
+            self._raise_error()
+        if self._fh is None:
+            self._open()
+        record = LogStream(file_path, prompt_path, model, self.root)
+        self._queue.put(record)
+        return record
+
+    def barrier(self, callback: Callable[[], None]) -> None:
+        """Run *callback* on the writer thread once every record queued so
+        far has been flushed."""
+        if self._error is not None:
+            self._raise_error()
+        if self._fh is None:
+            self._open()
+        self._queue.put(_Barrier(callback))
+
+    def _write_stream(self, record: LogStream):
+        """Write *record* as its chunks arrive; return (data length, callback).
+
+        Returns None if the record was aborted.
+        """
+        fh = self._fh
+        start = fh.tell()
+        header = False
+        # Trailing newlines are held back, as format_record strips them
+        held = b""
+        while True:
+            kind, payload = record._chunks.get()
+            if not header:
+                # Written once there is something to show, so the model
+                # that produced the output is known
+                fh.write(record.header())
+                header = True
+            if kind == "chunk":
+                data = payload.encode("utf-8")
+                body = data.rstrip(b"\n")
+                if body:
+                    fh.write(held + body)
+                    fh.flush()
+                    held = data[len(body) :]
+                else:
+                    held += data
+            elif kind == "finish":
+                fh.write(b"\n" + _SEP)
+                return fh.tell() - start, payload
+            else:
+                fh.write(b"\n[stream aborted]\n" + _SEP)
+                return None
+
+    def _flush(self, callbacks: List[Callable[[], None]]) -> None:
+        # Flush the log before the index so entries never point past the data
+        for fh in (self._fh, self._index_fh):
+            if fh is None:
+                continue
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        for callback in callbacks:
+            callback()
+        callbacks.clear()
+
+    def _drain(self) -> None:
+        unflushed = 0
+        callbacks: List[Callable[[], None]] = []
+        last_flush = time.monotonic()
+        timeout = self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                # Idle for flush_interval: push out whatever is buffered
+                item = None
+            try:
+                if item is self._STOP:
+                    self._flush(callbacks)
+                    return
+                written = None
+                if isinstance(item, _Barrier):
+                    if unflushed:
+                        callbacks.append(item.callback)
+                    else:
+                        item.callback()
+                elif isinstance(item, LogStream):
+                    offset = self._fh.tell()
+                    written = self._write_stream(item)
+                    if written is not None:
+                        written = (item.key, offset, *written)
+                elif item is not None:
+                    data, key, on_flushed = item
+                    offset = self._fh.tell()
+                    self._fh.write(data)
+                    written = (key, offset, len(data), on_flushed)
+                if written is not None:
+                    (path, prompt), offset, length, on_flushed = written
+                    if self._index_fh is not None:
+                        entry = {
+                            "path": path,
+                            "prompt": prompt,
+                            "run": self.run_id,
+                            "offset": offset,
+                            "length": length,
+                        }
+                        self._index_fh.write((json.dumps(entry) + "\n").encode())
+                    unflushed += 1
+                    if on_flushed is not None:
+                        callbacks.append(on_flushed)
+                due = self.flush_every is not None and unflushed >= self.flush_every
+                if (
+                    self.flush_interval is not None
+                    and unflushed
+                    and time.monotonic() - last_flush >= self.flush_interval
+                ):
+                    due = True
+                if due:
+                    self._flush(callbacks)
+                    unflushed = 0
+                    last_flush = time.monotonic()
+            except Exception as exc:
+                self._error = exc
+                return
+
+    def close(self) -> None:
+        """Write out every queued record, flush, and close the handle."""
+        if self._fh is None:
+            return
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self._fh.close()
+        self._fh = None
+        if self._index_fh is not None:
+            self._index_fh.close()
+            self._index_fh = None
+        if self._error is not None:
+            self._raise_error()
+
+    def __enter__(self) -> "LogWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _parse_record(data: bytes, offset: int, run: str | None = None) -> LogRecord:
+    match = _HEADER.match(data)
+    if match is None:
+        raise ValueError(f"No log record header at offset {offset}")
+    body = data[match.end() :]
+    if body.endswith(b"\n" + _SEP):
+        body = body[: -len(_SEP) - 1]
+    return LogRecord(
+        path=match.group(1).decode("utf-8"),
+        prompt=match.group(2).decode("utf-8"),
+        output=body.decode("utf-8", errors="replace"),
+        offset=offset,
+        length=len(data),
+        run=run,
+        model=match.group(3).decode("utf-8") if match.group(3) else None,
+    )
+
+
+class LogReader:
+    """Read records from an extraction log without loading it into memory.
+
+    The log is memory-mapped. :meth:`iter_records` streams every record in
+    file order; :meth:`find` uses the sidecar index to seek straight to the
+    records of one file.
+    """
+
+    def __init__(self, log_path: Path) -> None:
+        self.log_path = Path(log_path)
+        self.index_path = index_path_for(self.log_path)
+        self._fh = self.log_path.open("rb")
+        size = os.fstat(self._fh.fileno()).st_size
+        self._map = (
+            mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        )
+
+    def read_bytes(self, offset: int, length: int) -> bytes:
+        """Return the raw bytes of the record stored at *offset*."""
+        if self._map is None:
+            raise ValueError(f"No log record at offset {offset}")
+        return self._map[offset : offset + length]
+
+    def read_at(self, offset: int, length: int, run: str | None = None) -> LogRecord:
+        """Return the record stored at *offset*."""
+        if self._map is None:
+            raise ValueError(f"No log record at offset {offset}")
+        return _parse_record(self._map[offset : offset + length], offset, run)
+
+    def iter_records(self) -> Iterator[LogRecord]:
+        """Yield every record in file order."""
+        if self._map is None:
+            return
+        pos = 0
+        while pos < len(self._map):
+            match = _RECORD_END.search(self._map, pos)
+            end = match.end() if match else len(self._map)
+            yield _parse_record(self._map[pos:end], pos)
+            pos = end
+
+    def iter_index(self) -> Iterator[dict]:
+        """Yield the sidecar index entries, oldest first."""
+        if not self.index_path.exists():
+            return
+        with self.index_path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def find(
+        self, path: str, prompt: str | None = None, run: str | None = None
+    ) -> Iterator[LogRecord]:
+        """Yield the records for *path*, optionally for one *prompt* / *run*."""
+        for entry in self.iter_index():
+            if entry["path"] != path:
+                continue
+            if prompt is not None and entry["prompt"] != prompt:
+                continue
+            if run is not None and entry["run"] != run:
+                continue
+            yield self.read_at(entry["offset"], entry["length"], entry["run"])
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._fh.close()
+
+    def __enter__(self) -> "LogReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _merge_source(reader: LogReader) -> Iterator[tuple]:
+    """Yield (sort key, data, index entry) for every record of *reader*.
+
+    Index entries are matched to records by offset while both are read in
+    file order. Without an index every record gets a bare entry; with one,
+    records it does not list (aborted streams) get None.
+    """
+    has_index = reader.index_path.exists()
+    entries = reader.iter_index()
+    entry = next(entries, None)
+    for record in reader.iter_records():
+        while entry is not None and entry["offset"] < record.offset:
+            entry = next(entries, None)
+        if not has_index:
+            found = {"path": record.path, "prompt": record.prompt, "run": None}
+        elif entry is not None and entry["offset"] == record.offset:
+            found = entry
+        else:
+            found = None
+        data = reader.read_bytes(record.offset, record.length)
+        yield walk_order_key(record.path), data, found
+
+
+def merge_logs(log_paths: Sequence[Path], output: Path) -> int:
+    """Merge extraction logs into *output* and return the number of records.
+
+    Records are streamed from every input and interleaved in discovery order
+    by path, so per-shard logs of a sequential run combine into the log one
+    host would have written; records of the same path keep their order. If
+    any input has an index, a fresh index is written for *output* carrying
+    over each record's run id. Both files are replaced atomically.
+    """
+    output = Path(output)
+    readers = [LogReader(path) for path in log_paths]
+    write_index = any(reader.index_path.exists() for reader in readers)
+    tmp_log = output.with_name(output.name + ".tmp")
+    index_path = index_path_for(output)
+    tmp_index = index_path.with_name(index_path.name + ".tmp")
+    count = 0
+    try:
+        with (
+            tmp_log.open("wb") as out,
+            tmp_index.open("wb") if write_index else nullcontext() as index_out,
+        ):
+            sources = [_merge_source(reader) for reader in readers]
+            for _, data, entry in heapq.merge(*sources, key=lambda item: item[0]):
+                offset = out.tell()
+                out.write(data)
+                count += 1
+                if index_out is None or entry is None:
+                    continue
+                merged = {
+                    "path": entry["path"],
+                    "prompt": entry["prompt"],
+                    "run": entry["run"],
+                    "offset": offset,
+                    "length": len(data),
+                }
+                index_out.write((json.dumps(merged) + "\n").encode())
+        os.replace(tmp_log, output)
+        if write_index:
+            os.replace(tmp_index, index_path)
     except OSError as exc:
-        typer.echo(f"Cannot write to log file: {exc}", err=True)
-        raise typer.Exit(code=1)
+        raise _log_error(exc)
+    finally:
+        for reader in readers:
+            reader.close()
+        for tmp in (tmp_log, tmp_index):
+            tmp.unlink(missing_ok=True)
+    return count
@@ -0,0 +1,204 @@
+"""Completion manifest used to resume interrupted runs."""
+
+from __future__ import annotations
+
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Sequence, TextIO, Tuple
+import json
+import typer
+
+from .file_io import write_atomic
+
+
+def content_hash(text: str) -> str:
+    return sha256(text.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """Append-only JSON Lines record of finished prompt passes.
+
+    Each entry names the file, the pass index, the prompt hash and the
+    hashes of the text fed into and produced by that pass. Extraction
+    entries for non-final passes also keep the output text, which is the
+    input the next pass needs when a run is resumed, until :meth:`compact`
+    finds the next pass recorded.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._entries: Dict[str, List[dict]] = {}
+        for entry in self._read():
+            self._entries.setdefault(entry["file"], []).append(entry)
+        self._fh: TextIO | None = None
+        # Extraction entries are recorded from the log writer thread
+        self._lock = Lock()
+
+    def _read(self) -> List[dict]:
+        if not self.path.exists():
+            return []
+        entries = []
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+        return entries
+
+    @staticmethod
+    def path_for(log_file: Path) -> Path:
+        """Return the manifest location that belongs to *log_file*."""
+        log_file = Path(log_file)
+        return log_file.with_name(log_file.name + ".manifest")
+
+    @staticmethod
+    def file_key(md_file: Path) -> str:
+        return str(Path(md_file).resolve())
+
+    def record(
+        self,
+        md_file: Path,
+        pass_idx: int,
+        prompt: str,
+        input_text: str,
+        output_text: str,
+        keep_text: bool = False,
+    ) -> None:
+        """Append an entry for a finished pass and flush it to disk."""
+        entry = {
+            "file": self.file_key(md_file),
+            "pass": pass_idx,
+            "prompt": content_hash(prompt),
+            "input": content_hash(input_text),
+            "output": content_hash(output_text),
+        }
+        if keep_text:
+            entry["text"] = output_text
+        with self._lock:
+            if self._fh is None:
+                try:
+                    self._fh = self.path.open("a", encoding="utf-8")
+                except OSError as exc:
+                    typer.echo(f"Cannot write to manifest file: {exc}", err=True)
+                    raise typer.Exit(code=1)
+            self._fh.write(json.dumps(entry) + "\n")
+            self._fh.flush()
+            self._entries.setdefault(entry["file"], []).append(entry)
+
+    def _find(
+        self, md_file: Path, pass_idx: int, prompt: str, field: str, digest: str
+    ) -> dict | None:
+        prompt_digest = content_hash(prompt)
+        with self._lock:
+            entries = list(self._entries.get(self.file_key(md_file), []))
+        for entry in reversed(entries):
+            if (
+                entry["pass"] == pass_idx
+                and entry["prompt"] == prompt_digest
+                and entry[field] == digest
+            ):
+                return entry
+        return None
+
+    def resume_extraction(
+        self, md_file: Path, prompts: Sequence[str], source: str
+    ) -> Tuple[int, str]:
+        """Return (next pass, its input text) for an extraction chain."""
+        return self.resume_chain(md_file, list(enumerate(prompts)), source)
+
+    def resume_chain(
+        self, md_file: Path, passes: Sequence[Tuple[int, str]], source: str
+    ) -> Tuple[int, str]:
+        """Like :meth:`resume_extraction` for a chain of (pass index, prompt).
+
+        Returns the position in *passes* to continue at and its input text.
+        A pass whose kept text was compacted away is followed by hash as far
+        as later passes were recorded, and re-run if the chain stops there.
+        """
+        text: str | None = source
+        known = 0, source
+        digest = content_hash(source)
+        for pos, (idx, prompt) in enumerate(passes):
+            entry = self._find(md_file, idx, prompt, "input", digest)
+            if entry is None:
+                return (pos, text) if text is not None else known
+            if pos < len(passes) - 1:
+                text = entry.get("text")
+                if text is not None:
+                    known = pos + 1, text
+            digest = entry["output"]
+        return len(passes), known[1]
+
+    def resume_inplace(
+        self, md_file: Path, prompts: Sequence[str], current: str
+    ) -> int:
+        """Return the next pass to run given the file's *current* contents."""
+        digest = content_hash(current)
+        for idx in reversed(range(len(prompts))):
+            if self._find(md_file, idx, prompts[idx], "output", digest):
+                return idx + 1
+        for idx in reversed(range(len(prompts))):
+            if self._find(md_file, idx, prompts[idx], "input", digest):
+                return idx
+        return 0
+
+    def resume_kept(
+        self, md_file: Path, prompts: Sequence[str], start: int, text: str
+    ) -> Tuple[int, str]:
+        """Skip passes from *start* whose output the manifest kept.
+
+        In-place runs keep non-final outputs in memory and write the file
+        once, so after a crash the file can be behind the manifest. Returns
+        the next pass to run and its input text.
+        """
+        while start < len(prompts):
+            entry = self._find(
+                md_file, start, prompts[start], "input", content_hash(text)
+            )
+            if entry is None or "text" not in entry:
+                break
+            text = entry["text"]
+            start += 1
+        return start, text
+
+    def compact(self) -> None:
+        """Rewrite the manifest without what a resume no longer needs.
+
+        Only the latest entry per file, pass, prompt and input survives, and
+        kept text is dropped once another pass has recorded it as input, so
+        a finished run leaves only hashes behind.
+        """
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            latest: Dict[tuple, dict] = {}
+            # Re-read the file to keep entries appended by other writers
+            for entry in self._read():
+                key = entry["file"], entry["pass"], entry["prompt"], entry["input"]
+                latest.pop(key, None)
+                latest[key] = entry
+            if not latest:
+                return
+            # (file, input hash) -> passes that read it
+            readers: Dict[Tuple[str, str], set] = {}
+            for entry in latest.values():
+                key = entry["file"], entry["input"]
+                readers.setdefault(key, set()).add(entry["pass"])
+            self._entries = {}
+            for entry in latest.values():
+                read_by = readers.get((entry["file"], entry["output"]), set())
+                if read_by - {entry["pass"]}:
+                    entry.pop("text", None)
+                self._entries.setdefault(entry["file"], []).append(entry)
+            write_atomic(
+                self.path, "".join(json.dumps(e) + "\n" for e in latest.values())
+            )
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,311 @@
+"""Per-request and per-run metrics for a processing run."""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Mapping
+import json
+import math
+import time
+
+from .file_io import write_atomic
+
+# Upper bounds (seconds) of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_PROM_PREFIX = "mdgpt"
+
+
+@dataclass(frozen=True)
+class RequestRecord:
+    """One logical request, including any retries it needed."""
+
+    model: str
+    prompt: str
+    latency: float | None
+    prompt_tokens: int
+    completion_tokens: int
+    retries: int
+    error: str | None = None
+    # Time to first token, for streamed requests
+    ttft: float | None = None
+
+
+def percentile(values: List[float], pct: float) -> float | None:
+    """Return the nearest-rank *pct* percentile of *values*."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RunMetrics:
+    """Thread-safe collector for request and file metrics of one run.
+
+    Requests are grouped by prompt. The client only sees prompt text, so
+    :meth:`label_prompts` maps each text to the name shown in reports;
+    unlabelled prompts are reported as ``"other"``.
+    """
+
+    def __init__(self, clock=time.monotonic) -> None:
+        self._clock = clock
+        self._start = clock()
+        self._end: float | None = None
+        self._lock = Lock()
+        self._labels: Dict[str, str] = {}
+        self.requests: List[RequestRecord] = []
+        self.files = 0
+        self.deduplicated = 0
+        # Adaptive concurrency limit: current, lowest, highest, cuts
+        self.concurrency: Dict[str, int] | None = None
+
+    def label_prompts(self, labels: Mapping[str, str]) -> None:
+        """Name prompts by text, e.g. ``{prompt_text: "01_extract.txt"}``."""
+        self._labels.update(labels)
+
+    def record_request(
+        self,
+        model: str,
+        prompt: str,
+        latency: float | None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        retries: int = 0,
+        error: str | None = None,
+        ttft: float | None = None,
+    ) -> None:
+        """Record one request; *latency* is None when it was not timed."""
+        record = RequestRecord(
+            model=model,
+            prompt=self._labels.get(prompt, "other"),
+            latency=latency,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            retries=retries,
+            error=error,
+            ttft=ttft,
+        )
+        with self._lock:
+            self.requests.append(record)
+
+    def record_file(self) -> None:
+        with self._lock:
+            self.files += 1
+
+    def record_deduplicated(self) -> None:
+        """Count a pass answered from a duplicate input instead of a call."""
+        with self._lock:
+            self.deduplicated += 1
+
+    def record_concurrency(self, limit: int) -> None:
+        """Record the adaptive concurrency limit after it changed."""
+        with self._lock:
+            state = self.concurrency
+            if state is None:
+                self.concurrency = {
+                    "limit": limit,
+                    "min": limit,
+                    "max": limit,
+                    "decreases": 0,
+                }
+                return
+            if limit < state["limit"]:
+                state["decreases"] += 1
+            state["limit"] = limit
+            state["min"] = min(state["min"], limit)
+            state["max"] = max(state["max"], limit)
+
+    def finish(self) -> None:
+        """Stop the run clock used for throughput."""
+        self._end = self._clock()
+
+    @property
+    def elapsed(self) -> float:
+        end = self._end if self._end is not None else self._clock()
+        return end - self._start
+
+    def summary(self) -> dict:
+        """Return the run's metrics as a JSON-serialisable dict."""
+        with self._lock:
+            requests = list(self.requests)
+            files = self.files
+            deduplicated = self.deduplicated
+            concurrency = dict(self.concurrency) if self.concurrency else None
+        latencies = [r.latency for r in requests if r.latency is not None]
+        ttfts = [r.ttft for r in requests if r.ttft is not None]
+        prompts: Dict[str, dict] = {}
+        for r in requests:
+            entry = prompts.setdefault(
+                r.prompt, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            entry["requests"] += 1
+            entry["prompt_tokens"] += r.prompt_tokens
+            entry["completion_tokens"] += r.completion_tokens
+        elapsed = self.elapsed
+        return {
+            "requests": len(requests),
+            "retries": sum(r.retries for r in requests),
+            "errors": dict(Counter(r.error for r in requests if r.error)),
+            "models": dict(Counter(r.model for r in requests)),
+            "latency_s": _distribution(latencies),
+            "ttft_s": _distribution(ttfts),
+            "tokens": {
+                "prompt": sum(r.prompt_tokens for r in requests),
+                "completion": sum(r.completion_tokens for r in requests),
+            },
+            "prompts": prompts,
+            "files": files,
+            "deduplicated": deduplicated,
+            "concurrency": concurrency,
+            "elapsed_s": elapsed,
+            "files_per_min": files / elapsed * 60 if elapsed > 0 else None,
+        }
+
+    def format_summary(self) -> str:
+        """Return a short human-readable report."""
+        data = self.summary()
+        latency = data["latency_s"]
+
+        def seconds(value: float | None) -> str:
+            return "-" if value is None else f"{value:.3f}s"
+
+        lines = [
+            f"Requests: {data['requests']} "
+            f"({data['retries']} retries, {sum(data['errors'].values())} errors)",
+            "Latency p50/p95/p99: "
+            + " / ".join(seconds(latency[p]) for p in ("p50", "p95", "p99")),
+        ]
+        ttft = data["ttft_s"]
+        if ttft["count"]:
+            lines.append(
+                "Time to first token p50/p95/p99: "
+                + " / ".join(seconds(ttft[p]) for p in ("p50", "p95", "p99"))
+            )
+        for name, entry in sorted(data["prompts"].items()):
+            lines.append(
+                f"Tokens {name}: {entry['prompt_tokens']} prompt, "
+                f"{entry['completion_tokens']} completion "
+                f"({entry['requests']} requests)"
+            )
+        rate = data["files_per_min"]
+        lines.append(
+            f"Files: {data['files']} in {data['elapsed_s']:.1f}s"
+            + (f" ({rate:.1f} files/min)" if rate is not None else "")
+        )
+        if data["deduplicated"]:
+            lines.append(f"Deduplicated: {data['deduplicated']} calls saved")
+        concurrency = data["concurrency"]
+        if concurrency is not None:
+            lines.append(
+                f"Concurrency limit: {concurrency['limit']} "
+                f"(range {concurrency['min']}-{concurrency['max']}, "
+                f"{concurrency['decreases']} decreases)"
+            )
+        if data["errors"]:
+            errors = ", ".join(f"{k}={v}" for k, v in sorted(data["errors"].items()))
+            lines.append(f"Errors: {errors}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        data = self.summary()
+        with self._lock:
+            latencies = [r.latency for r in self.requests if r.latency is not None]
+            ttfts = [r.ttft for r in self.requests if r.ttft is not None]
+        p = _PROM_PREFIX
+        lines = _histogram(
+            f"{p}_request_duration_seconds",
+            "Request wall time including retries.",
+            latencies,
+        )
+        if ttfts:
+            lines += _histogram(
+                f"{p}_time_to_first_token_seconds",
+                "Time until a streamed request's first output.",
+                ttfts,
+            )
+        lines += [
+            f"# HELP {p}_requests_total Requests sent, by model.",
+            f"# TYPE {p}_requests_total counter",
+        ]
+        for model, count in sorted(data["models"].items()):
+            lines.append(f'{p}_requests_total{{model="{_escape(model)}"}} {count}')
+        lines += [
+            f"# HELP {p}_tokens_total Tokens used, by prompt and kind.",
+            f"# TYPE {p}_tokens_total counter",
+        ]
+        for name, entry in sorted(data["prompts"].items()):
+            for kind in ("prompt", "completion"):
+                lines.append(
+                    f'{p}_tokens_total{{prompt="{_escape(name)}",kind="{kind}"}} '
+                    f"{entry[kind + '_tokens']}"
+                )
+        lines += [
+            f"# HELP {p}_retries_total Retried request attempts.",
+            f"# TYPE {p}_retries_total counter",
+            f"{p}_retries_total {data['retries']}",
+            f"# HELP {p}_request_errors_total Requests that failed, by error class.",
+            f"# TYPE {p}_request_errors_total counter",
+        ]
+        for error, count in sorted(data["errors"].items()):
+            lines.append(
+                f'{p}_request_errors_total{{error="{_escape(error)}"}} {count}'
+            )
+        lines += [
+            f"# HELP {p}_files_processed_total Files whose passes all finished.",
+            f"# TYPE {p}_files_processed_total counter",
+            f"{p}_files_processed_total {data['files']}",
+            f"# HELP {p}_deduplicated_calls_total Passes reused from duplicate inputs.",
+            f"# TYPE {p}_deduplicated_calls_total counter",
+            f"{p}_deduplicated_calls_total {data['deduplicated']}",
+        ]
+        if data["concurrency"] is not None:
+            lines += [
+                f"# HELP {p}_concurrency_limit Adaptive limit on requests in flight.",
+                f"# TYPE {p}_concurrency_limit gauge",
+                f"{p}_concurrency_limit {data['concurrency']['limit']}",
+            ]
+        lines += [
+            f"# HELP {p}_run_duration_seconds Wall time of the run.",
+            f"# TYPE {p}_run_duration_seconds gauge",
+            f"{p}_run_duration_seconds {data['elapsed_s']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: Path) -> None:
+        write_atomic(Path(path), json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_prometheus(self, path: Path) -> None:
+        # Atomic so the node exporter never reads a half-written textfile
+        write_atomic(Path(path), self.to_prometheus())
+
+
+def _distribution(values: List[float]) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "sum": sum(values),
+        "count": len(values),
+    }
+
+
+def _histogram(name: str, help_text: str, values: List[float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for bound in LATENCY_BUCKETS:
+        count = sum(1 for value in values if value <= bound)
+        lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+    lines += [
+        f'{name}_bucket{{le="+Inf"}} {len(values)}',
+        f"{name}_sum {sum(values)}",
+        f"{name}_count {len(values)}",
+    ]
+    return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
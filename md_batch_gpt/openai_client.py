@@ -2,15 +2,346 @@
 
 from __future__ import annotations
 
-from typing import Iterable
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Mapping,
+    Tuple,
+)
+import asyncio
+import json
 import time
 
-import openai
+from . import config
+from .concurrency import AdaptiveConcurrency
+from .metrics import RunMetrics
+from .ratelimit import RateLimiter, backoff_delay, estimate_tokens, retry_after
+from .routing import ModelRouter
 
-from .config import OPENAI_API_KEY
+if TYPE_CHECKING:  # pragma: no cover
+    import openai
 
-# Instantiate a single client for reuse
-_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# The ``openai`` package is slow to import, so it is loaded by ``_sdk()`` on
+# the first request rather than when this module is imported.
+openai = None
+
+# Single client reused for every request, built on first use
+_client: openai.OpenAI | None = None
+
+# Async client, only set while an ``async_client_session`` is open
+_async_client: openai.AsyncOpenAI | None = None
+
+# Shared RPM/TPM scheduler consulted before every request, if set
+_rate_limiter: RateLimiter | None = None
+
+# Adaptive cap on requests in flight, if set
+_concurrency: AdaptiveConcurrency | None = None
+
+# Model router; requests for a model with a fallback are not retried here
+_router: ModelRouter | None = None
+
+# Collector every request is reported to, if set
+_metrics: RunMetrics | None = None
+
+_MAX_ATTEMPTS = 4
+
+_BATCH_ENDPOINT = "/v1/chat/completions"
+# The Batch API accepts at most this many requests per input file
+_BATCH_MAX_REQUESTS = 50_000
+_BATCH_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass(frozen=True)
+class HttpPoolConfig:
+    """Connection pool and timeout settings for the async client."""
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 600.0
+    connect_timeout: float = 10.0
+
+
+def _sdk():
+    """Import the ``openai`` package on first use and return it."""
+    global openai
+    if openai is None:
+        import openai as module
+
+        openai = module
+    return openai
+
+
+def _get_client() -> openai.OpenAI:
+    """Return the shared client, creating it on first use."""
+    global _client
+    sdk = _sdk()
+    if _client is None:
+        _client = sdk.OpenAI(api_key=config.require_api_key())
+    return _client
+
+
+def _build_params(
+    messages: Iterable[dict],
+    model: str,
+    temperature: float,
+    max_tokens: int | None,
+) -> dict:
+    params = dict(model=model, messages=list(messages), temperature=temperature)
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    return params
+
+
+def set_rate_limiter(limiter: RateLimiter | None) -> RateLimiter | None:
+    """Install *limiter* for all requests and return the previous one."""
+    global _rate_limiter
+    previous, _rate_limiter = _rate_limiter, limiter
+    return previous
+
+
+def set_concurrency(
+    controller: AdaptiveConcurrency | None,
+) -> AdaptiveConcurrency | None:
+    """Gate every request attempt on *controller* and return the previous one."""
+    global _concurrency
+    previous, _concurrency = _concurrency, controller
+    return previous
+
+
+def _is_congestion(exc: BaseException) -> bool:
+    if openai is None:
+        return False
+    if isinstance(exc, openai.RateLimitError):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code in {429, 502}
+
+
+@contextmanager
+def _request_slot() -> Iterator[None]:
+    """Hold an adaptive-concurrency slot for one request attempt."""
+    gate = _concurrency
+    if gate is None:
+        yield
+        return
+    start = gate.acquire()
+    began = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        gate.release(start, congested=_is_congestion(exc))
+        raise
+    gate.release(start, latency=time.perf_counter() - began)
+
+
+@asynccontextmanager
+async def _async_request_slot() -> AsyncIterator[None]:
+    gate = _concurrency
+    if gate is None:
+        yield
+        return
+    start = await gate.acquire_async()
+    began = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        gate.release(start, congested=_is_congestion(exc))
+        raise
+    gate.release(start, latency=time.perf_counter() - began)
+
+
+def set_router(router: ModelRouter | None) -> ModelRouter | None:
+    """Install *router* and return the previous one.
+
+    While set, a retryable error from a model that has a fallback is raised
+    at once instead of being retried after a backoff, so the caller can
+    send the request to the fallback model.
+    """
+    global _router
+    previous, _router = _router, router
+    return previous
+
+
+def is_overloaded(exc: BaseException) -> bool:
+    """Return True for errors worth failing over to another model."""
+    if openai is None:
+        return False
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and (
+        exc.status_code == 429 or exc.status_code >= 500
+    )
+
+
+def _fails_over(params: dict) -> bool:
+    router = _router
+    return router is not None and router.fallback_for(params["model"]) is not None
+
+
+def set_metrics(metrics: RunMetrics | None) -> RunMetrics | None:
+    """Record every request into *metrics* and return the previous collector."""
+    global _metrics
+    previous, _metrics = _metrics, metrics
+    return previous
+
+
+def _usage(usage) -> Tuple[int, int]:
+    """Return (prompt, completion) tokens from a response's ``usage``."""
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, Mapping):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return (
+        getattr(usage, "prompt_tokens", None) or 0,
+        getattr(usage, "completion_tokens", None) or 0,
+    )
+
+
+def _observe(
+    params: dict,
+    start: float,
+    retries: int,
+    response=None,
+    error: Exception | None = None,
+    usage=None,
+    ttft: float | None = None,
+) -> None:
+    """Report a finished request to the metrics collector, if one is set."""
+    metrics = _metrics
+    if metrics is None:
+        return
+    if usage is None:
+        usage = getattr(response, "usage", None)
+    prompt_tokens, completion_tokens = _usage(usage)
+    metrics.record_request(
+        model=params["model"],
+        prompt=params["messages"][0]["content"],
+        latency=time.perf_counter() - start,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        retries=retries,
+        error=type(error).__name__ if error is not None else None,
+        ttft=ttft,
+    )
+
+
+def _on_retryable_error(attempt: int, exc: Exception) -> float:
+    """Return the backoff for *exc*, pausing the shared limiter on Retry-After."""
+    delay = backoff_delay(attempt, exc)
+    if _rate_limiter is not None and retry_after(exc) is not None:
+        _rate_limiter.pause(delay)
+    return delay
+
+
+@dataclass
+class _Attempt:
+    """State one request attempt reports back to the retry loop."""
+
+    start: float
+    usage: object = None
+    ttft: float | None = None
+    # Output already passed on, which a retry would repeat
+    partial: bool = False
+
+
+def _retry_delay(
+    params: dict, number: int, attempt: _Attempt, exc: Exception
+) -> float | None:
+    """Return the backoff before retrying *exc*, or None to give up on it.
+
+    Only :func:`is_overloaded` errors are retried, and not for a model that
+    fails over, after partial output or on the last attempt.
+    """
+    if (
+        attempt.partial
+        or _fails_over(params)
+        or not is_overloaded(exc)
+        or number == _MAX_ATTEMPTS - 1
+    ):
+        _observe(params, attempt.start, number, error=exc, ttft=attempt.ttft)
+        return None
+    return _on_retryable_error(number, exc)
+
+
+def _with_retries(params: dict, send: Callable[[_Attempt], str]) -> str:
+    """Call *send* until it returns, backing off between retryable errors."""
+    start = time.perf_counter()
+    for number in range(_MAX_ATTEMPTS):
+        attempt = _Attempt(start)
+        try:
+            text = send(attempt)
+        except openai.APIError as exc:
+            delay = _retry_delay(params, number, attempt, exc)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        _observe(params, start, number, usage=attempt.usage, ttft=attempt.ttft)
+        return text
+    raise RuntimeError("Unknown error sending prompt")
+
+
+async def _with_retries_async(
+    params: dict, send: Callable[[_Attempt], Awaitable[str]]
+) -> str:
+    """Async counterpart of :func:`_with_retries`."""
+    start = time.perf_counter()
+    for number in range(_MAX_ATTEMPTS):
+        attempt = _Attempt(start)
+        try:
+            text = await send(attempt)
+        except openai.APIError as exc:
+            delay = _retry_delay(params, number, attempt, exc)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        _observe(params, start, number, usage=attempt.usage, ttft=attempt.ttft)
+        return text
+    raise RuntimeError("Unknown error sending prompt")
+
+
+@contextmanager
+def _response(client: openai.OpenAI, params: dict, tokens: int) -> Iterator:
+    """Yield the response to *params* while holding a request slot.
+
+    With a rate limiter set, waits for its budget first and feeds it the
+    rate-limit headers of the reply.
+    """
+    limiter = _rate_limiter
+    if limiter is not None:
+        limiter.acquire(tokens)
+    with _request_slot():
+        if limiter is None:
+            yield client.chat.completions.create(**params)
+        else:
+            raw = client.chat.completions.with_raw_response.create(**params)
+            limiter.update_from_headers(raw.headers)
+            yield raw.parse()
+
+
+@asynccontextmanager
+async def _async_response(
+    client: openai.AsyncOpenAI, params: dict, tokens: int
+) -> AsyncIterator:
+    """Async counterpart of :func:`_response`."""
+    limiter = _rate_limiter
+    if limiter is not None:
+        await limiter.acquire_async(tokens)
+    async with _async_request_slot():
+        if limiter is None:
+            yield await client.chat.completions.create(**params)
+        else:
+            raw = await client.chat.completions.with_raw_response.create(**params)
+            limiter.update_from_headers(raw.headers)
+            yield raw.parse()
 
 
 def _chat_request(
@@ -20,28 +351,78 @@ def _chat_request(
     max_tokens: int | None = None,
 ):
     """Send a chat completion request with retry logic."""
-    last_exc: Exception | None = None
-    for attempt in range(4):
-        try:
-            params = dict(model=model, messages=list(messages), temperature=temperature)
-            if max_tokens is not None:
-                params["max_tokens"] = max_tokens
-            response = _client.chat.completions.create(**params)
+    params = _build_params(messages, model, temperature, max_tokens)
+    tokens = estimate_tokens(params["messages"], max_tokens)
+    client = _get_client()
+
+    def send(attempt: _Attempt) -> str:
+        with _response(client, params, tokens) as response:
+            attempt.usage = getattr(response, "usage", None)
             return response.choices[0].message.content
-        except openai.RateLimitError as exc:
-            last_exc = exc
-        except openai.APIStatusError as exc:
-            last_exc = exc
-            if exc.status_code not in {429, 502}:
-                raise
-        except openai.APIConnectionError as exc:
-            last_exc = exc
-        if attempt < 3:
-            time.sleep(2**attempt)
-    # If we fall through, raise the last captured exception
-    if last_exc:
-        raise last_exc
-    raise RuntimeError("Unknown error sending prompt")
+
+    return _with_retries(params, send)
+
+
+async def _async_chat_request(
+    messages: Iterable[dict],
+    model: str,
+    temperature: float,
+    max_tokens: int | None = None,
+):
+    """Async counterpart of :func:`_chat_request` using the pooled client."""
+    client = _async_client
+    if client is None:
+        raise RuntimeError("async_client_session() is not active")
+    params = _build_params(messages, model, temperature, max_tokens)
+    tokens = estimate_tokens(params["messages"], max_tokens)
+
+    async def send(attempt: _Attempt) -> str:
+        async with _async_response(client, params, tokens) as response:
+            attempt.usage = getattr(response, "usage", None)
+            return response.choices[0].message.content
+
+    return await _with_retries_async(params, send)
+
+
+@asynccontextmanager
+async def async_client_session(
+    pool: HttpPoolConfig | None = None,
+) -> AsyncIterator[openai.AsyncOpenAI]:
+    """Open a shared ``AsyncOpenAI`` client backed by a keep-alive pool.
+
+    The client is bound to the running event loop, so it lives only for the
+    duration of the ``async with`` block.
+    """
+    global _async_client
+    import httpx
+
+    openai = _sdk()
+    pool = pool or HttpPoolConfig()
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool.max_connections,
+            max_keepalive_connections=pool.max_keepalive_connections,
+            keepalive_expiry=pool.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(pool.timeout, connect=pool.connect_timeout),
+    )
+    client = openai.AsyncOpenAI(
+        api_key=config.require_api_key(), http_client=http_client
+    )
+    previous = _async_client
+    _async_client = client
+    try:
+        yield client
+    finally:
+        _async_client = previous
+        await client.close()
+
+
+def _messages(prompt: str, content: str) -> list[dict]:
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": content},
+    ]
 
 
 def send_prompt(
@@ -51,8 +432,191 @@ def send_prompt(
     max_tokens: int | None,
 ) -> str:
     """Send `content` with a system `prompt` and return the assistant message text."""
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": content},
-    ]
-    return _chat_request(messages, model=model, temperature=1, max_tokens=max_tokens)
+    return _chat_request(
+        _messages(prompt, content), model=model, temperature=1, max_tokens=max_tokens
+    )
+
+
+async def async_send_prompt(
+    prompt: str,
+    content: str,
+    model: str,
+    max_tokens: int | None,
+) -> str:
+    """Async version of :func:`send_prompt`; requires an open client session."""
+    return await _async_chat_request(
+        _messages(prompt, content), model=model, temperature=1, max_tokens=max_tokens
+    )
+
+
+def _stream_params(prompt: str, content: str, model: str, max_tokens: int | None):
+    params = _build_params(
+        _messages(prompt, content), model=model, temperature=1, max_tokens=max_tokens
+    )
+    params.update(stream=True, stream_options={"include_usage": True})
+    return params
+
+
+def _delta_text(chunk) -> str:
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return ""
+    return choices[0].delta.content or ""
+
+
+def _take_chunk(attempt: _Attempt, chunk, parts: list[str]) -> str:
+    """Record *chunk* against *attempt* and return its text, if any."""
+    attempt.usage = getattr(chunk, "usage", None) or attempt.usage
+    text = _delta_text(chunk)
+    if text:
+        if attempt.ttft is None:
+            attempt.ttft = time.perf_counter() - attempt.start
+        attempt.partial = True
+        parts.append(text)
+    return text
+
+
+def stream_prompt(
+    prompt: str,
+    content: str,
+    model: str,
+    max_tokens: int | None,
+    on_chunk: Callable[[str], None],
+) -> str:
+    """Like :func:`send_prompt`, but pass output text to *on_chunk* as it arrives.
+
+    A failed request is retried only if no output has reached *on_chunk*
+    yet, since a retry would repeat text already passed on.
+    """
+    params = _stream_params(prompt, content, model, max_tokens)
+    tokens = estimate_tokens(params["messages"], max_tokens)
+    client = _get_client()
+
+    def send(attempt: _Attempt) -> str:
+        parts: list[str] = []
+        # The slot is held until the whole body has arrived
+        with _response(client, params, tokens) as stream:
+            for chunk in stream:
+                text = _take_chunk(attempt, chunk, parts)
+                if text:
+                    on_chunk(text)
+        return "".join(parts)
+
+    return _with_retries(params, send)
+
+
+async def async_stream_prompt(
+    prompt: str,
+    content: str,
+    model: str,
+    max_tokens: int | None,
+    on_chunk: Callable[[str], None],
+) -> str:
+    """Async version of :func:`stream_prompt`; requires an open client session."""
+    client = _async_client
+    if client is None:
+        raise RuntimeError("async_client_session() is not active")
+    params = _stream_params(prompt, content, model, max_tokens)
+    tokens = estimate_tokens(params["messages"], max_tokens)
+
+    async def send(attempt: _Attempt) -> str:
+        parts: list[str] = []
+        async with _async_response(client, params, tokens) as stream:
+            async for chunk in stream:
+                text = _take_chunk(attempt, chunk, parts)
+                if text:
+                    on_chunk(text)
+        return "".join(parts)
+
+    return await _with_retries_async(params, send)
+
+
+def _wait_for_batch(
+    batch_id: str,
+    poll_interval: float,
+    on_status: Callable[[str, str], None] | None,
+):
+    client = _get_client()
+    batch = client.batches.retrieve(batch_id)
+    while True:
+        if on_status is not None:
+            on_status(batch.id, batch.status)
+        if batch.status in _BATCH_TERMINAL:
+            return batch
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch_id)
+
+
+def run_chat_batch(
+    requests: Mapping[str, Tuple[str, str]],
+    model: str,
+    max_tokens: int | None,
+    poll_interval: float = 30.0,
+    on_status: Callable[[str, str], None] | None = None,
+) -> Dict[str, str]:
+    """Run ``{custom_id: (prompt, content)}`` through the Batch API.
+
+    Requests are written as JSON Lines, uploaded and submitted, then the
+    batch is polled until it finishes. Returns the assistant text keyed by
+    custom_id; requests that failed inside the batch are left out.
+    """
+    client = _get_client()
+    ids = list(requests)
+    batch_ids = []
+    for start in range(0, len(ids), _BATCH_MAX_REQUESTS):
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": _BATCH_ENDPOINT,
+                    "body": _build_params(
+                        _messages(*requests[custom_id]),
+                        model=model,
+                        temperature=1,
+                        max_tokens=max_tokens,
+                    ),
+                }
+            )
+            for custom_id in ids[start : start + _BATCH_MAX_REQUESTS]
+        ]
+        upload = client.files.create(
+            file=("batch.jsonl", ("\n".join(lines) + "\n").encode("utf-8")),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=upload.id,
+            endpoint=_BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        batch_ids.append(batch.id)
+
+    results: Dict[str, str] = {}
+    for batch_id in batch_ids:
+        batch = _wait_for_batch(batch_id, poll_interval, on_status)
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+        if not batch.output_file_id:
+            continue
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            body = response["body"]
+            results[item["custom_id"]] = body["choices"][0]["message"]["content"]
+            if _metrics is not None:
+                # Batch items are not timed individually
+                prompt_tokens, completion_tokens = _usage(body.get("usage"))
+                _metrics.record_request(
+                    model=body.get("model", model),
+                    prompt=requests[item["custom_id"]][0],
+                    latency=None,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    retries=0,
+                )
+    return results
@@ -1,13 +1,802 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
 from pathlib import Path
-from typing import List
+from typing import Awaitable, Callable, Dict, Iterator, List, Mapping, Tuple
 
-from .file_io import iter_markdown_files, write_atomic
-from .openai_client import send_prompt
-from .log_io import append_log_record
+from .cache import ResponseCache
+from .chunking import chunk_markdown, concat_outputs
+from .concurrency import AdaptiveConcurrency
+from .estimate import DEFAULT_PRICES, Calibration, RunEstimate, format_estimate
+from .file_io import (
+    GroupedWriter,
+    Prefetcher,
+    iter_markdown_files,
+    select_shard,
+    write_atomic,
+)
+from .openai_client import (
+    HttpPoolConfig,
+    async_client_session,
+    async_send_prompt,
+    async_stream_prompt,
+    run_chat_batch,
+    is_overloaded,
+    send_prompt,
+    set_concurrency,
+    set_metrics,
+    set_rate_limiter,
+    set_router,
+    stream_prompt,
+)
+from .jobqueue import LEASED, PENDING, Job, JobQueue, new_worker_id
+from .log_io import LogWriter
+from .manifest import Manifest
+from .metrics import RunMetrics
+from .packing import (
+    FilePacker,
+    pack_inputs,
+    pack_prompt,
+    split_outputs,
+    text_tokens,
+)
+from .ratelimit import RateLimiter
+from .regex_filter import RegexFilter
+from .routing import ModelRouter
 import typer
 
+# Sends one prompt pass: (system prompt, content) -> model output
+PromptCall = Callable[[str, str], Awaitable[str]]
+
+# Threads added per file for sending its chunks in parallel
+CHUNK_WORKERS = 8
+
+# Finished pass outputs kept for duplicates; the least recently used go first
+DEDUPE_MAX_RESULTS = 10_000
+
+# Where a streamed pass sends its output chunks; set per pass
+_stream_sink: contextvars.ContextVar[Callable[[str], None] | None] = (
+    contextvars.ContextVar("stream_sink", default=None)
+)
+
+
+class _PassModels:
+    """Models that answered one prompt pass, when routing is active."""
+
+    def __init__(self, routed: str | None = None) -> None:
+        # The model the current request is being sent to
+        self.current = routed
+        self.used: List[str] = []
+
+    def label(self) -> str | None:
+        if not self.used:
+            return self.current
+        return ", ".join(dict.fromkeys(self.used))
+
+
+# Collects the models used by the pass being run; set per pass
+_pass_models: contextvars.ContextVar[_PassModels | None] = contextvars.ContextVar(
+    "pass_models", default=None
+)
+
+
+@dataclass
+class _RunContext:
+    """Settings and shared objects every file of a run needs."""
+
+    prompts: List[Tuple[Path, str]]
+    model: str
+    max_tokens: int | None
+    verbose: bool
+    inplace: bool
+    log: LogWriter | None
+    manifest: Manifest | None
+    resume: bool
+    regex: RegexFilter | None
+    cache: ResponseCache | None
+    refresh_cache: bool
+    metrics: RunMetrics | None = None
+    # Reuse one result for passes with identical prompt and input
+    dedupe: bool = True
+    # Passes answered from a duplicate instead of a new call
+    deduplicated: int = 0
+    # Hold a file's log records until all its passes are done
+    buffer_records: bool = False
+    # Write extraction records while the output streams in
+    stream: bool = False
+    # Picks a model per request; records then name the model used
+    router: ModelRouter | None = None
+    # Prompt file names by prompt text, for routing rules
+    prompt_names: Dict[str, str] = field(default_factory=dict)
+    # Chains of prompt indices that run side by side (Extraction Mode)
+    plan: List[List[int]] | None = None
+    # Token budget of a packed request and the largest file it takes
+    pack_tokens: int = 0
+    pack_file_tokens: int = 0
+    # Commits in-place results, grouping their fsyncs
+    writer: GroupedWriter | None = None
+
+
+async def _process_file(
+    run: _RunContext, md_file: Path, text: str, call: PromptCall
+) -> None:
+    """Run every prompt pass over *md_file*, whose contents are *text*.
+
+    When ``run.buffer_records`` is True, log records are held back until all
+    passes have finished and then written together so records for one file
+    stay contiguous in the log.
+
+    With ``run.stream``, each extraction record is written while its output
+    streams in instead, so records of one file may be interleaved with
+    those of other files.
+
+    In Extraction Mode with ``run.plan``, each chain of the plan starts
+    from the file's content and the chains run concurrently.
+
+    Finished passes are recorded in the run's manifest; when resuming, the
+    passes it already lists are skipped. Files the regex filter rejects are
+    not sent at all.
+
+    In place, outputs are kept in memory between passes and only the last
+    is written (see :func:`_record_inplace`).
+    """
+    text = _select_input(run, md_file, text)
+    if text is None:
+        return
+    original = text
+    if run.plan is None or run.inplace:
+        start, text = _resume_point(run, md_file, text)
+        chains = [(list(range(start, len(run.prompts))), text)]
+    else:
+        chains = [_resume_chain(run, md_file, chain, text) for chain in run.plan]
+    pending: List[Tuple[int, Path, str, str, str, str | None]] = []
+    if len(chains) == 1:
+        await _run_chain(run, md_file, *chains[0], call, pending, original)
+    else:
+        await asyncio.gather(
+            *(
+                _run_chain(run, md_file, passes, source, call, pending)
+                for passes, source in chains
+            )
+        )
+        pending.sort(key=lambda record: record[0])
+    # No awaits below, so no other file can interleave its records
+    _emit_records(run, md_file, pending)
+    if run.metrics is not None:
+        run.metrics.record_file()
+
+
+async def _run_chain(
+    run: _RunContext,
+    md_file: Path,
+    passes: List[int],
+    text: str,
+    call: PromptCall,
+    pending: List[Tuple[int, Path, str, str, str, str | None]],
+    original: str | None = None,
+) -> None:
+    """Run *passes* in order over *text*, each taking the previous output.
+
+    *original* is the file's contents, for in-place runs.
+    """
+    prompts = run.prompts
+    for idx in passes:
+        prompt_path, prompt = prompts[idx]
+        if run.verbose:
+            typer.echo(f"{md_file}: pass {idx + 1}/{len(prompts)}")
+        source = text
+        models = _PassModels() if run.router is not None else None
+        token = _pass_models.set(models)
+        try:
+            if run.stream and not run.inplace:
+                text = await _stream_pass(run, md_file, idx, text, call, models)
+                continue
+            text = await call(prompt, text)
+        finally:
+            _pass_models.reset(token)
+        model = models.label() if models is not None else None
+        if run.inplace:
+            _record_inplace(run, md_file, idx, source, text, original)
+        else:
+            pending.append((idx, prompt_path, prompt, source, text, model))
+            if not run.buffer_records:
+                _emit_records(run, md_file, pending)
+
+
+async def _process_pack(
+    run: _RunContext, call: PromptCall, group: List[Tuple[Path, str]]
+) -> None:
+    """Run every prompt pass over the files of *group*, packing them.
+
+    Each pass sends the files that are still small enough as one request
+    (see :mod:`md_batch_gpt.packing`) and splits the answer back per file.
+    If the answer does not split cleanly, that pass is sent again one file
+    at a time. Records and in-place writes are the same as for unpacked
+    files. When resuming, the files are processed one by one.
+    """
+    if len(group) == 1 or (run.manifest is not None and run.resume):
+        for md_file, text in group:
+            await _process_file(run, md_file, text, call)
+        return
+    # [path, current text, pending records, original contents]
+    members: List[List] = []
+    for md_file, text in group:
+        text = _select_input(run, md_file, text)
+        if text is not None:
+            members.append([md_file, text, [], text])
+
+    async def one(text: str, prompt: str) -> Tuple[str, str | None]:
+        models = _PassModels() if run.router is not None else None
+        token = _pass_models.set(models)
+        try:
+            output = await call(prompt, text)
+        finally:
+            _pass_models.reset(token)
+        return output, models.label() if models is not None else None
+
+    async def packed(batch: List[List], prompt: str) -> List[Tuple[str, str | None]]:
+        output, model = await one(
+            pack_inputs([m[1] for m in batch]), pack_prompt(prompt)
+        )
+        parts = split_outputs(output, len(batch))
+        if parts is not None:
+            return [(part, model) for part in parts]
+        if run.verbose:
+            typer.echo(
+                f"packed answer for {len(batch)} files did not split; "
+                "sending them one by one"
+            )
+        return list(await asyncio.gather(*(one(m[1], prompt) for m in batch)))
+
+    for idx, (prompt_path, prompt) in enumerate(run.prompts):
+        if run.verbose:
+            typer.echo(
+                f"{len(members)} packed files: pass {idx + 1}/{len(run.prompts)}"
+            )
+        # Outputs can outgrow the limits, so the groups are rebuilt per pass
+        singles, batches = _pack_batches(members, run.pack_tokens, run.pack_file_tokens)
+        results = await asyncio.gather(
+            *(one(m[1], prompt) for m in singles),
+            *(packed(batch, prompt) for batch in batches),
+        )
+        outputs = list(results[: len(singles)])
+        for batch_outputs in results[len(singles) :]:
+            outputs += batch_outputs
+        ordered = singles + [m for batch in batches for m in batch]
+        for member, (output, model) in zip(ordered, outputs):
+            md_file, source, pending, original = member
+            member[1] = output
+            if run.inplace:
+                _record_inplace(run, md_file, idx, source, output, original)
+            else:
+                pending.append((idx, prompt_path, prompt, source, output, model))
+    for md_file, _, pending, _ in members:
+        _emit_records(run, md_file, pending)
+        if run.metrics is not None:
+            run.metrics.record_file()
+
+
+def _pack_batches(
+    members: List[List], budget: int, file_tokens: int
+) -> Tuple[List[List], List[List[List]]]:
+    """Split *members* into files sent alone and groups sent packed."""
+    singles: List[List] = []
+    batches: List[List[List]] = [[]]
+    size = 0
+    for member in members:
+        tokens = text_tokens(member[1])
+        if tokens > file_tokens:
+            singles.append(member)
+            continue
+        if size + tokens > budget:
+            batches.append([])
+            size = 0
+        batches[-1].append(member)
+        size += tokens
+    for batch in batches:
+        if len(batch) == 1:
+            singles.append(batch[0])
+    return singles, [batch for batch in batches if len(batch) > 1]
+
+
+async def _stream_pass(
+    run: _RunContext,
+    md_file: Path,
+    idx: int,
+    text: str,
+    call: PromptCall,
+    models: _PassModels | None = None,
+) -> str:
+    """Run pass *idx* over *text*, streaming its output into the log."""
+    prompt_path, prompt = run.prompts[idx]
+    label = models.label if models is not None else None
+    with run.log.stream(md_file, prompt_path, label) as record:
+        token = _stream_sink.set(record.write)
+        try:
+            output = await call(prompt, text)
+        finally:
+            _stream_sink.reset(token)
+        if not record.written:
+            # Answered from the cache or a duplicate without streaming
+            record.write(output)
+        record.finish(_manifest_callback(run, md_file, idx, text, output))
+    if run.verbose:
+        typer.echo(f"log record {idx + 1}: {md_file} {prompt_path.name}")
+    return output
+
+
+def _manifest_callback(
+    run: _RunContext, md_file: Path, idx: int, source: str, output: str
+) -> Callable[[], None] | None:
+    """Return the callback that records pass *idx* once its record is flushed."""
+    if run.manifest is None:
+        return None
+    return partial(
+        run.manifest.record,
+        md_file,
+        idx,
+        run.prompts[idx][1],
+        source,
+        output,
+        keep_text=not _ends_chain(run, idx),
+    )
+
+
+def _record_inplace(
+    run: _RunContext,
+    md_file: Path,
+    idx: int,
+    source: str,
+    output: str,
+    original: str | None,
+) -> None:
+    """Record in-place pass *idx* and write *md_file* if it was the last.
+
+    Earlier outputs only go to the manifest, which keeps their text so a
+    resumed run continues from them; the file itself changes once, and not
+    at all if the final output equals its *original* contents.
+    """
+    last = _ends_chain(run, idx)
+    # Record before writing: a crash in between re-runs this pass instead
+    # of treating its output as fresh input.
+    if run.manifest is not None:
+        run.manifest.record(
+            md_file, idx, run.prompts[idx][1], source, output, keep_text=not last
+        )
+    if not last:
+        return
+    if run.writer is None:
+        write_atomic(md_file, output)
+    elif not run.writer.write(md_file, output, original) and run.verbose:
+        typer.echo(f"{md_file}: unchanged, not rewritten")
+
+
+def _report_writes(run: _RunContext) -> None:
+    writer = run.writer
+    typer.echo(
+        f"In place: {writer.written} files written in {writer.groups} sync "
+        f"groups, {writer.unchanged} unchanged"
+    )
+
+
+def _ends_chain(run: _RunContext, idx: int) -> bool:
+    """Return True if no later pass takes the output of pass *idx*."""
+    if run.plan is None or run.inplace:
+        return idx == len(run.prompts) - 1
+    return any(chain[-1] == idx for chain in run.plan)
+
+
+def _select_input(run: _RunContext, md_file: Path, text: str) -> str | None:
+    """Return the part of *text* to send, or None if the regex filter skips it.
+
+    In-place runs send whole files, since the output replaces the file.
+    """
+    if run.regex is None:
+        return text
+    selected = run.regex.select(text, trim=not run.inplace)
+    if selected is None and run.verbose:
+        typer.echo(f"{md_file}: skipped by regex filter")
+    return selected
+
+
+def _resume_point(run: _RunContext, md_file: Path, text: str) -> Tuple[int, str]:
+    """Return the first pass to run for *md_file* and the text it takes."""
+    if run.manifest is None or not run.resume:
+        return 0, text
+    prompt_texts = [prompt for _, prompt in run.prompts]
+    if run.inplace:
+        start = run.manifest.resume_inplace(md_file, prompt_texts, text)
+        start, text = run.manifest.resume_kept(md_file, prompt_texts, start, text)
+    else:
+        start, text = run.manifest.resume_extraction(md_file, prompt_texts, text)
+    if run.verbose and start:
+        typer.echo(f"{md_file}: resuming at pass {start + 1}/{len(run.prompts)}")
+    return start, text
+
+
+def _resume_chain(
+    run: _RunContext, md_file: Path, chain: List[int], text: str
+) -> Tuple[List[int], str]:
+    """Return the passes of *chain* still to run and the text they start on."""
+    if run.manifest is None or not run.resume:
+        return chain, text
+    passes = [(idx, run.prompts[idx][1]) for idx in chain]
+    pos, text = run.manifest.resume_chain(md_file, passes, text)
+    if run.verbose and pos:
+        typer.echo(f"{md_file}: resuming chain at pass {chain[pos] + 1}")
+    return chain[pos:], text
+
+
+def _emit_records(
+    run: _RunContext,
+    md_file: Path,
+    pending: List[Tuple[int, Path, str, str, str, str | None]],
+) -> None:
+    """Queue the *pending* records for *md_file* on the log and clear them.
+
+    Manifest entries are added only once the writer has flushed the record.
+    """
+    for idx, prompt_path, prompt, source, output, model in pending:
+        on_flushed = _manifest_callback(run, md_file, idx, source, output)
+        run.log.write(md_file, prompt_path, output, on_flushed, model=model)
+        if run.verbose:
+            typer.echo(f"log record {idx + 1}: {md_file} {prompt_path.name}")
+    pending.clear()
+
+
+async def _run_workers(
+    items: Iterator[tuple],
+    handle: Callable[..., Awaitable[None]],
+    workers: int,
+) -> None:
+    """Feed *items* to *handle* from *workers* coroutines sharing one iterator.
+
+    With more than one worker the next item is fetched off the event loop,
+    since waiting for the read-ahead thread would stall requests in flight.
+    """
+    loop = asyncio.get_running_loop()
+    done = object()
+
+    async def worker() -> None:
+        while True:
+            if workers > 1:
+                item = await loop.run_in_executor(None, next, items, done)
+            else:
+                item = next(items, done)
+            if item is done:
+                return
+            await handle(*item)
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(max(1, workers))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _run(
+    run: _RunContext,
+    files: Iterator[tuple],
+    concurrency: int,
+    use_async: bool,
+    http_pool: HttpPoolConfig | None,
+    chunk_tokens: int | None,
+    merge: str,
+    reduce_prompt: str | None,
+    process: Callable[..., Awaitable[None]] | None = None,
+) -> None:
+    """Run *files* through the prompt passes with the chosen transport.
+
+    *process*, when given, handles each item as ``process(call, *item)``
+    instead of :func:`_process_file`, with *call* sending one pass.
+    """
+    max_tokens, cache, router = run.max_tokens, run.cache, run.router
+    # Chains of a plan run side by side, so each file can have that many
+    # requests in flight
+    width = len(run.plan) if run.plan is not None and not run.inplace else 1
+    run.buffer_records = concurrency > 1 or width > 1
+    prompt_names = run.prompt_names
+    prompt_names.update((prompt, path.name) for path, prompt in run.prompts)
+    # One task per distinct (prompt, input); duplicates await the same task
+    # and copy the models recorded by the pass that created it. Entries are
+    # [task, models, callers waiting]; finished ones are kept for later
+    # copies up to DEDUPE_MAX_RESULTS, and failed ones dropped.
+    passes: OrderedDict[str, list] = OrderedDict()
+
+    async def call(prompt: str, text: str) -> str:
+        model = run.model
+        if router is not None:
+            model = router.choose(prompt_names.get(prompt), text)
+        models = _pass_models.get()
+        if models is not None:
+            models.current = model
+        if not run.dedupe:
+            return await chunked_call(prompt, text, model)
+        key = ResponseCache.make_key(model, prompt, text, max_tokens)
+        entry = passes.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(chunked_call(prompt, text, model))
+            entry = passes[key] = [task, models, 0]
+            _trim_results(passes)
+        else:
+            passes.move_to_end(key)
+            _count_duplicate(run)
+        task, first, _ = entry
+        entry[2] += 1
+        try:
+            # Shielded so that one cancelled caller does not cancel the
+            # pass under the others
+            output = await asyncio.shield(task)
+        except BaseException:
+            # A failed pass must be sent again by the next caller, not
+            # answered with the same exception
+            if task.done() and passes.get(key) is entry:
+                del passes[key]
+            raise
+        finally:
+            entry[2] -= 1
+            if not entry[2] and not task.done():
+                # Every caller was cancelled
+                task.cancel()
+                if passes.get(key) is entry:
+                    del passes[key]
+        if models is not None and first is not None and first is not models:
+            models.used.extend(first.used)
+        return output
+
+    async def chunked_call(prompt: str, text: str, model: str) -> str:
+        if chunk_tokens is None:
+            return await cached_call(prompt, text, model)
+        chunks = chunk_markdown(text, chunk_tokens)
+        if len(chunks) == 1:
+            return await cached_call(prompt, text, model)
+        # Chunk outputs arrive out of order, so they are not streamed
+        token = _stream_sink.set(None)
+        try:
+            outputs = await asyncio.gather(
+                *(cached_call(prompt, c, model) for c in chunks)
+            )
+        finally:
+            _stream_sink.reset(token)
+        merged = concat_outputs(list(outputs))
+        if merge == "reduce" and reduce_prompt is not None:
+            return await cached_call(reduce_prompt, merged, model)
+        return merged
+
+    async def cached_call(prompt: str, text: str, model: str) -> str:
+        if cache is None:
+            output, _ = await routed_send(prompt, text, model)
+            return output
+        key = cache.make_key(model, prompt, text, max_tokens)
+        # SQLite I/O runs off the event loop, which keeps serving other files
+        if not run.refresh_cache:
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+        output, used = await routed_send(prompt, text, model)
+        # A fallback's answer is stored under the fallback model
+        used_key = cache.make_key(used, prompt, text, max_tokens)
+        await asyncio.to_thread(cache.put, used_key, used, output)
+        return output
+
+    async def routed_send(prompt: str, text: str, model: str) -> Tuple[str, str]:
+        """Send to *model*, or to its fallback if it is overloaded."""
+        if router is None:
+            return await send(prompt, text, model), model
+        models = _pass_models.get()
+        fallback = router.fallback_for(model)
+        for attempt in (model, fallback):
+            if models is not None:
+                models.current = attempt
+            start = time.perf_counter()
+            try:
+                output = await send(prompt, text, attempt)
+            except Exception as exc:
+                if attempt != model or fallback is None or not is_overloaded(exc):
+                    raise
+                router.record_failure(model)
+                if run.verbose:
+                    typer.echo(f"{model}: {type(exc).__name__}, retrying on {fallback}")
+                continue
+            router.record_success(attempt, time.perf_counter() - start)
+            if models is not None:
+                models.used.append(attempt)
+            return output, attempt
+        raise AssertionError("unreachable")
+
+    async def handle(*item) -> None:
+        if process is not None:
+            await process(call, *item)
+        else:
+            await _process_file(run, *item, call)
+
+    if use_async:
+
+        async def send(prompt: str, text: str, model: str) -> str:
+            sink = _stream_sink.get()
+            if sink is not None:
+                return await async_stream_prompt(prompt, text, model, max_tokens, sink)
+            return await async_send_prompt(prompt, text, model, max_tokens)
+
+        async with async_client_session(http_pool):
+            await _run_workers(files, handle, concurrency)
+        return
+
+    if concurrency <= 1 and width <= 1 and chunk_tokens is None:
+
+        async def send(prompt: str, text: str, model: str) -> str:
+            sink = _stream_sink.get()
+            if sink is not None:
+                return stream_prompt(prompt, text, model, max_tokens, sink)
+            return send_prompt(prompt, text, model, max_tokens)
+
+        await _run_workers(files, handle, 1)
+        return
+
+    loop = asyncio.get_running_loop()
+    workers = concurrency * width
+    if chunk_tokens is not None:
+        workers *= CHUNK_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        async def send(prompt: str, text: str, model: str) -> str:
+            # Executor threads do not see the context, so pass the sink on
+            sink = _stream_sink.get()
+            if sink is not None:
+                return await loop.run_in_executor(
+                    pool, stream_prompt, prompt, text, model, max_tokens, sink
+                )
+            return await loop.run_in_executor(
+                pool, send_prompt, prompt, text, model, max_tokens
+            )
+
+        await _run_workers(files, handle, concurrency)
+
+
+def _watch_concurrency(
+    controller: AdaptiveConcurrency | None,
+    metrics: RunMetrics | None,
+    verbose: bool,
+) -> None:
+    """Report *controller*'s limit changes to *metrics* and verbose output."""
+    if controller is None:
+        return
+    previous = controller.on_change
+    if metrics is not None:
+        metrics.record_concurrency(controller.limit)
+
+    def on_change(limit: int) -> None:
+        if previous is not None:
+            previous(limit)
+        if metrics is not None:
+            metrics.record_concurrency(limit)
+        if verbose:
+            typer.echo(f"concurrency limit: {limit}")
+
+    controller.on_change = on_change
+
+
+def _trim_results(passes: OrderedDict[str, list]) -> None:
+    """Drop the least recently used finished passes beyond the limit."""
+    excess = len(passes) - DEDUPE_MAX_RESULTS
+    if excess <= 0:
+        return
+    done = [key for key, entry in passes.items() if entry[0].done()]
+    for key in done[:excess]:
+        del passes[key]
+
+
+def _count_duplicate(run: _RunContext) -> None:
+    run.deduplicated += 1
+    if run.metrics is not None:
+        run.metrics.record_deduplicated()
+
+
+def _run_batch(
+    run: _RunContext,
+    files: Iterator[Tuple[Path, str]],
+    poll_interval: float,
+) -> None:
+    """Run each prompt pass for all files as one Batch API job.
+
+    Outputs of one pass become the inputs of the next pass's batch. Log
+    records are written per file once every pass has finished so the log
+    has the same layout as a sequential run.
+    """
+    model, max_tokens, cache, prompts = (
+        run.model,
+        run.max_tokens,
+        run.cache,
+        run.prompts,
+    )
+    paths: List[Path] = []
+    texts: List[str] = []
+    originals: List[str] = []
+    starts: List[int] = []
+    for md_file, text in files:
+        text = _select_input(run, md_file, text)
+        if text is None:
+            continue
+        originals.append(text)
+        start, text = _resume_point(run, md_file, text)
+        paths.append(md_file)
+        texts.append(text)
+        starts.append(start)
+
+    def on_status(batch_id: str, status: str) -> None:
+        typer.echo(f"batch {batch_id}: {status}")
+
+    pending: List[List[Tuple[int, Path, str, str, str, str | None]]] = [
+        [] for _ in paths
+    ]
+    for idx, (prompt_path, prompt) in enumerate(prompts):
+        active = [i for i, start in enumerate(starts) if start <= idx]
+        if not active:
+            continue
+        outputs: Dict[int, str] = {}
+        requests: Dict[str, Tuple[str, str]] = {}
+        # Files whose input duplicates an earlier file's, by custom_id
+        duplicates: Dict[int, str] = {}
+        custom_ids: Dict[str, str] = {}
+        for i in active:
+            key = ResponseCache.make_key(model, prompt, texts[i], max_tokens)
+            if run.dedupe and key in custom_ids:
+                duplicates[i] = custom_ids[key]
+                _count_duplicate(run)
+                continue
+            custom_ids[key] = str(i)
+            if cache is not None and not run.refresh_cache:
+                cached = cache.get(key)
+                if cached is not None:
+                    outputs[i] = cached
+                    continue
+            requests[str(i)] = (prompt, texts[i])
+        if requests:
+            if run.verbose:
+                typer.echo(
+                    f"pass {idx + 1}/{len(prompts)}: "
+                    f"submitting batch of {len(requests)} requests"
+                )
+            results = run_chat_batch(
+                requests,
+                model,
+                max_tokens,
+                poll_interval=poll_interval,
+                on_status=on_status if run.verbose else None,
+            )
+            for custom_id, (_, content) in requests.items():
+                output = results.get(custom_id)
+                if output is None:
+                    # Failed inside the batch; retry it as a regular request
+                    output = send_prompt(prompt, content, model, max_tokens)
+                if cache is not None:
+                    key = cache.make_key(model, prompt, content, max_tokens)
+                    cache.put(key, model, output)
+                outputs[int(custom_id)] = output
+        for i, custom_id in duplicates.items():
+            outputs[i] = outputs[int(custom_id)]
+        for i in active:
+            source, texts[i] = texts[i], outputs[i]
+            if run.inplace:
+                _record_inplace(run, paths[i], idx, source, texts[i], originals[i])
+            else:
+                pending[i].append((idx, prompt_path, prompt, source, texts[i], None))
+
+    for md_file, records in zip(paths, pending):
+        _emit_records(run, md_file, records)
+        if run.metrics is not None:
+            run.metrics.record_file()
+
 
 def process_folder(
     folder: Path,
@@ -19,32 +808,492 @@ def process_folder(
     verbose: bool = False,
     inplace: bool = False,
     log_file: Path = Path("extracted.txt"),
+    concurrency: int = 1,
+    use_async: bool = False,
+    http_pool: HttpPoolConfig | None = None,
+    cache: ResponseCache | None = None,
+    refresh_cache: bool = False,
+    manifest: Manifest | None = None,
+    resume: bool = False,
+    batch: bool = False,
+    batch_poll_interval: float = 30.0,
+    rate_limiter: RateLimiter | None = None,
+    chunk_tokens: int | None = None,
+    merge: str = "concat",
+    reduce_prompt: Path | None = None,
+    log_flush_every: int | None = 1,
+    log_flush_interval: float | None = None,
+    log_fsync: bool = False,
+    log_index: bool = True,
+    include: List[str] | None = None,
+    exclude: List[str] | None = None,
+    use_gitignore: bool = False,
+    prefetch_bytes: int = 64 * 1024**2,
+    metrics: RunMetrics | None = None,
+    dedupe: bool = True,
+    stream: bool = False,
+    shard: Tuple[int, int] | None = None,
+    adaptive: AdaptiveConcurrency | None = None,
+    router: ModelRouter | None = None,
+    plan: List[List[int]] | None = None,
+    pack_tokens: int | None = None,
+    pack_file_tokens: int = 512,
+    calibration: Calibration | None = None,
+    prices: Mapping[str, Tuple[float, float]] | None = None,
+    estimate_json: Path | None = None,
 ) -> None:
     """Process Markdown files in *folder* using prompts from *prompt_paths*.
 
-    When *dry_run* is True, print the files that would be processed and the
-    number of prompts, but make no changes.
+    When *dry_run* is True, print the files that would be processed, the
+    number of prompts and an offline estimate of the run's tokens, cost per
+    model in *prices* and wall clock under *calibration* (see
+    :class:`~md_batch_gpt.estimate.RunEstimate`), but make no changes. The
+    estimate is also written to *estimate_json* if given.
+
+    *regex_json* names a JSON file of patterns. Files no pattern matches are
+    skipped without an API call; in extraction mode only the heading
+    sections that match are sent.
+
+    *concurrency* sets how many files are processed at once. Prompt passes
+    for a single file always run in order. With *use_async* requests go
+    through a pooled ``AsyncOpenAI`` client on one event loop instead of a
+    thread per in-flight request; *http_pool* tunes that pool.
+
+    When a *cache* is given, responses are looked up before sending and
+    stored afterwards. *refresh_cache* skips the lookup but still stores.
+
+    Finished passes are appended to *manifest* as they complete. With
+    *resume*, passes the manifest already lists for a file's current content
+    are skipped and partly processed chains continue at the next pass.
+
+    With *batch*, each pass is submitted for all files as one OpenAI Batch
+    API job polled every *batch_poll_interval* seconds.
+
+    *rate_limiter* is shared by every request of the run so that all workers
+    wait for request and token budget before sending.
+
+    With *chunk_tokens*, content larger than that estimate is split at
+    Markdown headings and each chunk is sent in parallel. Chunk outputs are
+    joined in order (*merge* ``"concat"``) or joined and then passed through
+    *reduce_prompt* (*merge* ``"reduce"``).
+
+    Extraction records go through one :class:`LogWriter` on *log_file*;
+    *log_flush_every*, *log_flush_interval* and *log_fsync* set its flush
+    policy, and *log_index* whether it keeps a byte-offset sidecar index.
+
+    *include*, *exclude* and *use_gitignore* control file discovery; see
+    :func:`iter_markdown_files`. Files are discovered lazily and read ahead
+    on a background thread while requests are in flight, with at most
+    *prefetch_bytes* of file content buffered.
+
+    When *metrics* is given, every request and finished file is recorded
+    into it.
+
+    With *dedupe*, a pass whose prompt and input match one already sent in
+    this run reuses that result, so byte-identical files cost one call chain
+    and every copy still gets its own log record or in-place write.
+
+    With *shard* ``(index, count)``, only files whose relative path hashes
+    to the 0-based shard *index* of *count* are processed.
+
+    With *stream*, Extraction Mode records are written to the log as the
+    output arrives. It has no effect in place or with *batch*, and passes
+    split into chunks are written once merged.
+
+    With *adaptive*, every request attempt takes a slot from that AIMD
+    controller, so the number in flight follows its limit rather than
+    *concurrency*, which then only sets how many files are open at once.
+
+    With *router*, each request's model is picked by that policy instead of
+    *model* (the router's default), requests fail over to its fallback
+    model when their model is overloaded, and every log record names the
+    model that answered. Batch runs ignore it.
+
+    *plan* splits the prompts into chains of indices (see
+    :func:`~md_batch_gpt.plan.parse_plan`). In Extraction Mode every chain
+    starts from the file's content and the chains of a file run at the same
+    time, so a file takes as long as its slowest chain. Without a plan all
+    prompts form one chain. In place and with *batch* it has no effect.
+
+    With *pack_tokens*, files of at most *pack_file_tokens* estimated tokens
+    are grouped, up to *pack_tokens* per group, and each pass sends a group
+    as one request whose answer is split back per file (see
+    :func:`_process_pack`). Packed records are not streamed. Packing is
+    off with *batch* or *plan*.
     """
+    if batch:
+        router = plan = None
+    if batch or plan is not None:
+        pack_tokens = None
     prompts = [
         (Path(p), Path(p).read_text(encoding="utf-8", errors="replace"))
         for p in prompt_paths
     ]
-    files = list(iter_markdown_files(folder))
+    reduce_text = None
+    if reduce_prompt is not None:
+        reduce_text = Path(reduce_prompt).read_text(encoding="utf-8", errors="replace")
+    regex = RegexFilter.load(regex_json) if regex_json is not None else None
+    paths = iter_markdown_files(folder, include, exclude, use_gitignore)
+    if shard is not None:
+        paths = select_shard(paths, folder, *shard)
     if dry_run:
-        for f in files:
+        estimate = RunEstimate(
+            [(path.name, text) for path, text in prompts],
+            plan or [list(range(len(prompts)))],
+            calibration or Calibration(),
+            max_tokens,
+        )
+        for f in paths:
+            text = f.read_text(encoding="utf-8", errors="replace")
+            if regex is not None:
+                text = regex.select(text, trim=not inplace)
+                if text is None:
+                    continue
             print(f)
+            estimate.add_file(f, text)
         print(f"Prompt count: {len(prompts)}")
+        if regex is not None:
+            print(regex.summary())
+        data = estimate.summary(
+            model,
+            DEFAULT_PRICES if prices is None else prices,
+            concurrency=concurrency,
+            rpm=rate_limiter.rpm if rate_limiter is not None else None,
+            tpm=rate_limiter.tpm if rate_limiter is not None else None,
+        )
+        print(format_estimate(data))
+        if estimate_json is not None:
+            write_atomic(Path(estimate_json), json.dumps(data, indent=2) + "\n")
         return
 
-    for md_file in files:
-        text = md_file.read_text(encoding="utf-8", errors="replace")
-        for idx, (prompt_path, prompt) in enumerate(prompts):
-            if verbose:
-                typer.echo(f"{md_file}: pass {idx + 1}/{len(prompts)}")
-            text = send_prompt(prompt, text, model, max_tokens)
-            if inplace:
-                write_atomic(md_file, text)
-            else:
-                append_log_record(Path(log_file), md_file, prompt_path, text)
-                if verbose:
-                    typer.echo(f"log record {idx + 1}: {md_file} {prompt_path.name}")
+    log = None
+    if not inplace:
+        log = LogWriter(
+            Path(log_file),
+            flush_every=log_flush_every,
+            flush_interval=log_flush_interval,
+            fsync=log_fsync,
+            index=log_index,
+            root=folder,
+        )
+    run = _RunContext(
+        prompts=prompts,
+        model=model,
+        max_tokens=max_tokens,
+        verbose=verbose,
+        inplace=inplace,
+        log=log,
+        manifest=manifest,
+        resume=resume,
+        regex=regex,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        metrics=metrics,
+        dedupe=dedupe,
+        stream=stream,
+        router=router,
+        plan=plan,
+        pack_tokens=pack_tokens or 0,
+        pack_file_tokens=pack_file_tokens,
+        writer=GroupedWriter() if inplace else None,
+    )
+    labels = {text: path.name for path, text in prompts}
+    if pack_tokens is not None:
+        labels.update((pack_prompt(text), path.name) for path, text in prompts)
+        run.prompt_names.update(labels)
+    if metrics is not None:
+        if reduce_text is not None:
+            labels[reduce_text] = Path(reduce_prompt).name
+        metrics.label_prompts(labels)
+    _watch_concurrency(adaptive, metrics, verbose)
+    previous_limiter = set_rate_limiter(rate_limiter)
+    previous_metrics = set_metrics(metrics)
+    previous_concurrency = set_concurrency(adaptive)
+    previous_router = set_router(router)
+    files = Prefetcher(paths, max_bytes=prefetch_bytes)
+    try:
+        if batch:
+            _run_batch(run, files, batch_poll_interval)
+        else:
+            items, process = files, None
+            if pack_tokens is not None:
+                items = FilePacker(files, pack_tokens, pack_file_tokens)
+                process = partial(_process_pack, run)
+            asyncio.run(
+                _run(
+                    run,
+                    items,
+                    concurrency,
+                    use_async,
+                    http_pool,
+                    chunk_tokens,
+                    merge,
+                    reduce_text,
+                    process,
+                )
+            )
+    finally:
+        files.close()
+        set_rate_limiter(previous_limiter)
+        set_metrics(previous_metrics)
+        set_concurrency(previous_concurrency)
+        set_router(previous_router)
+        if metrics is not None:
+            metrics.finish()
+        if log is not None:
+            log.close()
+        if run.writer is not None:
+            run.writer.close()
+    if verbose and run.writer is not None:
+        _report_writes(run)
+    if verbose and cache is not None:
+        typer.echo(f"Cache: {cache.hits} hits, {cache.misses} misses")
+    if verbose and dedupe:
+        typer.echo(f"Dedupe: {run.deduplicated} calls saved")
+    if verbose and adaptive is not None:
+        typer.echo(f"Concurrency limit: {adaptive.limit}")
+    if verbose and regex is not None:
+        typer.echo(regex.summary())
+
+
+class _JobFeed:
+    """Thread-safe iterator that claims queue jobs and reads their files.
+
+    Yields ``(job, path, text, run)`` where *run* is a copy of *base* set up
+    for the job's prompt chain. Jobs whose file cannot be read are failed
+    and skipped. With *wait*, an empty queue is polled every
+    *poll_interval* seconds until no job is pending or leased.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        worker: str,
+        base: _RunContext,
+        active: "_Leases",
+        wait: bool,
+        poll_interval: float,
+        max_attempts: int,
+    ) -> None:
+        self._queue = queue
+        self._worker = worker
+        self._base = base
+        self._active = active
+        self._wait = wait
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._prompts: Dict[Path, str] = {}
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> "_JobFeed":
+        return self
+
+    def __next__(self) -> Tuple[Job, Path, str, _RunContext]:
+        with self._lock:
+            while True:
+                job = self._queue.claim(self._worker)
+                if job is None:
+                    counts = self._queue.counts()
+                    if not self._wait or not counts[PENDING] + counts[LEASED]:
+                        raise StopIteration
+                    time.sleep(self._poll_interval)
+                    continue
+                try:
+                    text = job.file.read_text(encoding="utf-8", errors="replace")
+                    prompts = [(p, self._prompt(p)) for p in job.prompts]
+                except OSError as exc:
+                    self._queue.fail(self._worker, job.id, str(exc), self._max_attempts)
+                    typer.echo(f"{job.file}: {exc}", err=True)
+                    continue
+                self._active.add(job.id)
+                run = replace(self._base, prompts=prompts)
+                return job, job.file, text, run
+
+    def _prompt(self, path: Path) -> str:
+        if path not in self._prompts:
+            text = path.read_text(encoding="utf-8", errors="replace")
+            self._prompts[path] = text
+            self._base.prompt_names[text] = path.name
+            if self._base.metrics is not None:
+                self._base.metrics.label_prompts({text: path.name})
+        return self._prompts[path]
+
+
+class _Leases:
+    """Job ids a worker holds, kept alive by a heartbeat thread."""
+
+    def __init__(self, queue: JobQueue, worker: str) -> None:
+        self._queue = queue
+        self._worker = worker
+        self._ids: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+    def add(self, job_id: int) -> None:
+        with self._lock:
+            self._ids.add(job_id)
+
+    def discard(self, job_id: int) -> None:
+        with self._lock:
+            self._ids.discard(job_id)
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self._queue.lease / 3):
+            with self._lock:
+                ids = list(self._ids)
+            try:
+                self._queue.heartbeat(self._worker, ids)
+            except Exception as exc:
+                # e.g. "database is locked" under contention; the lease
+                # only lapses if every beat until it expires fails
+                typer.echo(f"heartbeat failed: {exc}", err=True)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def process_queue(
+    queue: JobQueue,
+    model: str,
+    max_tokens: int | None = None,
+    verbose: bool = False,
+    inplace: bool = False,
+    log_file: Path = Path("extracted.txt"),
+    concurrency: int = 1,
+    use_async: bool = False,
+    http_pool: HttpPoolConfig | None = None,
+    cache: ResponseCache | None = None,
+    refresh_cache: bool = False,
+    manifest: Manifest | None = None,
+    rate_limiter: RateLimiter | None = None,
+    log_flush_every: int | None = 1,
+    log_flush_interval: float | None = None,
+    log_fsync: bool = False,
+    log_index: bool = True,
+    metrics: RunMetrics | None = None,
+    dedupe: bool = True,
+    stream: bool = False,
+    worker_id: str | None = None,
+    wait: bool = False,
+    poll_interval: float = 5.0,
+    max_attempts: int = 3,
+    adaptive: AdaptiveConcurrency | None = None,
+    router: ModelRouter | None = None,
+) -> int:
+    """Claim jobs from *queue* and run their prompt chains until it is empty.
+
+    Each job names one file and the prompt files to run over it. Jobs are
+    leased to *worker_id* (a fresh id by default) and the leases are renewed
+    by a heartbeat thread while they run, so a worker that dies only holds
+    its jobs until the lease expires. A job is marked done once its last
+    record has been flushed to *log_file*, or once its file is written in
+    place. A job that raises is released for another attempt and marked
+    failed after *max_attempts*; with a *manifest*, a retried job resumes at
+    its first unfinished pass.
+
+    With *wait*, the worker keeps polling every *poll_interval* seconds
+    while other workers still hold leases, so it can pick up jobs whose
+    lease runs out. The remaining options match :func:`process_folder`.
+
+    Returns the number of jobs this worker completed.
+    """
+    worker = worker_id or new_worker_id()
+    log = None
+    if not inplace:
+        log = LogWriter(
+            Path(log_file),
+            flush_every=log_flush_every,
+            flush_interval=log_flush_interval,
+            fsync=log_fsync,
+            index=log_index,
+        )
+    base = _RunContext(
+        prompts=[],
+        model=model,
+        max_tokens=max_tokens,
+        verbose=verbose,
+        inplace=inplace,
+        log=log,
+        manifest=manifest,
+        resume=manifest is not None,
+        regex=None,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        metrics=metrics,
+        dedupe=dedupe,
+        stream=stream,
+        router=router,
+        writer=GroupedWriter() if inplace else None,
+    )
+    completed = 0
+
+    def done(job: Job) -> None:
+        nonlocal completed
+        leases.discard(job.id)
+        if queue.complete(worker, job.id):
+            completed += 1
+        elif verbose:
+            typer.echo(f"{job.file}: lease lost before completion")
+
+    async def process(
+        call: PromptCall, job: Job, md_file: Path, text: str, run: _RunContext
+    ) -> None:
+        try:
+            await _process_file(run, md_file, text, call)
+        except typer.Exit:
+            raise
+        except Exception as exc:
+            leases.discard(job.id)
+            queue.fail(worker, job.id, f"{type(exc).__name__}: {exc}", max_attempts)
+            typer.echo(f"{md_file}: {exc}", err=True)
+            return
+        if log is not None:
+            log.barrier(partial(done, job))
+        else:
+            base.writer.barrier(partial(done, job))
+
+    _watch_concurrency(adaptive, metrics, verbose)
+    previous_limiter = set_rate_limiter(rate_limiter)
+    previous_metrics = set_metrics(metrics)
+    previous_concurrency = set_concurrency(adaptive)
+    previous_router = set_router(router)
+    leases = _Leases(queue, worker)
+    jobs = _JobFeed(queue, worker, base, leases, wait, poll_interval, max_attempts)
+    try:
+        asyncio.run(
+            _run(
+                base,
+                jobs,
+                concurrency,
+                use_async,
+                http_pool,
+                None,
+                "concat",
+                None,
+                process,
+            )
+        )
+    finally:
+        if log is not None:
+            log.close()
+        else:
+            base.writer.close()
+        leases.close()
+        set_rate_limiter(previous_limiter)
+        set_metrics(previous_metrics)
+        set_concurrency(previous_concurrency)
+        set_router(previous_router)
+        if metrics is not None:
+            metrics.finish()
+    if verbose and cache is not None:
+        typer.echo(f"Cache: {cache.hits} hits, {cache.misses} misses")
+    if verbose and dedupe:
+        typer.echo(f"Dedupe: {base.deduplicated} calls saved")
+    if verbose and base.writer is not None:
+        _report_writes(base)
+    if verbose and adaptive is not None:
+        typer.echo(f"Concurrency limit: {adaptive.limit}")
+    return completed
@@ -0,0 +1,108 @@
+"""Send several small files in one request and split the answer per file."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, List, Sequence, Tuple
+import re
+
+from .ratelimit import CHARS_PER_TOKEN
+
+PACK_INSTRUCTIONS = """
+
+The input holds several independent documents. Each starts with a line
+<<<FILE n>>> and ends with a line <<<END FILE n>>>. Apply the instructions
+above to every document on its own. Answer with one block per document, in
+the same order, each starting with a line <<<RESULT n>>> and ending with a
+line <<<END RESULT n>>>, using the document's number n. Write nothing
+outside these blocks."""
+
+_RESULT = re.compile(r"<<<RESULT (\d+)>>>\n?(.*?)\n?<<<END RESULT \1>>>", re.DOTALL)
+
+
+def text_tokens(text: str) -> int:
+    """Return the estimated tokens of one file's *text* when packed."""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def pack_prompt(prompt: str) -> str:
+    """Return *prompt* extended with the packed input/output contract."""
+    return prompt.rstrip("\n") + PACK_INSTRUCTIONS
+
+
+def pack_inputs(texts: Sequence[str]) -> str:
+    """Wrap each of *texts* in numbered delimiters and join them."""
+    return "\n\n".join(
+        f"<<<FILE {n}>>>\n{text.rstrip(chr(10))}\n<<<END FILE {n}>>>"
+        for n, text in enumerate(texts, 1)
+    )
+
+
+def split_outputs(output: str, count: int) -> List[str] | None:
+    """Return the *count* per-document answers in *output*, or None.
+
+    The answer is rejected unless it has exactly one block for each of the
+    numbers 1..*count*, in order, and nothing but whitespace between them.
+    """
+    results: List[str] = []
+    pos = 0
+    for match in _RESULT.finditer(output):
+        if output[pos : match.start()].strip():
+            return None
+        if int(match.group(1)) != len(results) + 1:
+            return None
+        results.append(match.group(2))
+        pos = match.end()
+    if output[pos:].strip() or len(results) != count:
+        return None
+    return results
+
+
+class FilePacker:
+    """Group ``(path, text)`` items into lists that fit one packed request.
+
+    Files of at most *file_tokens* estimated tokens are collected, in the
+    order they arrive, until adding the next would exceed *budget* tokens.
+    Larger files are passed through alone. Safe to iterate from several
+    threads.
+    """
+
+    def __init__(
+        self, files: Iterator[Tuple[Path, str]], budget: int, file_tokens: int
+    ) -> None:
+        self._files = iter(files)
+        self.budget = budget
+        self.file_tokens = min(file_tokens, budget)
+        self._lock = Lock()
+        self._group: List[Tuple[Path, str]] = []
+        self._size = 0
+        self._ready: List[List[Tuple[Path, str]]] = []
+
+    def __iter__(self) -> "FilePacker":
+        return self
+
+    def __next__(self) -> Tuple[List[Tuple[Path, str]]]:
+        """Return the next group, wrapped in a 1-tuple for ``handle(*item)``."""
+        with self._lock:
+            while not self._ready:
+                item = next(self._files, None)
+                if item is None:
+                    if not self._group:
+                        raise StopIteration
+                    self._flush()
+                    break
+                tokens = text_tokens(item[1])
+                if tokens > self.file_tokens:
+                    self._ready.append([item])
+                    continue
+                if self._size + tokens > self.budget:
+                    self._flush()
+                self._group.append(item)
+                self._size += tokens
+            return (self._ready.pop(0),)
+
+    def _flush(self) -> None:
+        self._ready.append(self._group)
+        self._group = []
+        self._size = 0
@@ -0,0 +1,55 @@
+"""Prompt plans: which prompts chain and which run side by side."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Sequence
+
+# Separates the steps of a chain on one plan line
+CHAIN_SEP = "->"
+
+
+def fanout_plan(count: int) -> List[List[int]]:
+    """Return a plan in which each of *count* prompts runs on its own."""
+    return [[i] for i in range(count)]
+
+
+def parse_plan(text: str, prompt_paths: Sequence[Path]) -> List[List[int]]:
+    """Parse a plan into chains of indices into *prompt_paths*.
+
+    Each non-blank line is one chain of prompt files separated by ``->``;
+    blank lines and ``#`` comments are ignored. Every chain starts from the
+    file's content and feeds each output to the next step, while separate
+    chains run independently. Prompts are named by file name or by the path
+    given to ``--prompts``, and every prompt must be used exactly once.
+
+    Raises ValueError for unknown, repeated or missing prompts.
+    """
+    lookup = {}
+    for i, path in enumerate(prompt_paths):
+        lookup.setdefault(str(path), i)
+        lookup.setdefault(Path(path).name, i)
+    chains: List[List[int]] = []
+    used = set()
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        chain = []
+        for name in (step.strip() for step in line.split(CHAIN_SEP)):
+            if name not in lookup:
+                raise ValueError(f"line {lineno}: unknown prompt {name!r}")
+            idx = lookup[name]
+            if idx in used:
+                raise ValueError(f"line {lineno}: prompt {name!r} is used twice")
+            used.add(idx)
+            chain.append(idx)
+        chains.append(chain)
+    missing = [str(prompt_paths[i]) for i in range(len(prompt_paths)) if i not in used]
+    if missing:
+        raise ValueError(f"prompts missing from the plan: {', '.join(missing)}")
+    return chains
+
+
+def load_plan(path: Path, prompt_paths: Sequence[Path]) -> List[List[int]]:
+    return parse_plan(Path(path).read_text(encoding="utf-8"), prompt_paths)
@@ -0,0 +1,191 @@
+"""Shared request and token budgets for OpenAI calls."""
+
+from __future__ import annotations
+
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Callable, Iterable, Mapping
+import asyncio
+import random
+import re
+import time
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Rough size of one token in characters, used to estimate a request's cost
+CHARS_PER_TOKEN = 4
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse OpenAI reset durations such as ``"6m0s"`` or ``"20ms"``."""
+    parts = _DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+
+
+def estimate_tokens(messages: Iterable[dict], max_tokens: int | None) -> int:
+    """Return the tokens a request counts against a TPM budget."""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // CHARS_PER_TOKEN + 1 + (max_tokens or 0)
+
+
+def retry_after(exc: Exception) -> float | None:
+    """Return the server's requested delay in seconds, if it sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, exc: Exception, cap: float = 60.0) -> float:
+    """Return how long to wait before retry *attempt* + 1.
+
+    Honors ``Retry-After`` when present, otherwise uses full jitter on an
+    exponential ceiling so concurrent callers do not retry in lockstep.
+    """
+    delay = retry_after(exc)
+    if delay is not None:
+        return min(delay, cap)
+    return random.uniform(0, min(cap, 2**attempt))
+
+
+class _Bucket:
+    def __init__(self, per_minute: float, now: float) -> None:
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated)
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / 60)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        # Requests larger than the whole budget only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute.
+
+    Limits given explicitly are kept; unset ones are learned from
+    ``x-ratelimit-*`` response headers. Callers block in :meth:`acquire`
+    (or ``await`` :meth:`acquire_async`) until both budgets allow the
+    request, so concurrent workers share one schedule instead of racing
+    into 429s.
+    """
+
+    def __init__(
+        self,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        self._lock = Lock()
+        now = clock()
+        self._fixed_rpm = rpm is not None
+        self._fixed_tpm = tpm is not None
+        self._requests = _Bucket(rpm, now) if rpm else None
+        self._tokens = _Bucket(tpm, now) if tpm else None
+        self._paused_until = 0.0
+
+    @property
+    def rpm(self) -> float | None:
+        return self._requests.capacity if self._requests else None
+
+    @property
+    def tpm(self) -> float | None:
+        return self._tokens.capacity if self._tokens else None
+
+    def reserve(self, tokens: int) -> float:
+        """Take budget for one request and return 0, or the seconds to wait."""
+        with self._lock:
+            now = self._clock()
+            wait = max(0.0, self._paused_until - now)
+            for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_for(amount))
+            if wait:
+                return wait
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= min(tokens, self._tokens.capacity)
+            return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            wait = self.reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int) -> None:
+        while True:
+            wait = self.reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for *seconds*, e.g. after a 429."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Learn limits and remaining budget from ``x-ratelimit-*`` headers."""
+        with self._lock:
+            now = self._clock()
+            for kind in ("requests", "tokens"):
+                limit = _number(headers.get(f"x-ratelimit-limit-{kind}"))
+                remaining = _number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                bucket = self._requests if kind == "requests" else self._tokens
+                fixed = self._fixed_rpm if kind == "requests" else self._fixed_tpm
+                if limit and not fixed:
+                    if bucket is None:
+                        bucket = _Bucket(limit, now)
+                        if kind == "requests":
+                            self._requests = bucket
+                        else:
+                            self._tokens = bucket
+                    else:
+                        bucket.capacity = limit
+                if bucket is not None and remaining is not None:
+                    bucket.refill(now)
+                    bucket.level = min(bucket.level, remaining)
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if remaining <= 0 and reset:
+                        self._paused_until = max(self._paused_until, now + reset)
+
+
+def _number(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
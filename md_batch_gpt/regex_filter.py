@@ -0,0 +1,74 @@
+"""Pre-send filtering of Markdown content by regular expressions."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Pattern
+import json
+import re
+
+import typer
+
+from .chunking import split_sections
+
+
+class RegexFilter:
+    """Skip files no pattern matches and keep only the sections that match.
+
+    Patterns are compiled once. :meth:`select` counts the files it skipped
+    and trimmed so runs can report them.
+    """
+
+    def __init__(self, patterns: Dict[str, Pattern[str]]) -> None:
+        self.patterns = patterns
+        self.skipped = 0
+        self.trimmed = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "RegexFilter":
+        """Read patterns from *path*.
+
+        The file holds either a JSON list of patterns or an object mapping
+        names to patterns. Flags can be set inline, e.g. ``(?i)``.
+        """
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+            if isinstance(data, list):
+                data = {str(i): p for i, p in enumerate(data)}
+            if not isinstance(data, dict) or not all(
+                isinstance(p, str) for p in data.values()
+            ):
+                raise ValueError("expected a list or object of pattern strings")
+            patterns = {name: re.compile(p, re.MULTILINE) for name, p in data.items()}
+        except (OSError, ValueError, re.error) as exc:
+            typer.echo(f"Invalid regex JSON {path}: {exc}", err=True)
+            raise typer.Exit(code=1)
+        return cls(patterns)
+
+    def _matches(self, text: str) -> bool:
+        return any(p.search(text) for p in self.patterns.values())
+
+    def select(self, text: str, trim: bool = True) -> str | None:
+        """Return the part of *text* to send, or None to skip the file.
+
+        With *trim*, only the heading sections containing a match are kept.
+        Without patterns every file is sent whole.
+        """
+        if not self.patterns:
+            return text
+        if not self._matches(text):
+            self.skipped += 1
+            return None
+        if not trim:
+            return text
+        kept = [s for s in split_sections(text) if self._matches(s)]
+        if not kept:
+            # Matches that span sections: keep the whole file
+            return text
+        selected = "".join(kept)
+        if len(selected) < len(text):
+            self.trimmed += 1
+        return selected
+
+    def summary(self) -> str:
+        return f"Regex filter: {self.skipped} skipped, {self.trimmed} trimmed"
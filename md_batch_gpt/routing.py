@@ -0,0 +1,165 @@
+"""Per-request model choice by input size, prompt and observed latency."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from threading import Lock
+from typing import Callable, Dict, List, Mapping, Tuple
+import time
+
+from .ratelimit import CHARS_PER_TOKEN
+
+# Weight of the newest sample in each model's smoothed latency
+_LATENCY_ALPHA = 0.2
+
+
+@dataclass(frozen=True)
+class RouteRule:
+    """Send matching requests to *model*.
+
+    A request matches when its prompt file name matches one of the *prompts*
+    globs (any prompt if empty) and its input's token estimate lies within
+    *min_input_tokens* and *max_input_tokens*. With *max_latency_s*, the rule
+    is skipped while the model's smoothed latency is above that.
+    """
+
+    model: str
+    prompts: Tuple[str, ...] = ()
+    min_input_tokens: int | None = None
+    max_input_tokens: int | None = None
+    max_latency_s: float | None = None
+
+    def matches(self, prompt_name: str | None, tokens: int) -> bool:
+        if self.prompts and not any(
+            fnmatchcase(prompt_name or "", pattern) for pattern in self.prompts
+        ):
+            return False
+        if self.min_input_tokens is not None and tokens < self.min_input_tokens:
+            return False
+        if self.max_input_tokens is not None and tokens > self.max_input_tokens:
+            return False
+        return True
+
+
+class ModelRouter:
+    """Pick a model for each request and fail over when one is overloaded.
+
+    :meth:`choose` returns the model of the first matching rule, or
+    *default*. Failures reported with :meth:`record_failure` count against a
+    model; after *fail_after* in a row it is skipped for *cooldown* seconds
+    and requests for it go straight to its fallback. The fallback of a model
+    is its entry in *fallbacks*, else *fallback*.
+
+    Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        default: str,
+        rules: List[RouteRule] | None = None,
+        fallback: str | None = None,
+        fallbacks: Mapping[str, str] | None = None,
+        fail_after: int = 3,
+        cooldown: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.default = default
+        self.rules = list(rules or [])
+        self.fallback = fallback
+        self.fallbacks = dict(fallbacks or {})
+        self.fail_after = fail_after
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = Lock()
+        self._failures: Dict[str, int] = {}
+        self._skip_until: Dict[str, float] = {}
+        self._latency: Dict[str, float] = {}
+
+    @classmethod
+    def from_config(cls, data: Mapping, default: str) -> "ModelRouter":
+        """Build a router from a ``[tool.md_batch_gpt.routing]`` table.
+
+        Raises ValueError if the table is malformed.
+        """
+        rules = []
+        for entry in data.get("rules", []):
+            if not isinstance(entry, Mapping) or "model" not in entry:
+                raise ValueError("every routing rule needs a model")
+            prompts = entry.get("prompts", ())
+            if isinstance(prompts, str):
+                prompts = (prompts,)
+            unknown = set(entry) - {
+                "model",
+                "prompts",
+                "min_input_tokens",
+                "max_input_tokens",
+                "max_latency_s",
+            }
+            if unknown:
+                raise ValueError(
+                    f"unknown routing rule keys: {', '.join(sorted(unknown))}"
+                )
+            rules.append(
+                RouteRule(
+                    model=str(entry["model"]),
+                    prompts=tuple(prompts),
+                    min_input_tokens=entry.get("min_input_tokens"),
+                    max_input_tokens=entry.get("max_input_tokens"),
+                    max_latency_s=entry.get("max_latency_s"),
+                )
+            )
+        return cls(
+            default,
+            rules,
+            fallback=data.get("fallback"),
+            fallbacks=data.get("fallbacks"),
+            fail_after=int(data.get("fail_after", 3)),
+            cooldown=float(data.get("cooldown", 60.0)),
+        )
+
+    def choose(self, prompt_name: str | None, text: str) -> str:
+        """Return the model for a request with this prompt and input."""
+        tokens = len(text) // CHARS_PER_TOKEN
+        model = self.default
+        with self._lock:
+            for rule in self.rules:
+                if not rule.matches(prompt_name, tokens):
+                    continue
+                latency = self._latency.get(rule.model)
+                if rule.max_latency_s is not None and latency is not None:
+                    if latency > rule.max_latency_s:
+                        continue
+                model = rule.model
+                break
+            if self._skip_until.get(model, 0.0) > self._clock():
+                return self._fallback_for(model) or model
+        return model
+
+    def _fallback_for(self, model: str) -> str | None:
+        fallback = self.fallbacks.get(model, self.fallback)
+        return fallback if fallback != model else None
+
+    def fallback_for(self, model: str) -> str | None:
+        """Return the model to retry on when *model* is overloaded, if any."""
+        return self._fallback_for(model)
+
+    def record_success(self, model: str, latency: float | None = None) -> None:
+        with self._lock:
+            self._failures[model] = 0
+            if latency is not None:
+                previous = self._latency.get(model)
+                self._latency[model] = (
+                    latency
+                    if previous is None
+                    else previous + _LATENCY_ALPHA * (latency - previous)
+                )
+
+    def record_failure(self, model: str) -> None:
+        """Count a 429/5xx from *model*; skip it for a while if it keeps failing."""
+        with self._lock:
+            failures = self._failures.get(model, 0) + 1
+            self._failures[model] = failures
+            if failures >= self.fail_after:
+                self._skip_until[model] = self._clock() + self.cooldown
+                self._failures[model] = 0
@@ -1,3 +1,6 @@
+import json
+
+
 class RateLimitError(Exception):
     pass
 
@@ -22,14 +25,72 @@ class _Choice:
 
 
 class _Completions:
+    def __init__(self):
+        self.with_raw_response = _RawCompletions(self)
+
     def create(self, **params):
+        if params.get("stream"):
+            return _stream_chunks(self._create(**params))
+        return self._create(**params)
+
+    def _create(self, **params):
         prompt = params.get("messages")[0]["content"]
         content = params.get("messages")[1]["content"]
+        usage = type(
+            "Usage",
+            (),
+            {"prompt_tokens": len(prompt) + len(content), "completion_tokens": 1},
+        )()
         return type(
-            "Resp", (), {"choices": [_Choice(f"{content}[{prompt.strip()}]")]}
+            "Resp",
+            (),
+            {"choices": [_Choice(f"{content}[{prompt.strip()}]")], "usage": usage},
         )()
 
 
+def _stream_chunks(response):
+    """Split a response into stream chunks of two characters each."""
+    text = response.choices[0].message.content
+    chunks = []
+    for i in range(0, len(text), 2):
+        delta = type("Delta", (), {"content": text[i : i + 2]})()
+        choice = type("ChunkChoice", (), {"delta": delta})()
+        chunks.append(type("Chunk", (), {"choices": [choice], "usage": None})())
+    chunks.append(type("Chunk", (), {"choices": [], "usage": response.usage})())
+    return chunks
+
+
+class _AsyncStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _RawResponse:
+    def __init__(self, parsed):
+        self.headers = {}
+        self._parsed = parsed
+
+    def parse(self):
+        return self._parsed
+
+
+class _RawCompletions:
+    def __init__(self, completions):
+        self.completions = completions
+
+    def create(self, **params):
+        return _RawResponse(self.completions.create(**params))
+
+
 class _Chat:
     def __init__(self):
         self.completions = _Completions()
@@ -38,3 +99,106 @@ class _Chat:
 class OpenAI:
     def __init__(self, api_key=None):
         self.chat = _Chat()
+        self.files = _Files()
+        self.batches = _Batches(self.files)
+
+
+class _AsyncCompletions:
+    def __init__(self):
+        self.with_raw_response = _AsyncRawCompletions(self)
+
+    async def create(self, **params):
+        response = _Completions().create(**params)
+        if params.get("stream"):
+            return _AsyncStream(response)
+        return response
+
+
+class _AsyncRawCompletions:
+    def __init__(self, completions):
+        self.completions = completions
+
+    async def create(self, **params):
+        return _RawResponse(await self.completions.create(**params))
+
+
+class _AsyncChat:
+    def __init__(self):
+        self.completions = _AsyncCompletions()
+
+
+class DefaultAsyncHttpxClient:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+class AsyncOpenAI:
+    def __init__(self, api_key=None, http_client=None):
+        self.http_client = http_client
+        self.chat = _AsyncChat()
+
+    async def close(self):
+        pass
+
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _Files:
+    def __init__(self):
+        self.store = {}
+
+    def create(self, file, purpose):
+        name, data = file
+        file_id = f"file-{len(self.store)}"
+        self.store[file_id] = data.decode("utf-8")
+        return _Obj(id=file_id, filename=name, purpose=purpose)
+
+    def content(self, file_id):
+        return _Obj(text=self.store[file_id])
+
+
+class _Batches:
+    def __init__(self, files):
+        self.files = files
+        self.batches = {}
+
+    def create(self, input_file_id, endpoint, completion_window):
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = _Obj(
+            id=batch_id,
+            status="validating",
+            input_file_id=input_file_id,
+            output_file_id=None,
+        )
+        return self.batches[batch_id]
+
+    def retrieve(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch.status == "validating":
+            batch.status = "in_progress"
+        elif batch.status == "in_progress":
+            lines = []
+            for line in self.files.store[batch.input_file_id].splitlines():
+                request = json.loads(line)
+                resp = _Completions().create(**request["body"])
+                body = {
+                    "choices": [
+                        {"message": {"content": resp.choices[0].message.content}}
+                    ]
+                }
+                lines.append(
+                    json.dumps(
+                        {
+                            "custom_id": request["custom_id"],
+                            "response": {"status_code": 200, "body": body},
+                        }
+                    )
+                )
+            output_id = f"file-{len(self.files.store)}"
+            self.files.store[output_id] = "\n".join(lines) + "\n"
+            batch.output_file_id = output_id
+            batch.status = "completed"
+        return batch
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from md_batch_gpt.cache import ResponseCache, default_cache_path
+
+
+def test_make_key_inputs():
+    key = ResponseCache.make_key("m", "prompt", "content", None)
+    assert key == ResponseCache.make_key("m", "prompt", "content", None)
+    assert key != ResponseCache.make_key("m2", "prompt", "content", None)
+    assert key != ResponseCache.make_key("m", "prompt2", "content", None)
+    assert key != ResponseCache.make_key("m", "prompt", "content2", None)
+    assert key != ResponseCache.make_key("m", "prompt", "content", 10)
+
+
+def test_get_put_counts(tmp_path):
+    cache = ResponseCache(tmp_path / "c.sqlite3")
+    key = cache.make_key("m", "p", "c", None)
+    assert cache.get(key) is None
+    cache.put(key, "m", "out")
+    assert cache.get(key) == "out"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    reopened = ResponseCache(tmp_path / "c.sqlite3")
+    assert reopened.get(key) == "out"
+    reopened.close()
+
+
+def test_evict_by_size_drops_least_recent(tmp_path):
+    cache = ResponseCache(tmp_path / "c.sqlite3", max_bytes=10)
+    cache.put("a", "m", "12345")
+    time.sleep(0.01)
+    cache.put("b", "m", "12345")
+    time.sleep(0.01)
+    assert cache.get("a") == "12345"
+    cache.put("c", "m", "12345")
+
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    assert cache.get("c") == "12345"
+
+
+def test_evict_by_age(tmp_path):
+    cache = ResponseCache(tmp_path / "c.sqlite3", max_age=60)
+    cache.put("old", "m", "x")
+    cache._conn.execute("UPDATE responses SET created = ?", (time.time() - 120,))
+    assert cache.get("old") is None
+    assert cache.evict() == 1
+
+
+def test_default_cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_path() == tmp_path / "md_batch_gpt" / "responses.sqlite3"
+
+
+def test_shared_between_threads_and_connections(tmp_path):
+    path = tmp_path / "c.sqlite3"
+    cache = ResponseCache(path, busy_timeout=5)
+    other = ResponseCache(path)
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: cache.put(str(i), "m", f"out{i}"), range(20)))
+    assert [other.get(str(i)) for i in range(20)] == [f"out{i}" for i in range(20)]
+    cache.close()
+    other.close()
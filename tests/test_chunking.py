@@ -0,0 +1,50 @@
+from md_batch_gpt.chunking import chunk_markdown, concat_outputs, split_sections
+
+DOC = """Intro line
+
+# One
+alpha
+
+## Two
+beta
+
+```
+# not a heading
+```
+
+# Three
+gamma
+"""
+
+
+def test_split_sections_roundtrip():
+    sections = split_sections(DOC)
+    assert "".join(sections) == DOC
+    assert [s.splitlines()[0] for s in sections] == [
+        "Intro line",
+        "# One",
+        "## Two",
+        "# Three",
+    ]
+
+
+def test_small_text_is_one_chunk():
+    assert chunk_markdown(DOC, 1000) == [DOC]
+
+
+def test_chunks_respect_budget_and_headings():
+    chunks = chunk_markdown(DOC, 10)
+    assert "".join(chunks) == DOC
+    assert all(len(c) <= 40 for c in chunks)
+    assert any(c.startswith("## Two") for c in chunks)
+
+
+def test_oversized_section_is_split():
+    text = "# Big\n" + "word " * 100
+    chunks = chunk_markdown(text, 10)
+    assert "".join(chunks) == text
+    assert all(len(c) <= 40 for c in chunks)
+
+
+def test_concat_outputs():
+    assert concat_outputs(["a\n", "\nb"]) == "a\n\nb"
@@ -1,6 +1,9 @@
 import importlib
+import json
 from pathlib import Path
 
+import pytest
+import typer
 from typer.testing import CliRunner
 
 
@@ -25,6 +28,7 @@ def test_run_dry_run(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(tmp_path),
             "--dry-run",
             "--prompts",
@@ -38,6 +42,40 @@ def test_run_dry_run(monkeypatch, tmp_path: Path):
     assert "a.md" in result.stdout
     assert "b.md" in result.stdout
     assert "Prompt count: 2" in result.stdout
+    assert "Total" in result.stdout
+    assert "Wall clock:" in result.stdout
+
+
+def test_dry_run_estimate_json(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A" * 400)
+    stats = tmp_path / "stats.json"
+    stats.write_text(
+        '{"latency_s": {"sum": 6.0, "count": 2},'
+        ' "tokens": {"prompt": 100, "completion": 50}}'
+    )
+    out = tmp_path / "estimate.json"
+    args = ["run", str(docs), "--prompts", "tests/data/p1.txt", "--model", "gpt-4o"]
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.app,
+        args + ["--dry-run", "--estimate-json", str(out), "--calibrate", str(stats)],
+    )
+    assert result.exit_code == 0, result.output
+    data = json.loads(out.read_text())
+    assert data["files"] == 1
+    assert data["assumptions"]["output_ratio"] == 0.5
+    assert data["assumptions"]["latency_s"] == 3.0
+    assert data["cost_usd"]["gpt-4o"] > 0
+    assert data["per_file"][0]["path"].endswith("a.md")
+
+    result = runner.invoke(cli.app, args + ["--estimate-json", str(out)])
+    assert result.exit_code != 0
+    assert "requires --dry-run" in result.output
 
 
 def test_run_max_tokens(monkeypatch, tmp_path: Path):
@@ -57,6 +95,7 @@ def test_run_max_tokens(monkeypatch, tmp_path: Path):
         verbose: bool = False,
         inplace: bool = False,
         log_file: Path | None = None,
+        **_: object,
     ) -> None:
         captured["max_tokens"] = max_tokens
 
@@ -68,6 +107,7 @@ def test_run_max_tokens(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(tmp_path),
             "--prompts",
             "tests/data/p1.txt",
@@ -101,7 +141,7 @@ def test_run_auto_prompt_dir(monkeypatch, tmp_path: Path):
     monkeypatch.setattr(cli, "__file__", str(dummy_cli_path))
 
     runner = CliRunner()
-    result = runner.invoke(cli.app, [str(docs), "--verbose"])
+    result = runner.invoke(cli.app, ["run", str(docs), "--verbose"])
 
     assert result.exit_code == 0, result.stdout
     assert "pass 3/3" in result.stdout
@@ -124,6 +164,7 @@ def test_run_regex_json(monkeypatch, tmp_path: Path):
         verbose: bool = False,
         inplace: bool = False,
         log_file: Path | None = None,
+        **_: object,
     ) -> None:
         captured["regex_json"] = regex_json
 
@@ -137,6 +178,7 @@ def test_run_regex_json(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(tmp_path),
             "--prompts",
             "tests/data/p1.txt",
@@ -177,6 +219,7 @@ def test_end_to_end_modes(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(docs),
             "--prompts",
             str(p1),
@@ -202,6 +245,7 @@ def test_end_to_end_modes(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(docs),
             "--prompts",
             str(p1),
@@ -219,6 +263,34 @@ def test_end_to_end_modes(monkeypatch, tmp_path: Path):
     assert log_file.read_text() == ""
 
 
+def test_finished_run_compacts_manifest(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    calls = []
+
+    def fake_send(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        return f"{content}[{prompt.strip()}]"
+
+    monkeypatch.setattr("md_batch_gpt.orchestrator.send_prompt", fake_send)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    log_file = tmp_path / "extracted.txt"
+    args = ["run", str(docs), "--log-file", str(log_file), "--no-inplace"]
+    args += ["--prompts", "tests/data/p1.txt", "--prompts", "tests/data/p2.txt"]
+
+    runner = CliRunner()
+    assert runner.invoke(cli.app, args).exit_code == 0
+    manifest = (tmp_path / "extracted.txt.manifest").read_text()
+    assert len(manifest.splitlines()) == 2
+    assert '"text"' not in manifest
+
+    result = runner.invoke(cli.app, args + ["--resume"])
+    assert result.exit_code == 0, result.output
+    assert len(calls) == 2
+
+
 def test_unwritable_log_file(monkeypatch, tmp_path: Path):
     monkeypatch.setenv("OPENAI_API_KEY", "dummy")
 
@@ -239,6 +311,7 @@ def test_unwritable_log_file(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(docs),
             "--prompts",
             "tests/data/p1.txt",
@@ -269,6 +342,7 @@ def test_log_file_resolution(monkeypatch, tmp_path: Path):
         verbose: bool = False,
         inplace: bool = False,
         log_file: Path | None = None,
+        **_: object,
     ) -> None:
         captured["log_file"] = log_file
 
@@ -280,6 +354,7 @@ def test_log_file_resolution(monkeypatch, tmp_path: Path):
     result = runner.invoke(
         cli.app,
         [
+            "run",
             str(tmp_path),
             "--prompts",
             "tests/data/p1.txt",
@@ -290,3 +365,165 @@ def test_log_file_resolution(monkeypatch, tmp_path: Path):
 
     assert result.exit_code == 0, result.stdout
     assert captured["log_file"] == Path.cwd() / Path("out.txt")
+
+
+def test_missing_api_key_only_fails_real_runs(monkeypatch, tmp_path: Path):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    cli = import_cli()
+    monkeypatch.setattr(
+        importlib.sys.modules["md_batch_gpt.config"], "OPENAI_API_KEY", None
+    )
+    (tmp_path / "a.md").write_text("A")
+    args = ["run", str(tmp_path), "--prompts", "tests/data/p1.txt"]
+
+    runner = CliRunner()
+    result = runner.invoke(cli.app, args + ["--dry-run"])
+    assert result.exit_code == 0, result.stdout
+    assert "a.md" in result.stdout
+
+    result = runner.invoke(cli.app, args)
+    assert result.exit_code == 1
+    assert "OPENAI_API_KEY" in result.output
+
+
+def test_parse_shard():
+    cli = import_cli()
+    assert cli.parse_shard("2/8") == (1, 8)
+    assert cli.parse_shard(None) is None
+    for bad in ("0/4", "5/4", "2", "a/b"):
+        with pytest.raises(typer.BadParameter):
+            cli.parse_shard(bad)
+
+
+def test_merge_command(tmp_path: Path):
+    cli = import_cli()
+    from md_batch_gpt.log_io import LogWriter
+
+    logs = [tmp_path / "s1.txt", tmp_path / "s2.txt"]
+    for log, name in zip(logs, ("b.md", "a.md")):
+        with LogWriter(log) as writer:
+            writer.write(Path(name), Path("p.txt"), name.upper())
+
+    runner = CliRunner()
+    out = tmp_path / "all.txt"
+    result = runner.invoke(cli.app, ["merge", *map(str, logs), "-o", str(out)])
+    assert result.exit_code == 0, result.output
+    assert "Merged 2 records from 2 logs" in result.output
+    assert out.read_text().index("A.MD") < out.read_text().index("B.MD")
+
+    result = runner.invoke(cli.app, ["merge", str(logs[0]), "-o", str(logs[0])])
+    assert result.exit_code != 0
+
+
+def test_sharded_runs_merge_by_input_path(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    monkeypatch.setattr(
+        "md_batch_gpt.orchestrator.send_prompt",
+        lambda prompt, content, model, max_tokens=None: content,
+    )
+    docs = tmp_path / "docs"
+    names = ["a.md", "x/a.md", "y/a.md", "y/b.md"]
+    for name in names:
+        (docs / name).parent.mkdir(parents=True, exist_ok=True)
+        (docs / name).write_text(name)
+
+    runner = CliRunner()
+    logs = [tmp_path / "s1.txt", tmp_path / "s2.txt"]
+    for i, log in enumerate(logs, 1):
+        result = runner.invoke(
+            cli.app,
+            ["run", str(docs), "--prompts", "tests/data/p1.txt", "--no-inplace"]
+            + ["--log-file", str(log), "--shard", f"{i}/2"],
+        )
+        assert result.exit_code == 0, result.output
+    out = tmp_path / "all.txt"
+    result = runner.invoke(cli.app, ["merge", *map(str, logs), "-o", str(out)])
+    assert result.exit_code == 0, result.output
+
+    headers = [line for line in out.read_text().splitlines() if line.startswith("===")]
+    assert headers == [f"=== {name} | prompt: p1.txt ===" for name in names]
+
+
+def test_enqueue_and_worker_commands(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    monkeypatch.setattr(
+        "md_batch_gpt.orchestrator.send_prompt", lambda p, c, m, t=None: c + "!"
+    )
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    (docs / "b.md").write_text("B")
+    queue = tmp_path / "q.db"
+
+    runner = CliRunner()
+    args = ["enqueue", str(docs), "--queue", str(queue)]
+    args += ["--prompts", "tests/data/p1.txt"]
+    result = runner.invoke(cli.app, args)
+    assert result.exit_code == 0, result.output
+    assert "Enqueued 2 jobs" in result.output
+    result = runner.invoke(cli.app, args)
+    assert "Enqueued 0 jobs" in result.output
+
+    result = runner.invoke(
+        cli.app,
+        ["worker", "--queue", str(queue), "--inplace", "--no-cache"],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Completed 2 jobs" in result.output
+    assert (docs / "a.md").read_text() == "A!"
+    assert (docs / "b.md").read_text() == "B!"
+
+
+def test_workers_write_separate_logs(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    monkeypatch.setattr(
+        "md_batch_gpt.orchestrator.send_prompt", lambda p, c, m, t=None: c + "!"
+    )
+    prompt = str(Path("tests/data/p1.txt").resolve())
+    monkeypatch.chdir(tmp_path)
+    queue = str(tmp_path / "q.db")
+    runner = CliRunner()
+    for worker_id, names in (("w1", ["a"]), ("w2", ["b", "c"])):
+        docs = tmp_path / worker_id
+        docs.mkdir()
+        for name in names:
+            (docs / f"{name}.md").write_text(name)
+        runner.invoke(
+            cli.app, ["enqueue", str(docs), "--queue", queue, "--prompts", prompt]
+        )
+        result = runner.invoke(
+            cli.app,
+            ["worker", "--queue", queue, "--no-cache", "--worker-id", worker_id],
+        )
+        assert result.exit_code == 0, result.output
+
+    logs = [tmp_path / "extracted.w1.txt", tmp_path / "extracted.w2.txt"]
+    assert logs[0].read_text().count("=== ") == 1
+    assert logs[1].read_text().count("=== ") == 2
+    result = runner.invoke(cli.app, ["merge", *map(str, logs), "-o", "all.txt"])
+    assert "Merged 3 records from 2 logs" in result.output
+
+
+def test_plan_options_are_validated(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    cli = import_cli()
+    (tmp_path / "a.md").write_text("A")
+    plan = tmp_path / "plan.txt"
+    plan.write_text("p1.txt\n")
+    base = ["run", str(tmp_path), "--prompts", "tests/data/p1.txt"]
+    base += ["--prompts", "tests/data/p2.txt"]
+
+    runner = CliRunner()
+    result = runner.invoke(cli.app, base + ["--plan", str(plan)])
+    assert result.exit_code != 0
+    assert "missing from the plan" in result.output
+    result = runner.invoke(cli.app, base + ["--fanout", "--inplace"])
+    assert result.exit_code != 0
+    result = runner.invoke(cli.app, base + ["--fanout", "--plan", str(plan)])
+    assert result.exit_code != 0
+    result = runner.invoke(cli.app, base + ["--fanout", "--pack-tokens", "1000"])
+    assert result.exit_code != 0
+    assert "--pack-tokens cannot be combined" in result.output
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+
+from md_batch_gpt.concurrency import AdaptiveConcurrency
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 0.001
+        return self.now
+
+
+def test_slow_start_then_additive_increase():
+    changes = []
+    gate = AdaptiveConcurrency(
+        20, latency_factor=None, on_change=changes.append, clock=FakeClock()
+    )
+    for _ in range(3):
+        gate.release(gate.acquire(), latency=1.0)
+    assert gate.limit == 4
+    gate.release(gate.acquire(), congested=True)
+    assert gate.limit == 2
+    for _ in range(4):
+        gate.release(gate.acquire(), latency=1.0)
+    # About one step per limit's worth of successes after the first cut
+    assert gate.limit == 3
+    assert changes == [2, 3, 4, 2, 3]
+    assert gate.decreases == 1
+
+
+def test_burst_of_errors_cuts_once_and_respects_bounds():
+    gate = AdaptiveConcurrency(8, min_limit=2, initial=8, clock=FakeClock())
+    starts = [gate.acquire() for _ in range(8)]
+    for start in starts:
+        gate.release(start, congested=True)
+    assert gate.limit == 4
+    # Attempts sent after the cut count again
+    for _ in range(3):
+        gate.release(gate.acquire(), congested=True)
+    assert gate.limit == 2
+    assert gate.decreases == 4
+    for _ in range(50):
+        gate.release(gate.acquire(), latency=1.0)
+    assert gate.limit <= 8
+
+
+def test_latency_spike_cuts_limit():
+    gate = AdaptiveConcurrency(10, initial=6, latency_factor=2.0, clock=FakeClock())
+    for _ in range(5):
+        gate.release(gate.acquire(), latency=1.0)
+    assert gate.limit == 10
+    while gate.decreases == 0:
+        gate.release(gate.acquire(), latency=10.0)
+    assert gate.limit == 5
+
+
+def test_acquire_blocks_at_the_limit():
+    gate = AdaptiveConcurrency(4, initial=1, latency_factor=None)
+    start = gate.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        gate.release(gate.acquire(), latency=1.0)
+        acquired.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not acquired.wait(0.1)
+    assert gate.in_flight == 1
+    gate.release(start, latency=1.0)
+    assert acquired.wait(5)
+    thread.join()
+    assert gate.in_flight == 0
+
+
+def test_cancelled_async_waiter_gives_back_its_slot():
+    gate = AdaptiveConcurrency(4, initial=1, latency_factor=None)
+
+    async def main():
+        start = await gate.acquire_async()
+        waiter = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.release(start, latency=1.0)
+        # Slow start raised the limit to two; both slots are free
+        first = await gate.acquire_async()
+        second = await gate.acquire_async()
+        assert gate.in_flight == 2
+        gate.release(first)
+        gate.release(second)
+
+    asyncio.run(main())
+    assert gate.in_flight == 0
@@ -32,5 +32,7 @@ def test_missing_api_key(monkeypatch):
     env_file = Path(".env")
     if env_file.exists():
         env_file.unlink()
+    config = import_config()
+    assert config.OPENAI_API_KEY is None
     with pytest.raises(RuntimeError):
-        import_config()
+        config.require_api_key()
@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from md_batch_gpt.estimate import (
+    DEFAULT_PRICES,
+    Calibration,
+    RunEstimate,
+    format_estimate,
+    parse_prices,
+)
+
+
+def test_chain_passes_read_the_previous_output():
+    calibration = Calibration(chars_per_token=4, output_ratio=0.5, latency=2.0)
+    estimate = RunEstimate(
+        [("a.txt", "x" * 40), ("b.txt", "y" * 8)], [[0, 1]], calibration
+    )
+    estimate.add_file(Path("doc.md"), "z" * 360)
+
+    passes = estimate.files[0]["passes"]
+    assert passes[0] == {"prompt": "a.txt", "input_tokens": 100, "output_tokens": 50}
+    assert passes[1] == {"prompt": "b.txt", "input_tokens": 52, "output_tokens": 26}
+
+
+def test_plan_chains_start_from_the_file_and_max_tokens_caps_output():
+    calibration = Calibration(chars_per_token=1, output_ratio=1.0)
+    estimate = RunEstimate([("a", ""), ("b", "")], [[0], [1]], calibration, 30)
+    estimate.add_file(Path("doc.md"), "z" * 100)
+
+    assert [p["input_tokens"] for p in estimate.files[0]["passes"]] == [100, 100]
+    assert [p["output_tokens"] for p in estimate.files[0]["passes"]] == [30, 30]
+
+
+def test_summary_costs_and_wall_clock_bound():
+    calibration = Calibration(chars_per_token=1, output_ratio=0.0, latency=5.0)
+    estimate = RunEstimate([("a", ""), ("b", "")], [[0, 1]], calibration)
+    for i in range(4):
+        estimate.add_file(Path(f"{i}.md"), "z" * 1_000_000)
+
+    data = estimate.summary("mine", {"cheap": (1.0, 2.0)}, concurrency=2)
+    assert data["requests"] == 8
+    assert data["cost_usd"] == {"cheap": 4.0, "mine": None}
+    # the second pass reads an empty output; two waves of two-pass files
+    assert data["wall_clock_s"] == 20.0
+    assert data["bound_by"] == "concurrency"
+
+    data = estimate.summary("cheap", {}, concurrency=2, rpm=6, tpm=8_000_000)
+    assert data["wall_clock_s"] == 80.0
+    assert data["bound_by"] == "rpm"
+    table = format_estimate(data)
+    assert table.splitlines()[3].split() == ["Total", "8", "4000000", "0"]
+    assert "cheap *" in table
+    assert "bound by rpm" in table
+    json.dumps(data)
+
+
+def test_calibration_from_stats(tmp_path: Path):
+    stats = tmp_path / "stats.json"
+    stats.write_text(
+        json.dumps(
+            {
+                "latency_s": {"sum": 12.0, "count": 4},
+                "tokens": {"prompt": 1000, "completion": 300},
+            }
+        )
+    )
+    calibration = Calibration.from_stats(stats, chars_per_token=3.5)
+    assert calibration == Calibration(3.5, 0.3, 3.0)
+
+    stats.write_text(json.dumps({"latency_s": {"count": 0}, "tokens": {}}))
+    with pytest.raises(ValueError):
+        Calibration.from_stats(stats)
+
+
+def test_parse_prices():
+    prices = parse_prices(
+        {"o3": {"input": 1, "output": 4}, "local": {"input": 0, "output": 0}}
+    )
+    assert prices["o3"] == (1.0, 4.0)
+    assert prices["local"] == (0.0, 0.0)
+    assert prices["gpt-4o"] == DEFAULT_PRICES["gpt-4o"]
+    with pytest.raises(ValueError):
+        parse_prices({"o3": {"input": 1}})
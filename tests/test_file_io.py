@@ -1,6 +1,17 @@
+import time
 from pathlib import Path
 
-from md_batch_gpt.file_io import iter_markdown_files, write_atomic
+import pytest
+
+from md_batch_gpt.file_io import (
+    GroupedWriter,
+    Prefetcher,
+    iter_markdown_files,
+    select_shard,
+    shard_of,
+    walk_order_key,
+    write_atomic,
+)
 
 
 def test_iter_markdown_files(tmp_path: Path):
@@ -34,3 +45,164 @@ def test_write_atomic_creates_parents(tmp_path: Path):
     write_atomic(nested_target, "content")
     assert nested_target.read_text() == "content"
     assert (tmp_path / "subdir" / "nested").is_dir()
+
+
+def make_tree(root: Path, files):
+    for rel in files:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(rel)
+
+
+def rel_list(root: Path, paths):
+    return [p.relative_to(root).as_posix() for p in paths]
+
+
+def test_iter_markdown_files_stable_order_and_pruning(tmp_path: Path):
+    make_tree(
+        tmp_path,
+        [
+            "b.md",
+            "a.md",
+            "z/inner.md",
+            "m/x.md",
+            "node_modules/pkg/readme.md",
+            ".git/info.md",
+        ],
+    )
+    found = iter_markdown_files(tmp_path, exclude=["node_modules"])
+    assert rel_list(tmp_path, found) == ["a.md", "b.md", "m/x.md", "z/inner.md"]
+
+
+def test_iter_markdown_files_include_exclude(tmp_path: Path):
+    make_tree(tmp_path, ["a.md", "notes.txt", "drafts/b.md", "docs/c.md", "docs/d.md"])
+    results = iter_markdown_files(
+        tmp_path, include=["*.md", "*.txt"], exclude=["drafts", "docs/d.md"]
+    )
+    assert rel_list(tmp_path, results) == ["a.md", "notes.txt", "docs/c.md"]
+
+
+def test_iter_markdown_files_gitignore(tmp_path: Path):
+    make_tree(
+        tmp_path,
+        [
+            "keep.md",
+            "build/out.md",
+            "docs/tmp.md",
+            "docs/keep-tmp.md",
+            "docs/sub/local.md",
+            "other/build/x.md",
+        ],
+    )
+    (tmp_path / ".gitignore").write_text("# comment\n/build/\n*tmp.md\n!keep-tmp.md\n")
+    (tmp_path / "docs" / "sub" / ".gitignore").write_text("local.md\n")
+
+    assert rel_list(tmp_path, iter_markdown_files(tmp_path, use_gitignore=True)) == [
+        "keep.md",
+        "docs/keep-tmp.md",
+        "other/build/x.md",
+    ]
+    assert len(list(iter_markdown_files(tmp_path))) == 6
+
+
+def test_iter_markdown_files_defaults_find_everything(tmp_path: Path):
+    # Only dotfiles are skipped unless pruning is asked for
+    make_tree(tmp_path, ["a.md", "node_modules/pkg/readme.md", "build/out.md"])
+    (tmp_path / ".gitignore").write_text("build/\n")
+    assert rel_list(tmp_path, iter_markdown_files(tmp_path)) == [
+        "a.md",
+        "build/out.md",
+        "node_modules/pkg/readme.md",
+    ]
+
+
+def test_prefetcher_keeps_order(tmp_path: Path):
+    make_tree(tmp_path, ["a.md", "b.md", "c.md"])
+    paths = [tmp_path / name for name in ("c.md", "a.md", "b.md")]
+    with Prefetcher(iter(paths)) as files:
+        assert [(p.name, text) for p, text in files] == [
+            ("c.md", "c.md"),
+            ("a.md", "a.md"),
+            ("b.md", "b.md"),
+        ]
+
+
+def test_prefetcher_bounds_buffered_bytes(tmp_path: Path):
+    make_tree(tmp_path, ["a.md", "b.md", "c.md"])
+    seen = []
+
+    def paths():
+        for name in ("a.md", "b.md", "c.md"):
+            seen.append(name)
+            yield tmp_path / name
+
+    with Prefetcher(paths(), max_bytes=4) as files:
+        time.sleep(0.1)
+        # One 4-byte file buffered, the reader waiting on the next one
+        assert seen == ["a.md", "b.md"]
+        assert [p.name for p, _ in files] == ["a.md", "b.md", "c.md"]
+
+
+def test_prefetcher_reads_oversized_file_alone(tmp_path: Path):
+    (tmp_path / "big.md").write_text("x" * 100)
+    with Prefetcher(iter([tmp_path / "big.md"]), max_bytes=10) as files:
+        assert [text for _, text in files] == ["x" * 100]
+
+
+def test_prefetcher_raises_read_errors(tmp_path: Path):
+    (tmp_path / "a.md").write_text("a")
+    with Prefetcher(iter([tmp_path / "a.md", tmp_path / "missing.md"])) as files:
+        assert next(files)[1] == "a"
+        with pytest.raises(FileNotFoundError):
+            next(files)
+
+
+def test_shards_are_disjoint_and_stable(tmp_path: Path):
+    names = [f"m{d}/lesson{f}.md" for d in range(5) for f in range(20)]
+    make_tree(tmp_path, names)
+    shards = [
+        rel_list(tmp_path, select_shard(iter_markdown_files(tmp_path), tmp_path, i, 3))
+        for i in range(3)
+    ]
+    assert sorted(sum(shards, [])) == sorted(names)
+    assert all(shards)
+    assert shard_of("m1/lesson3.md", 3) == shard_of("m1/lesson3.md", 3)
+    for i, shard in enumerate(shards):
+        assert all(shard_of(rel, 3) == i for rel in shard)
+
+
+def test_walk_order_key_matches_discovery(tmp_path: Path):
+    make_tree(tmp_path, ["b.md", "a/z.md", "a/b/c.md", "a/a.md", "c/d.md", "a.md"])
+    found = rel_list(tmp_path, iter_markdown_files(tmp_path))
+    assert sorted(found, key=walk_order_key) == found
+
+
+def test_grouped_writer(tmp_path: Path):
+    a, b = tmp_path / "a.md", tmp_path / "sub" / "b.md"
+    a.write_text("old")
+    durable = []
+    with GroupedWriter() as writer:
+        assert writer.write(a, "new", current="old")
+        assert writer.write(b, "made")
+        assert not writer.write(a, "same", current="same")
+        writer.barrier(lambda: durable.append(a.read_text()))
+    assert durable == ["new"]
+    assert a.read_text() == "new"
+    assert b.read_text() == "made"
+    assert (writer.written, writer.unchanged) == (2, 1)
+    assert 1 <= writer.groups <= 2
+    assert sorted(p.name for p in tmp_path.rglob("*") if p.is_file()) == [
+        "a.md",
+        "b.md",
+    ]
+
+
+def test_grouped_writer_raises_commit_errors(tmp_path: Path):
+    target = tmp_path / "dir.md"
+    target.mkdir()
+    (target / "x").write_text("keep")
+    writer = GroupedWriter()
+    writer.write(target, "data")
+    with pytest.raises(OSError):
+        writer.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["dir.md"]
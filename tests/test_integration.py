@@ -1,3 +1,4 @@
+import json
 from pathlib import Path
 from .runner import run_cli
 
@@ -20,6 +21,7 @@ def test_extraction_mode(tmp_path: Path):
 
     proc = run_cli(
         [
+            "run",
             str(docs),
             "--prompts",
             str(p1),
@@ -56,6 +58,7 @@ def test_extraction_mode(tmp_path: Path):
     # run again in inplace mode and ensure log stays empty
     proc = run_cli(
         [
+            "run",
             str(docs),
             "--prompts",
             str(p1),
@@ -70,3 +73,43 @@ def test_extraction_mode(tmp_path: Path):
     assert proc.returncode == 0, proc.stdout + proc.stderr
     assert [f.read_text() for f in files] == ["A[P1][P2]", "B[P1][P2]"]
     assert log_path.read_text() == content
+
+
+def test_stats_output(tmp_path: Path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("P1")
+    stats_json = tmp_path / "stats.json"
+    stats_prom = tmp_path / "stats.prom"
+
+    proc = run_cli(
+        [
+            "run",
+            str(docs),
+            "--prompts",
+            str(p1),
+            "--log-file",
+            str(tmp_path / "log.txt"),
+            "--no-cache",
+            "--stream",
+            "--stats",
+            "--stats-json",
+            str(stats_json),
+            "--stats-prom",
+            str(stats_prom),
+        ],
+        cwd=Path(__file__).resolve().parent.parent,
+    )
+
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "Tokens p1.txt: 3 prompt, 1 completion (1 requests)" in proc.stdout
+    assert "Time to first token p50/p95/p99" in proc.stdout
+    assert (
+        "=== a.md | prompt: p1.txt ===\nA[P1]\n" in (tmp_path / "log.txt").read_text()
+    )
+    data = json.loads(stats_json.read_text())
+    assert data["requests"] == 1
+    assert data["files"] == 1
+    assert "mdgpt_files_processed_total 1" in stats_prom.read_text()
@@ -0,0 +1,77 @@
+from pathlib import Path
+
+from md_batch_gpt.jobqueue import DONE, FAILED, LEASED, PENDING, JobQueue
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_queue(tmp_path: Path, **kwargs) -> JobQueue:
+    files = [tmp_path / "a.md", tmp_path / "b.md"]
+    queue = JobQueue(tmp_path / "q.db", **kwargs)
+    queue.enqueue(files, [tmp_path / "p1.txt", tmp_path / "p2.txt"])
+    return queue
+
+
+def test_enqueue_is_idempotent(tmp_path: Path):
+    queue = make_queue(tmp_path)
+    assert (
+        queue.enqueue([tmp_path / "a.md"], [tmp_path / "p1.txt", tmp_path / "p2.txt"])
+        == 0
+    )
+    assert queue.enqueue([tmp_path / "a.md"], [tmp_path / "p1.txt"]) == 1
+    assert queue.counts()[PENDING] == 3
+
+
+def test_claims_are_exclusive_across_connections(tmp_path: Path):
+    queue = make_queue(tmp_path)
+    other = JobQueue(tmp_path / "q.db")
+    first = queue.claim("w1")
+    second = other.claim("w2")
+    assert first.file == (tmp_path / "a.md").resolve()
+    assert first.prompts == [
+        (tmp_path / "p1.txt").resolve(),
+        (tmp_path / "p2.txt").resolve(),
+    ]
+    assert first.attempts == 1
+    assert second.id != first.id
+    assert queue.claim("w1") is None
+    assert other.counts()[LEASED] == 2
+    other.close()
+
+
+def test_expired_lease_is_reclaimed(tmp_path: Path):
+    clock = FakeClock()
+    queue = make_queue(tmp_path, lease=60, clock=clock)
+    job = queue.claim("w1")
+    queue.claim("w1")
+    clock.now += 50
+    assert queue.heartbeat("w1", [job.id]) == 1
+    clock.now += 30
+    # Only the job that missed its heartbeat is free again
+    again = queue.claim("w2")
+    assert again.id != job.id
+    assert again.attempts == 2
+    assert queue.claim("w2") is None
+    # The first holder lost that job and cannot complete it
+    assert not queue.complete("w1", again.id)
+    assert queue.complete("w2", again.id)
+    assert queue.complete("w1", job.id)
+    assert queue.counts()[DONE] == 2
+
+
+def test_fail_retries_until_max_attempts(tmp_path: Path):
+    queue = make_queue(tmp_path)
+    queue.enqueue([], [])
+    job = queue.claim("w")
+    queue.fail("w", job.id, "boom", max_attempts=2)
+    assert queue.counts()[PENDING] == 2
+    job = queue.claim("w")
+    assert job.attempts == 2
+    queue.fail("w", job.id, "boom", max_attempts=2)
+    assert queue.counts() == {PENDING: 1, LEASED: 0, DONE: 0, FAILED: 1}
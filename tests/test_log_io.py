@@ -1,4 +1,11 @@
-from md_batch_gpt.log_io import append_log_record
+import time
+from pathlib import Path
+
+import pytest
+import typer
+
+from md_batch_gpt import log_io
+from md_batch_gpt.log_io import LogWriter, append_log_record
 
 
 def test_append_log_record(tmp_path):
@@ -7,7 +14,229 @@ def test_append_log_record(tmp_path):
     src.write_text("dummy")
     prm = tmp_path / "p.txt"
     prm.write_text("prompt")
-    append_log_record(log, src, prm, "OUTPUT")
+    append_log_record(log, src, prm, "OUTPUT", root=tmp_path)
     content = log.read_text(encoding="utf-8")
     assert "=== a.md | prompt: p.txt ===" in content
     assert "OUTPUT" in content
+
+
+def test_record_paths_never_collide(tmp_path):
+    log = tmp_path / "log.txt"
+    docs = tmp_path / "docs"
+    with LogWriter(log, root=docs) as writer:
+        writer.write(docs / "x" / "a.md", Path("p.txt"), "XA")
+        writer.write(docs / "y" / "a.md", Path("p.txt"), "YA")
+        # Outside the input folder and the working directory
+        writer.write(tmp_path / "a.md", Path("p.txt"), "A")
+    with log_io.LogReader(log) as reader:
+        paths = [entry["path"] for entry in reader.iter_index()]
+    assert paths == ["x/a.md", "y/a.md", (tmp_path / "a.md").resolve().as_posix()]
+
+
+def test_log_writer_records_in_order(tmp_path):
+    log = tmp_path / "log.txt"
+    flushed = []
+    with LogWriter(log, flush_every=None) as writer:
+        for i in range(50):
+            writer.write(
+                Path(f"f{i}.md"),
+                Path("p.txt"),
+                f"OUT{i}",
+                lambda i=i: flushed.append(i),
+            )
+    blocks = [b for b in log.read_text().split("\n---\n") if b.strip()]
+    assert len(blocks) == 50
+    assert blocks[7] == "=== f7.md | prompt: p.txt ===\nOUT7\n"
+    assert flushed == list(range(50))
+
+
+def test_log_writer_flush_every(tmp_path, monkeypatch):
+    fsyncs = []
+    monkeypatch.setattr(log_io.os, "fsync", fsyncs.append)
+    log = tmp_path / "log.txt"
+    writer = log_io.LogWriter(log, flush_every=2, fsync=True)
+    flushed = []
+    for i in range(5):
+        writer.write(Path("a.md"), Path("p.txt"), str(i), lambda i=i: flushed.append(i))
+    writer.close()
+    # Two flushes of two records, then the last one at close; the index is
+    # synced alongside the log each time
+    assert len(set(fsyncs)) == 2
+    assert len(fsyncs) == 6
+    assert flushed == [0, 1, 2, 3, 4]
+
+
+def test_log_writer_flush_interval(tmp_path):
+    log = tmp_path / "log.txt"
+    writer = LogWriter(log, flush_every=None, flush_interval=0.01)
+    writer.write(Path("a.md"), Path("p.txt"), "OUT")
+    deadline = time.monotonic() + 2
+    while "OUT" not in log.read_text() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert "OUT" in log.read_text()
+    writer.close()
+
+
+def test_log_writer_unwritable(tmp_path, capsys):
+    writer = LogWriter(tmp_path)
+    with pytest.raises(typer.Exit):
+        writer.write(Path("a.md"), Path("p.txt"), "OUT")
+    assert "Cannot write to log file" in capsys.readouterr().err
+    writer.close()
+
+
+def test_index_and_reader(tmp_path):
+    log = tmp_path / "log.txt"
+    with LogWriter(log, run_id="run-1") as writer:
+        writer.write(Path("a.md"), Path("p1.txt"), "A1\n---\nnot a separator")
+        writer.write(Path("a.md"), Path("p2.txt"), "A2")
+        writer.write(Path("b.md"), Path("p1.txt"), "")
+    with LogWriter(log, run_id="run-2") as writer:
+        writer.write(Path("a.md"), Path("p1.txt"), "A1 again")
+
+    assert log_io.index_path_for(log) == tmp_path / "log.txt.idx"
+    with log_io.LogReader(log) as reader:
+        records = list(reader.iter_records())
+        assert [(r.path, r.prompt, r.output) for r in records] == [
+            ("a.md", "p1.txt", "A1\n---\nnot a separator"),
+            ("a.md", "p2.txt", "A2"),
+            ("b.md", "p1.txt", ""),
+            ("a.md", "p1.txt", "A1 again"),
+        ]
+
+        found = list(reader.find("a.md", prompt="p1.txt"))
+        assert [(r.output, r.run) for r in found] == [
+            ("A1\n---\nnot a separator", "run-1"),
+            ("A1 again", "run-2"),
+        ]
+        assert [r.output for r in reader.find("a.md", run="run-1")] == [
+            "A1\n---\nnot a separator",
+            "A2",
+        ]
+        assert found[1].offset == records[3].offset
+        assert found[1].length == records[3].length
+
+
+def test_reader_empty_log(tmp_path):
+    log = tmp_path / "log.txt"
+    log.write_text("")
+    with log_io.LogReader(log) as reader:
+        assert list(reader.iter_records()) == []
+        assert list(reader.find("a.md")) == []
+
+
+def test_log_stream_matches_whole_record(tmp_path):
+    log = tmp_path / "log.txt"
+    with LogWriter(log) as writer:
+        with writer.stream(Path("a.md"), Path("p.txt")) as record:
+            for chunk in ("Line 1\n", "\n", "Line 2", "\n\n"):
+                record.write(chunk)
+        writer.write(Path("b.md"), Path("p.txt"), "Line 1\n\nLine 2\n\n")
+    first = log.read_text().split("=== b.md")[0]
+    assert first == log_io.format_record(
+        Path("a.md"), Path("p.txt"), "Line 1\n\nLine 2"
+    )
+    with log_io.LogReader(log) as reader:
+        assert [r.output for r in reader.find("a.md")] == ["Line 1\n\nLine 2"]
+
+
+def test_log_stream_writes_progressively_and_stays_intact(tmp_path):
+    log = tmp_path / "log.txt"
+    flushed = []
+    with LogWriter(log) as writer:
+        first = writer.stream(Path("a.md"), Path("p.txt"))
+        second = writer.stream(Path("b.md"), Path("p.txt"))
+        writer.write(Path("c.md"), Path("p.txt"), "C")
+        # The waiting stream and record are held back, not interleaved
+        second.write("B1")
+        first.write("A1")
+        deadline = time.monotonic() + 2
+        while "A1" not in log.read_text() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert log.read_text() == "=== a.md | prompt: p.txt ===\nA1"
+        second.write("B2")
+        first.write("A2")
+        first.finish(lambda: flushed.append("a"))
+        second.finish(lambda: flushed.append("b"))
+    blocks = [b for b in log.read_text().split("\n---\n") if b.strip()]
+    assert blocks == [
+        "=== a.md | prompt: p.txt ===\nA1A2\n",
+        "=== b.md | prompt: p.txt ===\nB1B2\n",
+        "=== c.md | prompt: p.txt ===\nC\n",
+    ]
+    assert flushed == ["a", "b"]
+
+
+def test_log_stream_abort_is_not_indexed(tmp_path):
+    log = tmp_path / "log.txt"
+    flushed = []
+    with LogWriter(log) as writer:
+        with pytest.raises(RuntimeError):
+            with writer.stream(Path("a.md"), Path("p.txt")) as record:
+                record.write("partial")
+                raise RuntimeError("boom")
+        writer.write(Path("b.md"), Path("p.txt"), "B", lambda: flushed.append(1))
+    assert "partial\n[stream aborted]\n\n---\n" in log.read_text()
+    with log_io.LogReader(log) as reader:
+        assert [e["path"] for e in reader.iter_index()] == ["b.md"]
+        assert [r.output for r in reader.find("b.md")] == ["B"]
+    assert flushed == [1]
+
+
+def test_merge_logs(tmp_path):
+    first = tmp_path / "shard1.txt"
+    second = tmp_path / "shard2.txt"
+    with LogWriter(first, run_id="run-1") as writer:
+        writer.write(Path.cwd() / "a.md", Path("p1.txt"), "A1")
+        writer.write(Path.cwd() / "a.md", Path("p2.txt"), "A2")
+        writer.write(Path.cwd() / "sub/c.md", Path("p1.txt"), "C1")
+    with LogWriter(second, index=False) as writer:
+        writer.write(Path.cwd() / "b.md", Path("p1.txt"), "B1")
+        writer.write(Path.cwd() / "sub/a.md", Path("p1.txt"), "SA1")
+
+    merged = tmp_path / "merged.txt"
+    assert log_io.merge_logs([first, second], merged) == 5
+
+    with log_io.LogReader(merged) as reader:
+        records = list(reader.iter_records())
+        assert [(r.path, r.output) for r in records] == [
+            ("a.md", "A1"),
+            ("a.md", "A2"),
+            ("b.md", "B1"),
+            ("sub/a.md", "SA1"),
+            ("sub/c.md", "C1"),
+        ]
+        entries = list(reader.iter_index())
+        assert [(e["path"], e["run"]) for e in entries] == [
+            ("a.md", "run-1"),
+            ("a.md", "run-1"),
+            ("b.md", None),
+            ("sub/a.md", None),
+            ("sub/c.md", "run-1"),
+        ]
+        assert [r.output for r in reader.find("sub/c.md")] == ["C1"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "merged.txt",
+        "merged.txt.idx",
+        "shard1.txt",
+        "shard1.txt.idx",
+        "shard2.txt",
+    ]
+
+
+def test_records_with_model(tmp_path):
+    log = tmp_path / "log.txt"
+    models = iter(["fallback"])
+    with LogWriter(log) as writer:
+        writer.write(Path("a.md"), Path("p.txt"), "A", model="small")
+        with writer.stream(Path("b.md"), Path("p.txt"), lambda: next(models)) as rec:
+            rec.write("B")
+        writer.write(Path("c.md"), Path("p.txt"), "C")
+    assert log.read_text().startswith("=== a.md | prompt: p.txt | model: small ===\n")
+    with log_io.LogReader(log) as reader:
+        records = list(reader.iter_records())
+    assert [(r.path, r.prompt, r.model) for r in records] == [
+        ("a.md", "p.txt", "small"),
+        ("b.md", "p.txt", "fallback"),
+        ("c.md", "p.txt", None),
+    ]
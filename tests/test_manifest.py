@@ -0,0 +1,88 @@
+from pathlib import Path
+
+from md_batch_gpt.manifest import Manifest
+
+
+def test_path_for(tmp_path: Path):
+    assert Manifest.path_for(tmp_path / "log.txt") == tmp_path / "log.txt.manifest"
+
+
+def test_resume_extraction(tmp_path: Path):
+    md = tmp_path / "a.md"
+    path = tmp_path / "log.manifest"
+    manifest = Manifest(path)
+    assert not path.exists()
+    manifest.record(md, 0, "p1", "A", "A1", keep_text=True)
+    manifest.close()
+
+    reloaded = Manifest(path)
+    assert reloaded.resume_extraction(md, ["p1", "p2"], "A") == (1, "A1")
+    # Changed source or prompt chain starts over
+    assert reloaded.resume_extraction(md, ["p1", "p2"], "B") == (0, "B")
+    assert reloaded.resume_extraction(md, ["x", "p2"], "A") == (0, "A")
+
+    reloaded.record(md, 1, "p2", "A1", "A2")
+    assert reloaded.resume_extraction(md, ["p1", "p2"], "A")[0] == 2
+
+
+def test_resume_inplace(tmp_path: Path):
+    md = tmp_path / "a.md"
+    manifest = Manifest(tmp_path / "log.manifest")
+    manifest.record(md, 0, "p1", "A", "A1")
+    manifest.record(md, 1, "p2", "A1", "A2")
+
+    assert manifest.resume_inplace(md, ["p1", "p2", "p3"], "A1") == 1
+    assert manifest.resume_inplace(md, ["p1", "p2", "p3"], "A2") == 2
+    assert manifest.resume_inplace(md, ["p1", "p2"], "A2") == 2
+    assert manifest.resume_inplace(md, ["p1", "p2"], "other") == 0
+
+
+def test_torn_line_ignored(tmp_path: Path):
+    path = tmp_path / "log.manifest"
+    Manifest(path).record(tmp_path / "a.md", 0, "p", "A", "B")
+    with path.open("a") as f:
+        f.write('{"file": "x", "pa')
+    assert Manifest(path).resume_inplace(tmp_path / "a.md", ["p"], "B") == 1
+
+
+def test_resume_kept(tmp_path: Path):
+    md = tmp_path / "a.md"
+    manifest = Manifest(tmp_path / "log.manifest")
+    manifest.record(md, 0, "p1", "A", "A1", keep_text=True)
+    manifest.record(md, 1, "p2", "A1", "A2", keep_text=True)
+    manifest.record(md, 2, "p3", "A2", "A3")
+
+    prompts = ["p1", "p2", "p3"]
+    # The file was never written: continue from the kept outputs, but re-run
+    # the final pass, whose write may not have happened
+    assert manifest.resume_kept(md, prompts, 0, "A") == (2, "A2")
+    assert manifest.resume_kept(md, prompts, 0, "B") == (0, "B")
+    assert manifest.resume_kept(md, prompts, 3, "A3") == (3, "A3")
+
+
+def test_compact(tmp_path: Path):
+    md, other = tmp_path / "a.md", tmp_path / "b.md"
+    path = tmp_path / "log.manifest"
+    manifest = Manifest(path)
+    manifest.record(md, 0, "p1", "A", "A1", keep_text=True)
+    manifest.record(md, 0, "p1", "A", "A1", keep_text=True)
+    manifest.record(md, 1, "p2", "A1", "A2", keep_text=True)
+    manifest.record(md, 2, "p3", "A2", "A3")
+    # An interrupted chain still needs its kept text
+    manifest.record(other, 0, "p1", "B", "B1", keep_text=True)
+    manifest.compact()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 4
+    assert sum('"text"' in line for line in lines) == 1
+    prompts = ["p1", "p2", "p3"]
+    for reloaded in (manifest, Manifest(path)):
+        assert reloaded.resume_extraction(md, prompts, "A")[0] == 3
+        assert reloaded.resume_extraction(other, prompts, "B") == (1, "B1")
+        # A changed last prompt re-runs from the last pass whose text is kept
+        assert reloaded.resume_extraction(md, ["p1", "p2", "x"], "A") == (0, "A")
+
+    # Recording continues after compaction
+    manifest.record(other, 1, "p2", "B1", "B2", keep_text=True)
+    assert manifest.resume_extraction(other, prompts, "B") == (2, "B2")
+    assert len(path.read_text().splitlines()) == 5
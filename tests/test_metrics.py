@@ -0,0 +1,95 @@
+import json
+from pathlib import Path
+
+from md_batch_gpt.metrics import RunMetrics, percentile
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_summary_groups_by_prompt_label():
+    clock = FakeClock()
+    metrics = RunMetrics(clock=clock)
+    metrics.label_prompts({"Extract": "01_extract.txt"})
+    metrics.record_request("m", "Extract", 1.0, 10, 2)
+    metrics.record_request("m", "Extract", 3.0, 20, 4, retries=2)
+    metrics.record_request("m", "Unknown", 2.0, error="RateLimitError")
+    metrics.record_file()
+    clock.now = 30.0
+    metrics.finish()
+
+    data = metrics.summary()
+    assert data["requests"] == 3
+    assert data["retries"] == 2
+    assert data["errors"] == {"RateLimitError": 1}
+    assert data["latency_s"]["p50"] == 2.0
+    assert data["prompts"]["01_extract.txt"] == {
+        "requests": 2,
+        "prompt_tokens": 30,
+        "completion_tokens": 6,
+    }
+    assert data["prompts"]["other"]["requests"] == 1
+    assert data["files_per_min"] == 2.0
+
+    text = metrics.format_summary()
+    assert "Latency p50/p95/p99: 2.000s / 3.000s / 3.000s" in text
+    assert "Tokens 01_extract.txt: 30 prompt, 6 completion (2 requests)" in text
+    assert "Files: 1 in 30.0s (2.0 files/min)" in text
+
+
+def test_untimed_requests_count_tokens_only():
+    metrics = RunMetrics()
+    metrics.record_request("m", "p", None, 5, 1)
+    data = metrics.summary()
+    assert data["latency_s"]["count"] == 0
+    assert data["latency_s"]["p50"] is None
+    assert data["tokens"] == {"prompt": 5, "completion": 1}
+
+
+def test_write_json_and_prometheus(tmp_path: Path):
+    metrics = RunMetrics()
+    metrics.label_prompts({"P": 'we"ird.txt'})
+    metrics.record_request("m", "P", 0.3, 7, 3, retries=1)
+    metrics.record_request("m", "P", 4.0, 1, 1)
+    metrics.record_file()
+    metrics.finish()
+
+    metrics.write_json(tmp_path / "stats.json")
+    assert json.loads((tmp_path / "stats.json").read_text())["requests"] == 2
+
+    metrics.write_prometheus(tmp_path / "stats.prom")
+    lines = (tmp_path / "stats.prom").read_text().splitlines()
+    assert 'mdgpt_request_duration_seconds_bucket{le="0.25"} 0' in lines
+    assert 'mdgpt_request_duration_seconds_bucket{le="0.5"} 1' in lines
+    assert 'mdgpt_request_duration_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'mdgpt_tokens_total{prompt="we\\"ird.txt",kind="prompt"} 8' in lines
+    assert "mdgpt_retries_total 1" in lines
+    assert "mdgpt_files_processed_total 1" in lines
+
+
+def test_concurrency_limit_is_reported():
+    metrics = RunMetrics()
+    assert metrics.summary()["concurrency"] is None
+    for limit in (1, 2, 4, 2, 3):
+        metrics.record_concurrency(limit)
+    assert metrics.summary()["concurrency"] == {
+        "limit": 3,
+        "min": 1,
+        "max": 4,
+        "decreases": 1,
+    }
+    assert "Concurrency limit: 3 (range 1-4, 1 decreases)" in metrics.format_summary()
+    assert "mdgpt_concurrency_limit 3" in metrics.to_prometheus()
@@ -0,0 +1,415 @@
+import asyncio
+import importlib
+import importlib.util
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+def import_client():
+    if "md_batch_gpt.openai_client" in importlib.sys.modules:
+        del importlib.sys.modules["md_batch_gpt.openai_client"]
+    return importlib.import_module("md_batch_gpt.openai_client")
+
+
+class _FakeAsyncOpenAI:
+    instances = []
+
+    def __init__(self, api_key=None, http_client=None):
+        self.http_client = http_client
+        self.closed = False
+        self.chat = self
+        self.completions = self
+        _FakeAsyncOpenAI.instances.append(self)
+
+    async def create(self, **params):
+        prompt = params["messages"][0]["content"]
+        content = params["messages"][1]["content"]
+        message = type("M", (), {"content": f"{content}[{prompt}]"})()
+        choice = type("C", (), {"message": message})()
+        return type("R", (), {"choices": [choice]})()
+
+    async def close(self):
+        self.closed = True
+
+
+def test_async_send_prompt_uses_pooled_session(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    captured = {}
+
+    def fake_http_client(**kwargs):
+        captured.update(kwargs)
+        return object()
+
+    monkeypatch.setattr(client._sdk(), "AsyncOpenAI", _FakeAsyncOpenAI)
+    monkeypatch.setattr(client._sdk(), "DefaultAsyncHttpxClient", fake_http_client)
+
+    pool = client.HttpPoolConfig(max_connections=7, max_keepalive_connections=3)
+
+    async def main():
+        async with client.async_client_session(pool):
+            return await asyncio.gather(
+                *(client.async_send_prompt("p", str(i), "m", None) for i in range(5))
+            )
+
+    results = asyncio.run(main())
+
+    assert results == [f"{i}[p]" for i in range(5)]
+    assert len(_FakeAsyncOpenAI.instances) == 1
+    assert _FakeAsyncOpenAI.instances[0].closed
+    assert client._async_client is None
+    assert captured["limits"].max_connections == 7
+    assert captured["limits"].max_keepalive_connections == 3
+
+
+def load_stub():
+    spec = importlib.util.spec_from_file_location(
+        "openai_stub", Path(__file__).parent / "stubs" / "openai.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_run_chat_batch(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    stub_client = load_stub().OpenAI()
+    monkeypatch.setattr(client, "_client", stub_client)
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+
+    statuses = []
+    results = client.run_chat_batch(
+        {"0": ("P", "A"), "1": ("P", "B")},
+        model="m",
+        max_tokens=5,
+        on_status=lambda batch_id, status: statuses.append(status),
+    )
+
+    assert results == {"0": "A[P]", "1": "B[P]"}
+    assert statuses[-1] == "completed"
+    uploaded = [
+        json.loads(line) for line in stub_client.files.store["file-0"].splitlines()
+    ]
+    assert uploaded[0]["custom_id"] == "0"
+    assert uploaded[0]["url"] == "/v1/chat/completions"
+    assert uploaded[0]["body"]["max_tokens"] == 5
+
+
+def test_run_chat_batch_failed_status(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    stub_client = load_stub().OpenAI()
+    monkeypatch.setattr(client, "_client", stub_client)
+
+    original_create = stub_client.batches.create
+
+    def failing_create(**kwargs):
+        batch = original_create(**kwargs)
+        batch.status = "failed"
+        return batch
+
+    monkeypatch.setattr(stub_client.batches, "create", failing_create)
+
+    with pytest.raises(RuntimeError, match="failed"):
+        client.run_chat_batch({"0": ("P", "A")}, model="m", max_tokens=None)
+
+
+def test_chat_request_uses_rate_limiter(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    from md_batch_gpt.ratelimit import RateLimiter
+
+    stub = load_stub()
+    stub_client = stub.OpenAI()
+    monkeypatch.setattr(client, "_client", stub_client)
+
+    raw_create = stub_client.chat.completions.with_raw_response.create
+
+    def create_with_headers(**params):
+        raw = raw_create(**params)
+        raw.headers = {"x-ratelimit-limit-requests": "500"}
+        return raw
+
+    monkeypatch.setattr(
+        stub_client.chat.completions.with_raw_response, "create", create_with_headers
+    )
+
+    limiter = RateLimiter()
+    previous = client.set_rate_limiter(limiter)
+    try:
+        assert client.send_prompt("P", "A", "m", None) == "A[P]"
+    finally:
+        client.set_rate_limiter(previous)
+    assert limiter.rpm == 500
+
+
+def test_chat_request_honors_retry_after(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": "3"}, request=request)
+    attempts = []
+
+    class FlakyCompletions:
+        def create(self, **params):
+            attempts.append(params)
+            if len(attempts) < 3:
+                raise client._sdk().RateLimitError("busy", response=response, body=None)
+            return load_stub()._Completions().create(**params)
+
+    fake = type("C", (), {})()
+    fake.chat = type("Chat", (), {"completions": FlakyCompletions()})()
+    monkeypatch.setattr(client, "_client", fake)
+    sleeps = []
+    monkeypatch.setattr(client.time, "sleep", sleeps.append)
+
+    assert client.send_prompt("P", "A", "m", None) == "A[P]"
+    assert sleeps == [3, 3]
+
+
+def test_import_is_lazy(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    code = (
+        "import sys, md_batch_gpt.cli; "
+        "assert 'openai' not in sys.modules; "
+        "assert 'httpx' not in sys.modules"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_send_prompt_records_metrics(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+    from md_batch_gpt.metrics import RunMetrics
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": "0"}, request=request)
+    attempts = []
+
+    class FlakyCompletions:
+        def create(self, **params):
+            attempts.append(params)
+            if len(attempts) < 2:
+                raise client._sdk().RateLimitError("busy", response=response, body=None)
+            return load_stub()._Completions().create(**params)
+
+    fake = type("C", (), {})()
+    fake.chat = type("Chat", (), {"completions": FlakyCompletions()})()
+    monkeypatch.setattr(client, "_client", fake)
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+
+    metrics = RunMetrics()
+    metrics.label_prompts({"P": "p.txt"})
+    previous = client.set_metrics(metrics)
+    try:
+        client.send_prompt("P", "AB", "m", None)
+    finally:
+        client.set_metrics(previous)
+
+    (record,) = metrics.requests
+    assert (record.model, record.prompt, record.retries) == ("m", "p.txt", 1)
+    assert (record.prompt_tokens, record.completion_tokens) == (3, 1)
+    assert record.error is None
+    assert record.latency is not None
+
+
+def test_stream_prompt_passes_chunks_and_records_ttft(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    from md_batch_gpt.metrics import RunMetrics
+
+    monkeypatch.setattr(client, "_client", load_stub().OpenAI())
+    metrics = RunMetrics()
+    previous = client.set_metrics(metrics)
+    chunks = []
+    try:
+        output = client.stream_prompt("P", "ABC", "m", None, chunks.append)
+    finally:
+        client.set_metrics(previous)
+
+    assert output == "ABC[P]"
+    assert chunks == ["AB", "C[", "P]"]
+    (record,) = metrics.requests
+    assert record.ttft is not None and record.ttft <= record.latency
+    assert (record.prompt_tokens, record.completion_tokens) == (4, 1)
+
+
+def test_async_stream_prompt(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    stub = load_stub()
+    monkeypatch.setattr(client._sdk(), "AsyncOpenAI", stub.AsyncOpenAI)
+    monkeypatch.setattr(
+        client._sdk(), "DefaultAsyncHttpxClient", stub.DefaultAsyncHttpxClient
+    )
+    chunks = []
+
+    async def main():
+        async with client.async_client_session():
+            return await client.async_stream_prompt("P", "AB", "m", None, chunks.append)
+
+    assert asyncio.run(main()) == "AB[P]"
+    assert "".join(chunks) == "AB[P]"
+
+
+def test_rate_limit_error_cuts_adaptive_concurrency(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+    from md_batch_gpt.concurrency import AdaptiveConcurrency
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": "0"}, request=request)
+    attempts = []
+
+    class FlakyCompletions:
+        def create(self, **params):
+            attempts.append(gate.in_flight)
+            if len(attempts) < 2:
+                raise client._sdk().RateLimitError("busy", response=response, body=None)
+            return load_stub()._Completions().create(**params)
+
+    fake = type("C", (), {})()
+    fake.chat = type("Chat", (), {"completions": FlakyCompletions()})()
+    monkeypatch.setattr(client, "_client", fake)
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+
+    gate = AdaptiveConcurrency(8, initial=4, latency_factor=None)
+    previous = client.set_concurrency(gate)
+    try:
+        assert client.send_prompt("P", "AB", "m", None) == "AB[P]"
+    finally:
+        client.set_concurrency(previous)
+
+    # Each attempt held one slot; the 429 halved the limit, the success grew it
+    assert attempts == [1, 1]
+    assert gate.in_flight == 0
+    assert gate.decreases == 1
+    assert gate.limit == 2
+
+
+def test_model_with_fallback_is_not_retried(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+    from md_batch_gpt.routing import ModelRouter
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(502, request=request)
+    attempts = []
+
+    class FailingCompletions:
+        def create(self, **params):
+            attempts.append(params["model"])
+            raise client._sdk().APIStatusError("bad", response=response, body=None)
+
+    fake = type("C", (), {})()
+    fake.chat = type("Chat", (), {"completions": FailingCompletions()})()
+    monkeypatch.setattr(client, "_client", fake)
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+
+    previous = client.set_router(ModelRouter("o3", fallback="mini"))
+    try:
+        with pytest.raises(client._sdk().APIStatusError) as info:
+            client.send_prompt("P", "AB", "o3", None)
+        assert client.is_overloaded(info.value)
+        # The fallback itself has no fallback and is retried as usual
+        with pytest.raises(client._sdk().APIStatusError):
+            client.send_prompt("P", "AB", "mini", None)
+    finally:
+        client.set_router(previous)
+    assert attempts == ["o3"] + ["mini"] * 4
+
+
+@pytest.mark.parametrize("status", [500, 503])
+def test_every_entry_point_retries_server_errors(monkeypatch, status):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    stub = load_stub()
+    attempts = []
+
+    class FlakyCompletions:
+        def create(self, **params):
+            attempts.append(params)
+            if len(attempts) % 2:
+                raise client._sdk().APIStatusError("down", response=response, body=None)
+            return stub._Completions().create(**params)
+
+    class FlakyAsyncCompletions:
+        async def create(self, **params):
+            result = FlakyCompletions().create(**params)
+            return stub._AsyncStream(result) if params.get("stream") else result
+
+    def fake(completions):
+        fake = type("C", (), {})()
+        fake.chat = type("Chat", (), {"completions": completions})()
+        return fake
+
+    monkeypatch.setattr(client, "_client", fake(FlakyCompletions()))
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+    monkeypatch.setattr(client, "backoff_delay", lambda attempt, exc: 0)
+
+    assert client.send_prompt("P", "A", "m", None) == "A[P]"
+    assert client.stream_prompt("P", "A", "m", None, lambda _: None) == "A[P]"
+
+    async def main():
+        client._async_client = fake(FlakyAsyncCompletions())
+        try:
+            return [
+                await client.async_send_prompt("P", "A", "m", None),
+                await client.async_stream_prompt("P", "A", "m", None, print),
+            ]
+        finally:
+            client._async_client = None
+
+    assert asyncio.run(main()) == ["A[P]", "A[P]"]
+    assert len(attempts) == 8
+
+
+def test_stream_is_not_retried_after_output(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    client = import_client()
+    import httpx
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    error = client._sdk().APIConnectionError(request=request)
+    attempts = []
+
+    def broken_stream():
+        yield load_stub()._stream_chunks(
+            load_stub()
+            ._Completions()
+            .create(messages=[{"content": "P"}, {"content": "A"}])
+        )[0]
+        raise error
+
+    class Completions:
+        def create(self, **params):
+            attempts.append(params)
+            return broken_stream()
+
+    fake = type("C", (), {})()
+    fake.chat = type("Chat", (), {"completions": Completions()})()
+    monkeypatch.setattr(client, "_client", fake)
+    monkeypatch.setattr(client.time, "sleep", lambda _: None)
+
+    chunks = []
+    with pytest.raises(client._sdk().APIConnectionError):
+        client.stream_prompt("P", "A", "m", None, chunks.append)
+    assert chunks == ["A["]
+    assert len(attempts) == 1
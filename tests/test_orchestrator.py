@@ -1,6 +1,11 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+import asyncio
 import importlib
+import sqlite3
+import threading
+import time
 
 
 def import_orchestrator():
@@ -174,3 +179,947 @@ def test_process_folder_invalid_bytes(monkeypatch, tmp_path: Path):
 
     # Replacement character should appear for invalid bytes
     assert md.read_text(encoding="utf-8") == "A\ufffdB[p\ufffd]"
+
+
+def test_process_folder_concurrency_inplace(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    monkeypatch.setattr(
+        orch,
+        "send_prompt",
+        lambda prompt, content, model, max_tokens=None: f"{content}[{prompt}]",
+    )
+
+    names = [f"f{i}" for i in range(8)]
+    for name in names:
+        (tmp_path / f"{name}.md").write_text(name)
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+
+    orch.process_folder(tmp_path, [p1, p2], model="m", inplace=True, concurrency=4)
+
+    for name in names:
+        assert (tmp_path / f"{name}.md").read_text() == f"{name}[p1][p2]"
+
+
+def test_process_folder_concurrency_contiguous_log(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.pop()
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(6):
+        (docs / f"f{i}.md").write_text(f"F{i}")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log_file = tmp_path / "log.txt"
+
+    orch.process_folder(docs, [p1, p2], model="m", log_file=log_file, concurrency=3)
+
+    assert 1 < max(peak) <= 3
+    blocks = [b for b in log_file.read_text().split("\n---\n") if b.strip()]
+    assert len(blocks) == 12
+    headers = [b.splitlines()[0] for b in blocks]
+    for first, second in zip(headers[::2], headers[1::2]):
+        assert first.endswith("prompt: p1.txt ===")
+        assert second == first.replace("p1.txt", "p2.txt")
+
+
+def test_process_folder_async(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    sessions = []
+    state = {"in_flight": 0, "peak": 0}
+
+    @asynccontextmanager
+    async def fake_session(pool=None):
+        sessions.append(pool)
+        yield None
+
+    async def fake_async_send_prompt(prompt, content, model, max_tokens=None):
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "async_client_session", fake_session)
+    monkeypatch.setattr(orch, "async_send_prompt", fake_async_send_prompt)
+    monkeypatch.setattr(orch, "send_prompt", lambda *a, **k: 1 / 0)
+
+    for i in range(20):
+        (tmp_path / f"f{i}.md").write_text(f"F{i}")
+    p = tmp_path / "p.txt"
+    p.write_text("p")
+
+    orch.process_folder(
+        tmp_path, [p], model="m", inplace=True, concurrency=10, use_async=True
+    )
+
+    assert len(sessions) == 1
+    assert state["peak"] == 10
+    assert (tmp_path / "f3.md").read_text() == "F3[p]"
+
+
+def test_process_folder_cache(monkeypatch, tmp_path: Path, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.cache import ResponseCache
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    p = tmp_path / "p.txt"
+    p.write_text("p")
+    log_file = tmp_path / "log.txt"
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+
+    orch.process_folder(docs, [p], model="m", log_file=log_file, cache=cache)
+    orch.process_folder(
+        docs, [p], model="m", log_file=log_file, cache=cache, verbose=True
+    )
+    assert calls == ["A"]
+    assert "Cache: 1 hits, 1 misses" in capsys.readouterr().out
+    assert log_file.read_text().count("A[p]") == 2
+
+    orch.process_folder(
+        docs, [p], model="m", log_file=log_file, cache=cache, refresh_cache=True
+    )
+    assert calls == ["A", "A"]
+
+
+def test_process_folder_resume(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.manifest import Manifest
+
+    calls = []
+
+    def flaky_send_prompt(prompt, content, model, max_tokens=None):
+        if content == "B[p1]":
+            raise KeyboardInterrupt
+        calls.append((prompt, content))
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", flaky_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    (docs / "b.md").write_text("B")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log_file = tmp_path / "log.txt"
+    manifest_path = Manifest.path_for(log_file)
+
+    try:
+        orch.process_folder(
+            docs,
+            [p1, p2],
+            model="m",
+            log_file=log_file,
+            manifest=Manifest(manifest_path),
+        )
+    except KeyboardInterrupt:
+        pass
+    assert "B[p1]" in log_file.read_text()
+
+    calls.clear()
+    monkeypatch.setattr(
+        orch,
+        "send_prompt",
+        lambda prompt, content, model, max_tokens=None: calls.append(content)
+        or f"{content}[{prompt}]",
+    )
+    orch.process_folder(
+        docs,
+        [p1, p2],
+        model="m",
+        log_file=log_file,
+        manifest=Manifest(manifest_path),
+        resume=True,
+    )
+
+    assert "B[p1]" in calls
+    assert "B" not in calls
+    log = log_file.read_text()
+    assert log.count("\n---\n") == 4
+    assert log.count("B[p1][p2]") == 1
+
+
+def test_process_folder_resume_inplace(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.manifest import Manifest
+
+    monkeypatch.setattr(
+        orch,
+        "send_prompt",
+        lambda prompt, content, model, max_tokens=None: f"{content}[{prompt}]",
+    )
+
+    md = tmp_path / "docs" / "a.md"
+    md.parent.mkdir()
+    md.write_text("A")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    manifest_path = tmp_path / "log.txt.manifest"
+
+    orch.process_folder(
+        md.parent, [p1], model="m", inplace=True, manifest=Manifest(manifest_path)
+    )
+    assert md.read_text() == "A[p1]"
+
+    orch.process_folder(
+        md.parent,
+        [p1, p2],
+        model="m",
+        inplace=True,
+        manifest=Manifest(manifest_path),
+        resume=True,
+    )
+    assert md.read_text() == "A[p1][p2]"
+
+    orch.process_folder(
+        md.parent,
+        [p1, p2],
+        model="m",
+        inplace=True,
+        manifest=Manifest(manifest_path),
+        resume=True,
+    )
+    assert md.read_text() == "A[p1][p2]"
+
+
+def test_process_folder_batch(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    submitted = []
+
+    def fake_run_chat_batch(requests, model, max_tokens, poll_interval, on_status):
+        submitted.append(dict(requests))
+        results = {
+            cid: f"{content}[{prompt}]" for cid, (prompt, content) in requests.items()
+        }
+        # Simulate one request failing inside the batch
+        results.pop("1", None)
+        return results
+
+    retried = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        retried.append(content)
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "run_chat_batch", fake_run_chat_batch)
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    (docs / "b.md").write_text("B")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log_file = tmp_path / "log.txt"
+
+    orch.process_folder(docs, [p1, p2], model="m", log_file=log_file, batch=True)
+
+    assert len(submitted) == 2
+    assert sorted(c for _, c in submitted[1].values()) == ["A[p1]", "B[p1]"]
+    assert len(retried) == 2
+    blocks = [b for b in log_file.read_text().split("\n---\n") if b.strip()]
+    headers = [b.splitlines()[0] for b in blocks]
+    assert headers[0].replace("p1.txt", "p2.txt") == headers[1]
+    assert headers[2].replace("p1.txt", "p2.txt") == headers[3]
+    assert "A[p1][p2]" in log_file.read_text()
+    assert "B[p1][p2]" in log_file.read_text()
+
+
+def test_process_folder_chunking_reduce(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    calls = []
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        with lock:
+            calls.append((prompt, content))
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        if prompt == "reduce":
+            return "REDUCED:" + content.replace("\n", "|")
+        return content.splitlines()[0].upper()
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    md = tmp_path / "docs" / "a.md"
+    md.parent.mkdir()
+    md.write_text("# one\n" + "x" * 30 + "\n# two\n" + "y" * 30 + "\n")
+    p = tmp_path / "p.txt"
+    p.write_text("p")
+    reduce_prompt = tmp_path / "reduce.txt"
+    reduce_prompt.write_text("reduce")
+
+    orch.process_folder(
+        md.parent,
+        [p],
+        model="m",
+        inplace=True,
+        chunk_tokens=10,
+        merge="reduce",
+        reduce_prompt=reduce_prompt,
+    )
+
+    assert [c[0] for c in calls] == ["p", "p", "reduce"]
+    assert md.read_text() == "REDUCED:# ONE||# TWO"
+    # Both chunks were in flight at once, even at concurrency 1
+    assert in_flight[1] == 2
+
+
+def test_process_folder_regex_filter(monkeypatch, tmp_path: Path, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        return content.upper()
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("# One\nkeep me\n# Two\ndrop\n")
+    (docs / "b.md").write_text("# Only\nnothing here\n")
+    p = tmp_path / "p.txt"
+    p.write_text("p")
+    regex_json = tmp_path / "regex.json"
+    regex_json.write_text('["keep"]')
+    log_file = tmp_path / "log.txt"
+
+    orch.process_folder(docs, [p], model="m", regex_json=regex_json, dry_run=True)
+    out = capsys.readouterr().out
+    assert "a.md" in out
+    assert "b.md" not in out
+    assert "Regex filter: 1 skipped, 1 trimmed" in out
+
+    orch.process_folder(
+        docs, [p], model="m", regex_json=regex_json, log_file=log_file, verbose=True
+    )
+    assert calls == ["# One\nkeep me\n"]
+    assert "Regex filter: 1 skipped, 1 trimmed" in capsys.readouterr().out
+    assert "b.md" not in log_file.read_text()
+
+
+def test_process_folder_dedupe(monkeypatch, tmp_path: Path, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        # Keep requests in flight long enough for the copies to join them
+        time.sleep(0.05)
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("a.md", "b.md", "c.md"):
+        (docs / name).write_text("SAME")
+    (docs / "d.md").write_text("OTHER")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log_file = tmp_path / "log.txt"
+
+    orch.process_folder(
+        docs, [p1, p2], model="m", log_file=log_file, concurrency=4, verbose=True
+    )
+
+    assert sorted(calls) == ["OTHER", "OTHER[p1]", "SAME", "SAME[p1]"]
+    log = log_file.read_text()
+    for name in ("a.md", "b.md", "c.md"):
+        assert f"=== {name} | prompt: p2.txt ===" in log
+    assert log.count("SAME[p1][p2]") == 3
+    assert "Dedupe: 4 calls saved" in capsys.readouterr().out
+
+    calls.clear()
+    orch.process_folder(docs, [p1], model="m", inplace=True, dedupe=False)
+    assert len(calls) == 4
+    assert (docs / "c.md").read_text() == "SAME[p1]"
+
+    # One file at a time, later copies reuse the finished result
+    calls.clear()
+    orch.process_folder(docs, [p1], model="m", log_file=log_file, verbose=True)
+    assert len(calls) == 2
+    assert "Dedupe: 2 calls saved" in capsys.readouterr().out
+
+
+def test_dedupe_survives_cancelled_caller(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        time.sleep(0.1)
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    run = orch._RunContext(
+        prompts=[],
+        model="m",
+        max_tokens=None,
+        verbose=False,
+        inplace=True,
+        log=None,
+        manifest=None,
+        resume=False,
+        regex=None,
+        cache=None,
+        refresh_cache=False,
+    )
+    results = []
+
+    async def process(call, name):
+        if name == "first":
+            waiter = asyncio.ensure_future(call("p", "SAME"))
+            await asyncio.sleep(0.03)
+            waiter.cancel()
+        else:
+            await asyncio.sleep(0.01)
+            results.append(await call("p", "SAME"))
+
+    files = iter([("first",), ("second",)])
+    asyncio.run(orch._run(run, files, 2, False, None, None, "concat", None, process))
+
+    # The copy still waiting gets the result of the one request
+    assert results == ["SAME[p]"]
+    assert calls == ["SAME"]
+
+
+def test_process_folder_batch_dedupe(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+
+    submitted = []
+
+    def fake_run_chat_batch(requests, model, max_tokens, poll_interval, on_status):
+        submitted.append(dict(requests))
+        return {cid: f"{c}[{p}]" for cid, (p, c) in requests.items()}
+
+    monkeypatch.setattr(orch, "run_chat_batch", fake_run_chat_batch)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("SAME")
+    (docs / "b.md").write_text("SAME")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+
+    orch.process_folder(docs, [p1], model="m", inplace=True, batch=True)
+
+    assert [len(r) for r in submitted] == [1]
+    assert (docs / "a.md").read_text() == "SAME[p1]"
+    assert (docs / "b.md").read_text() == "SAME[p1]"
+
+
+def test_process_folder_stream(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.cache import ResponseCache
+    from md_batch_gpt.manifest import Manifest
+
+    streamed = []
+
+    def fake_stream_prompt(prompt, content, model, max_tokens, on_chunk):
+        output = f"{content}[{prompt}]"
+        streamed.append(content)
+        for i in range(0, len(output), 3):
+            on_chunk(output[i : i + 3])
+        return output
+
+    monkeypatch.setattr(orch, "stream_prompt", fake_stream_prompt)
+
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("a.md", "b.md", "c.md", "d.md"):
+        (docs / name).write_text(name[0].upper() * 10)
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log_file = tmp_path / "log.txt"
+    manifest = Manifest(tmp_path / "log.txt.manifest")
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+
+    orch.process_folder(
+        docs,
+        [p1, p2],
+        model="m",
+        log_file=log_file,
+        concurrency=4,
+        stream=True,
+        manifest=manifest,
+        cache=cache,
+    )
+    manifest.close()
+
+    assert len(streamed) == 8
+    blocks = [b for b in log_file.read_text().split("\n---\n") if b.strip()]
+    assert len(blocks) == 8
+    for letter in "abcd":
+        text = letter.upper() * 10
+        assert f"=== {letter}.md | prompt: p1.txt ===\n{text}[p1]\n" in blocks
+        assert f"=== {letter}.md | prompt: p2.txt ===\n{text}[p1][p2]\n" in blocks
+    resumed = Manifest(tmp_path / "log.txt.manifest")
+    start, _ = resumed.resume_extraction(docs / "a.md", ["p1", "p2"], "A" * 10)
+    assert start == 2
+
+    # Cached passes are written as whole records
+    streamed.clear()
+    orch.process_folder(
+        docs, [p1], model="m", log_file=log_file, stream=True, cache=cache
+    )
+    assert streamed == []
+    assert log_file.read_text().endswith(
+        "=== d.md | prompt: p1.txt ===\nDDDDDDDDDD[p1]\n\n---\n"
+    )
+
+
+def test_process_queue(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.jobqueue import JobQueue
+    from md_batch_gpt.log_io import LogReader
+    from md_batch_gpt.manifest import Manifest
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        if content == "bad":
+            raise RuntimeError("boom")
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    for name in ("a", "b", "c", "bad"):
+        (tmp_path / f"{name}.md").write_text(name if name != "bad" else "bad")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    files = sorted(tmp_path.glob("*.md")) + [tmp_path / "missing.md"]
+    queue = JobQueue(tmp_path / "q.db")
+    queue.enqueue(files, [p1, p2])
+
+    log = tmp_path / "out.txt"
+    manifest = Manifest(Manifest.path_for(log))
+    completed = orch.process_queue(
+        queue,
+        model="m",
+        log_file=log,
+        concurrency=2,
+        manifest=manifest,
+        worker_id="w",
+        max_attempts=1,
+    )
+    manifest.close()
+
+    assert completed == 3
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 3, "failed": 2}
+    reader = LogReader(log)
+    outputs = sorted(r.output for r in reader.iter_records())
+    reader.close()
+    assert outputs == ["a[p1]", "a[p1][p2]", "b[p1]", "b[p1][p2]", "c[p1]", "c[p1][p2]"]
+    queue.close()
+
+
+def test_process_queue_retries_failed_pass(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.jobqueue import JobQueue
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        if len(calls) == 1:
+            raise RuntimeError("transient")
+        return content + "!"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    md = tmp_path / "a.md"
+    md.write_text("A")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    queue = JobQueue(tmp_path / "q.db")
+    queue.enqueue([md], [p1])
+
+    completed = orch.process_queue(
+        queue, model="m", log_file=tmp_path / "out.txt", max_attempts=3
+    )
+
+    assert completed == 1
+    assert calls == ["A", "A"]
+    assert queue.counts()["done"] == 1
+    queue.close()
+
+
+def test_process_queue_dedupes_across_jobs(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.jobqueue import JobQueue
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    files = [tmp_path / "a.md", tmp_path / "b.md"]
+    for md in files:
+        md.write_text("SAME")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    queue = JobQueue(tmp_path / "q.db")
+    queue.enqueue(files, [p1, p2])
+
+    log_file = tmp_path / "out.txt"
+    assert orch.process_queue(queue, model="m", log_file=log_file) == 2
+
+    assert calls == ["SAME", "SAME[p1]"]
+    assert log_file.read_text().count("SAME[p1][p2]") == 2
+    queue.close()
+
+
+def test_heartbeat_survives_errors(monkeypatch, tmp_path: Path, capsys):
+    orch = import_orchestrator()
+    from md_batch_gpt.jobqueue import JobQueue
+
+    queue = JobQueue(tmp_path / "q.db", lease=0.03)
+    beats = []
+
+    def flaky_heartbeat(worker, ids):
+        beats.append(ids)
+        if len(beats) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return len(ids)
+
+    monkeypatch.setattr(queue, "heartbeat", flaky_heartbeat)
+    leases = orch._Leases(queue, "w")
+    leases.add(1)
+    deadline = time.monotonic() + 5
+    while len(beats) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    leases.close()
+    queue.close()
+
+    assert len(beats) >= 3
+    assert "heartbeat failed: database is locked" in capsys.readouterr().err
+
+
+def test_process_queue_takes_over_expired_lease(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.jobqueue import JobQueue
+
+    monkeypatch.setattr(orch, "send_prompt", lambda p, c, m, t=None: c + "!")
+    md = tmp_path / "a.md"
+    md.write_text("A")
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    queue = JobQueue(tmp_path / "q.db", lease=0.2)
+    queue.enqueue([md], [p1])
+    # A worker that claimed the job and died
+    assert queue.claim("dead") is not None
+
+    completed = orch.process_queue(
+        queue, model="m", inplace=True, wait=True, poll_interval=0.05
+    )
+
+    assert completed == 1
+    assert md.read_text() == "A!"
+    assert queue.counts()["done"] == 1
+    queue.close()
+
+
+def test_process_folder_routes_and_fails_over(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    import httpx
+    from md_batch_gpt import openai_client
+    from md_batch_gpt.log_io import LogReader
+    from md_batch_gpt.routing import ModelRouter, RouteRule
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    busy = openai_client._sdk().RateLimitError(
+        "busy", response=httpx.Response(429, request=request), body=None
+    )
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append((content[:1], model))
+        if model == "big":
+            raise busy
+        return f"{content[:1]}[{model}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    (tmp_path / "a.md").write_text("a")
+    (tmp_path / "b.md").write_text("b" * 4000)
+    (tmp_path / "c.md").write_text("c" * 4000)
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    router = ModelRouter(
+        "big", [RouteRule("small", max_input_tokens=100)], fallback="backup"
+    )
+    log = tmp_path / "log.txt"
+
+    orch.process_folder(tmp_path, [p1], model="big", log_file=log, router=router)
+
+    with LogReader(log) as reader:
+        records = [(r.path[-4:], r.output, r.model) for r in reader.iter_records()]
+    assert records == [
+        ("a.md", "a[small]", "small"),
+        ("b.md", "b[backup]", "backup"),
+        ("c.md", "c[backup]", "backup"),
+    ]
+    assert calls == [
+        ("a", "small"),
+        ("b", "big"),
+        ("b", "backup"),
+        ("c", "big"),
+        ("c", "backup"),
+    ]
+
+
+def test_process_folder_plan(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.log_io import LogReader
+    from md_batch_gpt.manifest import Manifest
+
+    # The two chains of a file must be in flight together
+    barrier = threading.Barrier(2, timeout=5)
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append((prompt, content))
+        if prompt in ("p1", "p3"):
+            barrier.wait()
+        return f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("A")
+    prompts = []
+    for name in ("p1", "p2", "p3"):
+        prompts.append(tmp_path / f"{name}.txt")
+        prompts[-1].write_text(name)
+    log = tmp_path / "log.txt"
+    manifest = Manifest(Manifest.path_for(log))
+
+    plan = [[0, 1], [2]]
+    orch.process_folder(
+        docs, prompts, model="m", log_file=log, plan=plan, manifest=manifest
+    )
+
+    with LogReader(log) as reader:
+        records = [(r.prompt, r.output) for r in reader.iter_records()]
+    assert records == [
+        ("p1.txt", "A[p1]"),
+        ("p2.txt", "A[p1][p2]"),
+        ("p3.txt", "A[p3]"),
+    ]
+    # Resuming skips every finished chain
+    calls.clear()
+    orch.process_folder(
+        docs,
+        prompts,
+        model="m",
+        log_file=log,
+        plan=plan,
+        manifest=manifest,
+        resume=True,
+    )
+    manifest.close()
+    assert calls == []
+
+
+def test_process_folder_packs_small_files(monkeypatch, tmp_path: Path, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.log_io import LogReader
+
+    calls = []
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(content)
+        if not content.startswith("<<<FILE"):
+            return f"{content}[{prompt[:2]}]"
+        texts = [
+            block.split("\n")[1] for block in content.split("\n\n") if block.strip()
+        ]
+        if "bad" in texts:
+            return "not the contract"
+        results = [
+            f"<<<RESULT {n}>>>\n{t}[{prompt[:2]}]\n<<<END RESULT {n}>>>"
+            for n, t in enumerate(texts, 1)
+        ]
+        return "\n".join(results)
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name, text in [
+        ("a", "A"),
+        ("b", "B"),
+        ("c", "C" * 400),
+        ("d", "bad"),
+        ("e", "E"),
+    ]:
+        (docs / f"{name}.md").write_text(text)
+    p1 = tmp_path / "p1.txt"
+    p1.write_text("p1")
+    p2 = tmp_path / "p2.txt"
+    p2.write_text("p2")
+    log = tmp_path / "log.txt"
+
+    orch.process_folder(
+        docs,
+        [p1, p2],
+        model="m",
+        log_file=log,
+        pack_tokens=2,
+        pack_file_tokens=50,
+        dedupe=False,
+        verbose=True,
+    )
+
+    with LogReader(log) as reader:
+        records = {(r.path[-4:], r.prompt): r.output for r in reader.iter_records()}
+    assert records[("a.md", "p1.txt")] == "A[p1]"
+    assert records[("b.md", "p2.txt")] == "B[p1][p2]"
+    assert records[("c.md", "p2.txt")] == "C" * 400 + "[p1][p2]"
+    assert records[("d.md", "p2.txt")] == "bad[p1][p2]"
+    assert records[("e.md", "p2.txt")] == "E[p1][p2]"
+    assert len(records) == 10
+    packed = [c for c in calls if c.startswith("<<<FILE")]
+    # a+b packed for both passes; d+e packed, failed, then sent one by one
+    assert len(packed) == 3
+    assert "did not split" in capsys.readouterr().out
+
+
+def test_inplace_writes_once_and_resumes_from_kept_passes(monkeypatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    orch = import_orchestrator()
+    from md_batch_gpt.manifest import Manifest
+
+    calls = []
+    fail = {"p3"}
+
+    def fake_send_prompt(prompt, content, model, max_tokens=None):
+        calls.append(prompt)
+        if prompt in fail:
+            raise RuntimeError("down")
+        return content if prompt == "same" else f"{content}[{prompt}]"
+
+    monkeypatch.setattr(orch, "send_prompt", fake_send_prompt)
+    writes = []
+    real_write = orch.GroupedWriter.write
+
+    def counting_write(self, path, data, current=None):
+        writes.append(Path(path).name)
+        return real_write(self, path, data, current)
+
+    monkeypatch.setattr(orch.GroupedWriter, "write", counting_write)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    md = docs / "a.md"
+    md.write_text("A")
+    prompts = []
+    for name in ("p1", "p2", "p3"):
+        prompts.append(tmp_path / f"{name}.txt")
+        prompts[-1].write_text(name)
+    manifest_path = tmp_path / "log.txt.manifest"
+
+    def run(paths, **kwargs):
+        orch.process_folder(
+            docs,
+            paths,
+            model="m",
+            inplace=True,
+            manifest=Manifest(manifest_path),
+            resume=True,
+            **kwargs,
+        )
+
+    try:
+        run(prompts)
+    except RuntimeError:
+        pass
+    # Intermediate passes stay in memory: the crash left the file untouched
+    assert md.read_text() == "A"
+    assert writes == []
+
+    fail.clear()
+    calls.clear()
+    run(prompts)
+    assert calls == ["p3"]
+    assert md.read_text() == "A[p1][p2][p3]"
+    assert writes == ["a.md"]
+
+    same = tmp_path / "same.txt"
+    same.write_text("same")
+    before = md.stat().st_mtime_ns
+    run([same], verbose=True)
+    assert md.read_text() == "A[p1][p2][p3]"
+    assert md.stat().st_mtime_ns == before
+    assert writes == ["a.md", "a.md"]
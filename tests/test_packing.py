@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from md_batch_gpt.packing import FilePacker, pack_inputs, pack_prompt, split_outputs
+
+
+def test_pack_and_split_round_trip():
+    packed = pack_inputs(["# A\n", "B"])
+    assert (
+        packed
+        == "<<<FILE 1>>>\n# A\n<<<END FILE 1>>>\n\n<<<FILE 2>>>\nB\n<<<END FILE 2>>>"
+    )
+    assert pack_prompt("Summarise.\n").startswith("Summarise.\n\nThe input holds")
+    answer = (
+        "<<<RESULT 1>>>\nfirst\nline\n<<<END RESULT 1>>>\n"
+        "<<<RESULT 2>>>\n\n<<<END RESULT 2>>>\n"
+    )
+    assert split_outputs(answer, 2) == ["first\nline", ""]
+
+
+def test_split_rejects_answers_that_break_the_contract():
+    one = "<<<RESULT 1>>>\na\n<<<END RESULT 1>>>"
+    two = "<<<RESULT 2>>>\nb\n<<<END RESULT 2>>>"
+    assert split_outputs(one, 2) is None
+    assert split_outputs(two + one, 2) is None
+    assert split_outputs("Sure! " + one + two, 2) is None
+    assert split_outputs(one + one, 2) is None
+    assert split_outputs("<<<RESULT 1>>>\na\n<<<END RESULT 2>>>", 1) is None
+
+
+def test_file_packer_groups_small_files():
+    files = [
+        (Path(f"{i}.md"), "x" * size)
+        for i, size in enumerate([40, 40, 400, 40, 40, 40])
+    ]
+    groups = [
+        [p.name for p, _ in group] for (group,) in FilePacker(iter(files), 25, 20)
+    ]
+    # 10 tokens each: two fit the budget; the 100-token file goes out alone
+    # at once, without waiting for the group it interrupted
+    assert groups == [["2.md"], ["0.md", "1.md"], ["3.md", "4.md"], ["5.md"]]
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pytest
+
+from md_batch_gpt.plan import fanout_plan, parse_plan
+
+PROMPTS = [Path("prompts/01_extract.txt"), Path("prompts/02_sum.txt"), Path("03.txt")]
+
+
+def test_parse_plan():
+    text = """
+    # summaries build on the extraction
+    01_extract.txt -> prompts/02_sum.txt
+    03.txt
+    """
+    assert parse_plan(text, PROMPTS) == [[0, 1], [2]]
+    assert fanout_plan(3) == [[0], [1], [2]]
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("01_extract.txt -> 02_sum.txt -> 03.txt -> nope.txt", "unknown prompt"),
+        ("01_extract.txt -> 02_sum.txt\n03.txt -> 01_extract.txt", "used twice"),
+        ("01_extract.txt -> 02_sum.txt", "missing from the plan: 03.txt"),
+    ],
+)
+def test_parse_plan_errors(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_plan(text, PROMPTS)
@@ -0,0 +1,97 @@
+import httpx
+import openai
+import pytest
+
+from md_batch_gpt.ratelimit import (
+    RateLimiter,
+    backoff_delay,
+    estimate_tokens,
+    parse_duration,
+    retry_after,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("slow down", response=response, body=None)
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("") is None
+
+
+def test_estimate_tokens():
+    messages = [{"content": "a" * 40}, {"content": "b" * 40}]
+    assert estimate_tokens(messages, None) == 21
+    assert estimate_tokens(messages, 100) == 121
+
+
+def test_request_budget():
+    clock = FakeClock()
+    limiter = RateLimiter(rpm=2, clock=clock)
+    assert limiter.reserve(1) == 0
+    assert limiter.reserve(1) == 0
+    assert limiter.reserve(1) == pytest.approx(30)
+    clock.now = 30
+    assert limiter.reserve(1) == 0
+
+
+def test_token_budget():
+    clock = FakeClock()
+    limiter = RateLimiter(tpm=600, clock=clock)
+    assert limiter.reserve(500) == 0
+    assert limiter.reserve(200) == pytest.approx(10)
+    clock.now = 10
+    assert limiter.reserve(200) == 0
+
+
+def test_learns_limits_from_headers():
+    clock = FakeClock()
+    limiter = RateLimiter(tpm=1000, clock=clock)
+    limiter.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "5s",
+            "x-ratelimit-limit-tokens": "99999",
+        }
+    )
+    assert limiter.rpm == 60
+    # Explicit limits win over headers
+    assert limiter.tpm == 1000
+    assert limiter.reserve(1) == pytest.approx(5)
+
+
+def test_pause_blocks_all_callers():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock)
+    limiter.pause(3)
+    assert limiter.reserve(1) == pytest.approx(3)
+    clock.now = 3
+    assert limiter.reserve(1) == 0
+
+
+def test_retry_after_headers():
+    assert retry_after(rate_limit_error({"retry-after": "7"})) == 7
+    assert retry_after(rate_limit_error({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(rate_limit_error({})) is None
+    assert backoff_delay(0, rate_limit_error({"retry-after": "7"})) == 7
+
+
+def test_backoff_jitter_bounds():
+    exc = rate_limit_error({})
+    delays = [backoff_delay(3, exc) for _ in range(50)]
+    assert all(0 <= d <= 8 for d in delays)
+    assert len(set(delays)) > 1
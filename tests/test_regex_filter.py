@@ -0,0 +1,43 @@
+import json
+from pathlib import Path
+
+import pytest
+import typer
+
+from md_batch_gpt.regex_filter import RegexFilter
+
+DOC = "# Intro\nhello\n# Outcomes\nLearning outcome: x\n# Other\nbye\n"
+
+
+def write_patterns(tmp_path: Path, data) -> Path:
+    path = tmp_path / "regex.json"
+    path.write_text(json.dumps(data))
+    return path
+
+
+def test_empty_patterns_send_everything(tmp_path: Path):
+    regex = RegexFilter.load(write_patterns(tmp_path, {}))
+    assert regex.select(DOC) == DOC
+    assert (regex.skipped, regex.trimmed) == (0, 0)
+
+
+def test_select_matching_sections(tmp_path: Path):
+    regex = RegexFilter.load(
+        write_patterns(tmp_path, {"outcomes": "(?i)learning outcome"})
+    )
+    assert regex.select(DOC) == "# Outcomes\nLearning outcome: x\n"
+    assert regex.select(DOC, trim=False) == DOC
+    assert regex.select("# Nothing\nhere\n") is None
+    assert (regex.skipped, regex.trimmed) == (1, 1)
+    assert regex.summary() == "Regex filter: 1 skipped, 1 trimmed"
+
+
+def test_list_form(tmp_path: Path):
+    regex = RegexFilter.load(write_patterns(tmp_path, ["^# Other$", "hello"]))
+    assert regex.select(DOC) == "# Intro\nhello\n# Other\nbye\n"
+
+
+def test_invalid_pattern(tmp_path: Path, capsys):
+    with pytest.raises(typer.Exit):
+        RegexFilter.load(write_patterns(tmp_path, ["("]))
+    assert "Invalid regex JSON" in capsys.readouterr().err
@@ -0,0 +1,78 @@
+import pytest
+
+from md_batch_gpt.routing import ModelRouter, RouteRule
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_rules_pick_model_by_prompt_and_size():
+    router = ModelRouter(
+        "big",
+        [
+            RouteRule("tagger", prompts=("*_tag.txt",)),
+            RouteRule("small", max_input_tokens=100),
+        ],
+    )
+    assert router.choose("02_tag.txt", "x" * 10_000) == "tagger"
+    assert router.choose("01_extract.txt", "x" * 400) == "small"
+    assert router.choose("01_extract.txt", "x" * 404) == "big"
+    assert router.choose(None, "x") == "small"
+
+
+def test_slow_model_is_skipped_by_latency_rule():
+    router = ModelRouter("big", [RouteRule("fast", max_latency_s=1.0)])
+    assert router.choose("p.txt", "x") == "fast"
+    router.record_success("fast", 5.0)
+    assert router.choose("p.txt", "x") == "big"
+
+
+def test_failing_model_goes_to_fallback_until_cooldown():
+    clock = FakeClock()
+    router = ModelRouter(
+        "big",
+        fallback="backup",
+        fallbacks={"backup": "big"},
+        fail_after=2,
+        cooldown=30,
+        clock=clock,
+    )
+    assert router.fallback_for("big") == "backup"
+    router.record_failure("big")
+    router.record_success("big")
+    router.record_failure("big")
+    assert router.choose("p.txt", "x") == "big"
+    router.record_failure("big")
+    assert router.choose("p.txt", "x") == "backup"
+    clock.now += 31
+    assert router.choose("p.txt", "x") == "big"
+
+
+def test_from_config():
+    router = ModelRouter.from_config(
+        {
+            "fallback": "gpt-4.1-mini",
+            "fail_after": 1,
+            "rules": [
+                {"model": "gpt-4.1-nano", "prompts": "01_*", "max_input_tokens": 50}
+            ],
+        },
+        "o3",
+    )
+    assert router.rules == [
+        RouteRule("gpt-4.1-nano", prompts=("01_*",), max_input_tokens=50)
+    ]
+    assert (router.default, router.fallback, router.fail_after) == (
+        "o3",
+        "gpt-4.1-mini",
+        1,
+    )
+    with pytest.raises(ValueError):
+        ModelRouter.from_config({"rules": [{"max_input_tokens": 5}]}, "o3")
+    with pytest.raises(ValueError):
+        ModelRouter.from_config({"rules": [{"model": "m", "max_tokens": 5}]}, "o3")